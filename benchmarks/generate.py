@@ -0,0 +1,192 @@
+"""Builds a journal database full of synthetic entries for benchmarking
+
+    python -m benchmarks.generate --entries 100000 --output bench.sqlite3
+
+The tables come from dailyjournal.sql, then every migration is applied,
+so the result looks like a production database that has been running for
+a while. The same --seed always produces the same database.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+from database import migrate
+
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "dailyjournal.sql")
+
+MOODS = ["Happy", "Sad", "Angry", "Ok", "Hopeful", "Excited", "Humorous",
+         "Reflective", "Existential"]
+
+TAGS = ["Front-end", "Back-end", "Misc", "Database", "Testing", "DevOps", "Design",
+        "Career", "Debugging", "Performance", "Security", "Tooling", "Algorithms",
+        "Networking", "Documentation", "Pairing"]
+
+CONCEPTS = ["Python", "Javascript", "SQL", "React", "CSS", "HTML", "Git", "Django",
+            "Fetch", "Promises", "Closures", "Recursion", "Dictionaries", "Classes",
+            "Modules", "Sorting", "Regex", "Docker", "Testing", "HTTP", "JSON",
+            "Components", "Hooks", "State", "Routing", "Lists", "Loops", "Dates"]
+
+SENTENCES = [
+    "I learned about {concept} today.",
+    "{concept} finally clicked for me after {number} tries.",
+    "Spent the whole afternoon debugging {concept} and it was a {adjective} experience.",
+    "Why is {concept} so {adjective}? I keep getting {error} errors.",
+    "Paired with a classmate on {concept} and we shipped the {feature} feature.",
+    "{concept} would have been super helpful when building my {project}.",
+    "The docs for {concept} are {adjective}, but the examples help a lot.",
+    "Refactored the {feature} module to use {concept} instead of {other}.",
+    "I still don't get how {concept} and {other} fit together.",
+    "Today's lecture covered {concept} and {other}, which was {adjective}.",
+    "Wrote tests for the {feature} page and found {number} bugs.",
+    "Dealing with {concept} is {adjective}. It makes no sense yet.",
+]
+
+WORDS = {
+    "adjective": ["great", "terrible", "confusing", "fun", "tedious", "surprising",
+                  "clean", "messy", "exciting", "frustrating", "elegant", "weird"],
+    "error": ["TypeError", "KeyError", "undefined", "404", "CORS", "syntax",
+              "off-by-one", "null reference"],
+    "feature": ["login", "search", "journal", "profile", "dashboard", "checkout",
+                "comments", "settings", "calendar"],
+    "project": ["client capstone", "server capstone", "portfolio", "group project",
+                "side project"],
+}
+
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct",
+          "Nov", "Dec"]
+
+# How many tags an entry gets, and how likely each count is
+TAG_FAN_OUT = ([0, 1, 2, 3, 4, 5, 6], [15, 35, 25, 13, 7, 3, 2])
+
+
+def _names(base, count, prefix):
+    """The first `count` names of base, then numbered ones
+    """
+    return base[:count] + [f"{prefix} {number}" for number in range(len(base) + 1, count + 1)]
+
+
+def _js_date(timestamp):
+    """Formats a timestamp the way the client sends dates, e.g.
+    Wed Sep 15 2021 10:10:47
+    """
+    t = time.gmtime(timestamp)
+    return (f"{DAYS[t.tm_wday]} {MONTHS[t.tm_mon - 1]} {t.tm_mday:02d} {t.tm_year} "
+            f"{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}")
+
+
+def _entry_text(rng, concept):
+    sentences = []
+
+    for _ in range(rng.choices([1, 2, 3, 4, 6], [20, 35, 25, 15, 5])[0]):
+        template = rng.choice(SENTENCES)
+        sentences.append(template.format(
+            concept=concept,
+            other=rng.choice(CONCEPTS),
+            number=rng.randint(2, 12),
+            **{key: rng.choice(values) for (key, values) in WORDS.items()}))
+
+    return " ".join(sentences)
+
+
+def _create_schema(conn):
+    """Runs the CREATE TABLE statements of dailyjournal.sql, without its
+    sample rows
+    """
+    with open(SCHEMA_PATH) as schema:
+        statements = schema.read().split(";")
+
+    for statement in statements:
+        if statement.strip().upper().startswith("CREATE"):
+            conn.execute(statement)
+
+
+def generate(path, entries=10000, moods=9, tags=16, seed=1, days=3 * 365):
+    """Creates a database at path filled with synthetic journal data
+
+    Args:
+        path (string): the database file to create; it must not exist
+        entries (number): how many entries to write
+        moods (number): how many moods to create
+        tags (number): how many tags to create
+        seed (number): seeds the random generator
+        days (number): how many days the entry dates are spread over
+
+    Returns:
+        dict: how many rows of each kind were written
+    """
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists")
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+
+    try:
+        _create_schema(conn)
+
+        conn.executemany("INSERT INTO Moods (label) VALUES (?)",
+                         [(label, ) for label in _names(MOODS, moods, "Mood")])
+        conn.executemany("INSERT INTO Tags (name) VALUES (?)",
+                         [(name, ) for name in _names(TAGS, tags, "Tag")])
+
+        # A few tags and moods are far more popular than the rest
+        tag_weights = [1 / rank for rank in range(1, tags + 1)]
+        mood_weights = [1 / rank ** 0.5 for rank in range(1, moods + 1)]
+        concept_weights = [1 / rank ** 0.7 for rank in range(1, len(CONCEPTS) + 1)]
+
+        # Entries are written in date order, a few per day
+        start = time.time() - days * 86400
+        step = days * 86400 / max(entries, 1)
+        entry_tags = 0
+
+        for entry_id in range(1, entries + 1):
+            concept = rng.choices(CONCEPTS, concept_weights)[0]
+            timestamp = start + (entry_id - 1) * step + rng.uniform(0, step)
+
+            conn.execute(
+                "INSERT INTO Entries (id, concept, entry, date, mood_id) VALUES (?, ?, ?, ?, ?)",
+                (entry_id, concept, _entry_text(rng, concept), _js_date(timestamp),
+                 rng.choices(range(1, moods + 1), mood_weights)[0]))
+
+            count = min(rng.choices(*TAG_FAN_OUT)[0], tags)
+            chosen = set()
+
+            while len(chosen) < count:
+                chosen.add(rng.choices(range(1, tags + 1), tag_weights)[0])
+
+            conn.executemany("INSERT INTO Entrytags (entry_id, tag_id) VALUES (?, ?)",
+                             [(entry_id, tag_id) for tag_id in sorted(chosen)])
+            entry_tags += count
+
+        conn.commit()
+    finally:
+        conn.close()
+
+    # Builds the search index, indexes and date columns over the new rows
+    migrate(path)
+
+    return {"entries": entries, "moods": moods, "tags": tags, "entry_tags": entry_tags}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic journal database")
+    parser.add_argument("--output", default="bench.sqlite3")
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--moods", type=int, default=9)
+    parser.add_argument("--tags", type=int, default=16)
+    parser.add_argument("--days", type=int, default=3 * 365,
+                        help="how many days the entry dates are spread over")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate(args.output, args.entries, args.moods, args.tags, args.seed, args.days)
+    print(f"Wrote {counts} to {args.output} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Drives HTTP load at the server and reports latency percentiles
+
+    python -m benchmarks.load --database bench.sqlite3 --mode threaded
+    python -m benchmarks.load --url http://localhost:8088 --concurrency 64
+
+Without --url, request_handler.py is started with the given --mode
+against --database and stopped afterwards. Each client thread keeps one
+connection open and sends requests back to back, picking paths from a
+weighted mix of the front-end's requests, or with --mix write, of
+creates and updates.
+
+    python -m benchmarks.load --database bench.sqlite3 --mix write --group-commit
+"""
+import argparse
+import json
+import os
+import random
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from http.client import HTTPConnection, HTTPException
+from urllib.parse import urlsplit
+
+import config
+
+from .report import compare, save_results, summarize
+
+
+REQUEST_HANDLER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               "request_handler.py")
+
+# (name, method, path, weight). {id} is replaced by a random entry id.
+REQUEST_MIX = [
+    ("list_page", "GET", "/entries?limit=50", 30),
+    ("single_entry", "GET", "/entries/{id}", 30),
+    ("search", "GET", "/entries?q=python", 10),
+    ("tag_filter", "GET", "/entries?tag_id=1&limit=50", 10),
+    ("moods", "GET", "/moods", 8),
+    ("tags", "GET", "/tags", 8),
+    ("stats", "GET", "/stats?period=month", 4),
+]
+
+# Only writes, for measuring --group-commit. Every request commits, so
+# run it against a generated database.
+WRITE_MIX = [
+    ("create_entry", "POST", "/entries", 70),
+    ("update_entry", "PUT", "/entries/{id}", 30),
+]
+
+MIXES = {"read": REQUEST_MIX, "write": WRITE_MIX}
+
+# The body sent with POST and PUT
+WRITE_BODY = json.dumps({"concept": "Load", "entry": "Written by benchmarks.load",
+                         "date": "Mon Apr 11 2022 10:10:47", "moodId": 1, "tags": [1, 2]})
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(database, mode, threads, processes, group_commit=False):
+    """Starts request_handler.py on a free port
+
+    Returns:
+        tuple: (the process, the port it listens on)
+    """
+    port = _free_port()
+    command = [sys.executable, REQUEST_HANDLER, "--host", "127.0.0.1", "--port", str(port),
+               "--mode", mode, "--threads", str(threads), "--processes", str(processes)]
+
+    if group_commit:
+        command.append("--group-commit")
+
+    env = dict(os.environ, JOURNAL_DATABASE=database, JOURNAL_ACCESS_LOG=os.devnull)
+    process = subprocess.Popen(command, env=env)
+
+    deadline = time.monotonic() + 30
+
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with {process.returncode}")
+
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return (process, port)
+        except OSError:
+            time.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError("The server didn't start listening within 30 seconds")
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+class _Client(threading.Thread):
+    """Sends requests over one keep-alive connection until the deadline
+    """
+
+    def __init__(self, host, port, mix, max_id, seed, warmup_until, deadline):
+        super().__init__(daemon=True)
+        self.host = host
+        self.port = port
+        self.mix = mix
+        self.max_id = max_id
+        self.rng = random.Random(seed)
+        self.warmup_until = warmup_until
+        self.deadline = deadline
+        # name -> [seconds], name -> {status: count}
+        self.timings = {name: [] for (name, _, _, _) in mix}
+        self.statuses = {name: {} for (name, _, _, _) in mix}
+        self.errors = 0
+
+    def run(self):
+        names = [name for (name, _, _, _) in self.mix]
+        methods = [method for (_, method, _, _) in self.mix]
+        paths = [path for (_, _, path, _) in self.mix]
+        weights = [weight for (_, _, _, weight) in self.mix]
+        conn = HTTPConnection(self.host, self.port, timeout=30)
+
+        while True:
+            index = self.rng.choices(range(len(names)), weights)[0]
+            path = paths[index].replace("{id}", str(self.rng.randint(1, self.max_id)))
+
+            started = time.perf_counter()
+
+            if started >= self.deadline:
+                break
+
+            try:
+                if methods[index] == "GET":
+                    conn.request("GET", path)
+                else:
+                    conn.request(methods[index], path, WRITE_BODY,
+                                 {"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, HTTPException):
+                self.errors += 1
+                conn.close()
+                conn = HTTPConnection(self.host, self.port, timeout=30)
+                continue
+
+            elapsed = time.perf_counter() - started
+
+            # Requests during the warm-up fill caches and aren't counted
+            if started < self.warmup_until:
+                continue
+
+            name = names[index]
+            self.timings[name].append(elapsed)
+            self.statuses[name][status] = self.statuses[name].get(status, 0) + 1
+
+        conn.close()
+
+
+def run_load(host, port, concurrency, duration, warmup, max_id, mix=REQUEST_MIX, seed=1):
+    """Runs `concurrency` clients against a server for `duration` seconds
+
+    Returns:
+        dict: overall and per-request-kind latency figures
+    """
+    now = time.perf_counter()
+    clients = [_Client(host, port, mix, max_id, seed + number, now + warmup,
+                       now + warmup + duration)
+               for number in range(concurrency)]
+
+    for client in clients:
+        client.start()
+
+    for client in clients:
+        client.join()
+
+    results = {}
+    every = []
+
+    for (name, _, _, _) in mix:
+        timings = [timing for client in clients for timing in client.timings[name]]
+        statuses = {}
+
+        for client in clients:
+            for (status, count) in client.statuses[name].items():
+                statuses[str(status)] = statuses.get(str(status), 0) + count
+
+        results[name] = summarize(timings)
+        results[name]["requests_per_second"] = len(timings) / duration
+        results[name]["statuses"] = statuses
+        every.extend(timings)
+
+    results["all"] = summarize(every)
+    results["all"]["requests_per_second"] = len(every) / duration
+    results["all"]["errors"] = sum(client.errors for client in clients)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load driver for the journal server")
+    parser.add_argument("--url", help="a running server; by default one is started")
+    parser.add_argument("--database", default=config.DATABASE_PATH)
+    parser.add_argument("--mode", default="threaded",
+                        choices=["single", "threaded", "prefork", "asyncio"])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--group-commit", action="store_true",
+                        help="start the server with --group-commit")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="read",
+                        help="read: the front-end's GETs; write: only POST and PUT")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to measure")
+    parser.add_argument("--warmup", type=float, default=2.0,
+                        help="seconds of load before measuring")
+    parser.add_argument("--max-id", type=int, help="highest entry id to request")
+    parser.add_argument("--output", default="load.json")
+    parser.add_argument("--compare", help="an earlier --output file to check against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="how much slower counts as a regression, e.g. 0.1 for 10%%")
+    args = parser.parse_args()
+
+    max_id = args.max_id
+
+    if max_id is None:
+        conn = sqlite3.connect(args.database)
+        max_id = conn.execute("SELECT MAX(id) FROM Entries").fetchone()[0] or 1
+        conn.close()
+
+    process = None
+
+    if args.url:
+        url = urlsplit(args.url)
+        (host, port) = (url.hostname, url.port or 80)
+    else:
+        (process, port) = start_server(args.database, args.mode, args.threads,
+                                       args.processes, args.group_commit)
+        host = "127.0.0.1"
+
+    try:
+        results = run_load(host, port, args.concurrency, args.duration, args.warmup, max_id,
+                           MIXES[args.mix])
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    for (name, figures) in results.items():
+        print(f"{name:14} {figures['requests_per_second']:9.1f} req/s  "
+              f"p50 {figures['p50_ms']:8.2f}  p90 {figures['p90_ms']:8.2f}  "
+              f"p99 {figures['p99_ms']:8.2f} ms")
+
+    settings = {key: value for (key, value) in vars(args).items() if key != "compare"}
+    save_results(args.output, "load", settings, results)
+
+    if args.compare:
+        regressions = compare(args.compare, results, "p99_ms", args.threshold)
+
+        for (name, before, after) in regressions:
+            print(f"REGRESSION {name}: p99 {before:.2f} ms -> {after:.2f} ms")
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Times each views function against a database made by benchmarks.generate
+
+    python -m benchmarks.micro --database bench.sqlite3 --output micro.json
+    python -m benchmarks.micro --database bench.sqlite3 --compare micro.json
+
+Cached views functions are timed twice: through the cache, and through
+the function underneath it. The write benchmarks delete what they add,
+but they do change the database's ids and counters, so point this at a
+generated database rather than a real one.
+
+The serializer benchmarks build the JSON of 100,000 entries by default,
+the listing size the models are tuned for, so generate at least that many:
+
+    python -m benchmarks.generate --entries 100000 --output bench.sqlite3
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict
+
+import config
+from database import get_connection, migrate, query_stats, reset_query_stats
+from models import Moods, Tags, to_json
+from views import (get_all_entries, stream_all_entries, get_single_entry, delete_entry,
+                   search_entries, get_entries_by_ids, get_entry_changes, create_journal_entry,
+                   create_journal_entries, export_entries, update_entry, get_all_moods,
+                   get_all_tags, get_single_tag, get_tags_by_ids, get_entry_stats,
+                   build_entry_index)
+
+from .report import compare, save_results, summarize
+
+
+# The same word the original LIKE query in dailyjournal.sql looked for
+SEARCH_TERM = "python"
+
+
+def _new_entry(number):
+    return {"concept": "Benchmark", "entry": f"Benchmark entry number {number}",
+            "date": "Mon Apr 11 2022 10:10:47", "moodId": 1, "tags": [1, 2]}
+
+
+def like_search(term):
+    """The substring search /entries?q= ran before the full-text index,
+    kept as the baseline the index is measured against
+    """
+    with get_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.execute("""
+        SELECT e.id, e.concept, e.entry, e.date, e.mood_id
+        FROM Entries e
+        WHERE e.entry LIKE ?
+        """, (f"%{term}%", ))
+
+        return json.dumps([list(row) for row in db_cursor.fetchall()])
+
+
+def _consume(chunks):
+    for _ in chunks:
+        pass
+
+
+def _benchmarks(sample_id, last_id):
+    """The benchmarks, and a function that deletes the entries the write
+    benchmarks left behind
+
+    Args:
+        sample_id (number): an entry that exists, for the single-row reads
+        last_id (number): the highest entry id
+
+    Returns:
+        tuple: ([(name, function)], cleanup function)
+    """
+    middle = last_id // 2
+    created = []
+
+    def create():
+        created.append(json.loads(create_journal_entry(_new_entry(len(created))))["id"])
+
+    def update():
+        update_entry(created[-1] if created else sample_id, _new_entry(0))
+
+    def delete():
+        if created:
+            delete_entry(created.pop())
+
+    def cleanup():
+        while created:
+            delete_entry(created.pop())
+
+    benchmarks = [
+        ("get_all_entries", lambda: get_all_entries()),
+        ("get_all_entries_page", lambda: get_all_entries(limit=50, after=middle)),
+        ("get_all_entries_fields", lambda: get_all_entries(limit=1000, fields="id,concept,date")),
+        ("get_all_entries_tag_filter", lambda: get_all_entries(limit=100, tag_id="1")),
+        ("get_all_entries_date_range", lambda: get_all_entries(
+            limit=100, **{"from": "2000-01-01", "to": "2100-01-01"})),
+        ("stream_all_entries", lambda: _consume(stream_all_entries())),
+        ("export_entries", lambda: _consume(export_entries())),
+        ("get_single_entry", lambda: get_single_entry(sample_id)),
+        ("get_single_entry_uncached", lambda: get_single_entry.__wrapped__(sample_id)),
+        ("get_entries_by_ids", lambda: get_entries_by_ids(list(range(middle, middle + 100)))),
+        ("get_entry_changes", lambda: get_entry_changes(0, 100)),
+        ("search_entries", lambda: search_entries(SEARCH_TERM)),
+        ("like_search", lambda: like_search(SEARCH_TERM)),
+        ("get_all_moods", lambda: get_all_moods()),
+        ("get_all_moods_uncached", lambda: get_all_moods.__wrapped__()),
+        ("get_all_tags", lambda: get_all_tags()),
+        ("get_all_tags_uncached", lambda: get_all_tags.__wrapped__()),
+        ("get_single_tag", lambda: get_single_tag(1)),
+        ("get_single_tag_uncached", lambda: get_single_tag.__wrapped__(1)),
+        ("get_tags_by_ids", lambda: get_tags_by_ids([1, 2, 3, 4, 5])),
+        ("get_entry_stats_day", lambda: get_entry_stats("day")),
+        ("get_entry_stats_month", lambda: get_entry_stats("month")),
+        ("create_journal_entry", create),
+        ("update_entry", update),
+        ("delete_entry", delete),
+        ("create_journal_entries", lambda: created.extend(json.loads(
+            create_journal_entries([_new_entry(number) for number in range(100)]))["ids"])),
+    ]
+
+    return (benchmarks, cleanup)
+
+
+def run(function, min_time, max_calls):
+    """Calls function until it has run for min_time seconds or max_calls times
+
+    Returns:
+        dict: latency figures, calls per second, and the statements the
+        first call ran
+    """
+    reset_query_stats()
+    timings = []
+
+    started = time.perf_counter()
+    function()
+    timings.append(time.perf_counter() - started)
+    (queries, sql_time) = query_stats()
+
+    while sum(timings) < min_time and len(timings) < max_calls:
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+
+    figures = summarize(timings)
+    figures["calls_per_second"] = len(timings) / sum(timings) if sum(timings) else 0.0
+    figures["queries"] = queries
+    figures["sql_ms"] = sql_time * 1000
+
+    return figures
+
+
+def _load_documents(limit):
+    """The stored JSON documents whole-entry listings send
+    """
+    with get_connection() as conn:
+        return [document for (document, ) in conn.execute("""
+        SELECT d.document
+        FROM EntryDocuments d
+        ORDER BY d.entry_id
+        LIMIT ?
+        """, (limit, ))]
+
+
+def _load_projected(limit):
+    """Entries as `fields=` listings build them before serializing: a
+    dictionary per entry holding Moods and Tags models
+    """
+    with get_connection() as conn:
+        tags = {}
+
+        for (entry_id, tag_id, name) in conn.execute("""
+        SELECT et.entry_id, t.id, t.name
+        FROM Entrytags et
+        JOIN Tags t ON t.id = et.tag_id
+        WHERE et.entry_id IN (SELECT e.id FROM Entries e ORDER BY e.id LIMIT ?)
+        ORDER BY et.entry_id, et.tag_id
+        """, (limit, )):
+            tags.setdefault(entry_id, []).append(Tags(tag_id, name))
+
+        return [{"id": id, "concept": concept, "entry": entry, "date": date,
+                 "mood_id": mood_id, "mood": Moods(mood_id, label), "tags": tags.get(id, [])}
+                for (id, concept, entry, date, mood_id, label) in conn.execute("""
+                SELECT e.id, e.concept, e.entry, e.date, e.mood_id, m.label
+                FROM Entries e
+                JOIN Moods m ON m.id = e.mood_id
+                ORDER BY e.id
+                LIMIT ?
+                """, (limit, ))]
+
+
+def serializer_benchmarks(count):
+    """Time and peak memory of building the JSON of `count` entries the
+    ways responses are built: splicing the stored documents together
+    (whole entries), to_json() of the projected models (`fields=`), and
+    json.dumps() with asdict() as the baseline to_json() replaced
+
+    Returns:
+        dict: name -> figures
+    """
+    documents = _load_documents(count)
+    entries = _load_projected(count)
+    results = {}
+
+    for (name, items, function) in (
+            ("serialize_documents", documents, lambda: "[" + ", ".join(documents) + "]"),
+            ("serialize_to_json", entries, lambda: to_json(entries)),
+            ("serialize_asdict_dumps", entries, lambda: json.dumps(entries, default=asdict))):
+        tracemalloc.start()
+        started = time.perf_counter()
+        text = function()
+        elapsed = time.perf_counter() - started
+        (_, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        figures = run(function, 0.5, 50)
+        figures["entries"] = len(items)
+        figures["bytes"] = len(text.encode())
+        figures["peak_kib"] = peak / 1024
+        figures["traced_ms"] = elapsed * 1000
+        results[name] = figures
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the views functions")
+    parser.add_argument("--database", default=config.DATABASE_PATH)
+    parser.add_argument("--output", default="micro.json")
+    parser.add_argument("--min-time", type=float, default=1.0,
+                        help="seconds to keep calling each function")
+    parser.add_argument("--max-calls", type=int, default=1000)
+    parser.add_argument("--serialize", type=int, default=100000,
+                        help="entries in the serializer benchmarks, at most the "
+                             "database's own")
+    parser.add_argument("--only", help="run only benchmarks whose name contains this")
+    parser.add_argument("--compare", help="an earlier --output file to check against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="how much slower counts as a regression, e.g. 0.1 for 10%%")
+    args = parser.parse_args()
+
+    # Connections are opened lazily, so this takes effect for all of them
+    config.DATABASE_PATH = args.database
+    migrate()
+    build_entry_index()
+
+    with get_connection() as conn:
+        (sample_id, last_id) = conn.execute("SELECT MIN(id), MAX(id) FROM Entries").fetchone()
+
+    results = {}
+    (benchmarks, cleanup) = _benchmarks(sample_id, last_id)
+
+    try:
+        for (name, function) in benchmarks:
+            if args.only and args.only not in name:
+                continue
+
+            results[name] = run(function, args.min_time, args.max_calls)
+            print(f"{name:32} p50 {results[name]['p50_ms']:9.3f} ms  "
+                  f"queries {results[name]['queries']}")
+    finally:
+        cleanup()
+
+    if not args.only or "serialize" in args.only:
+        for (name, figures) in serializer_benchmarks(args.serialize).items():
+            results[name] = figures
+            print(f"{name:32} p50 {figures['p50_ms']:9.3f} ms  "
+                  f"peak {figures['peak_kib']:.0f} KiB")
+
+    settings = {key: value for (key, value) in vars(args).items() if key != "compare"}
+    save_results(args.output, "micro", settings, results)
+
+    if args.compare:
+        # Any extra statement per call is a regression, e.g. an N+1 query
+        # creeping back into get_all_entries
+        regressions = [("p50 ms", ) + regression for regression in
+                       compare(args.compare, results, "p50_ms", args.threshold)]
+        regressions += [("queries", ) + regression for regression in
+                        compare(args.compare, results, "queries", 0)]
+
+        for (figure, name, before, after) in regressions:
+            print(f"REGRESSION {name}: {figure} {before:g} -> {after:g}")
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import json
+import platform
+import sqlite3
+import subprocess
+import time
+
+
+def percentile(values, fraction):
+    """Returns the value below which `fraction` of the sorted values fall
+
+    Args:
+        values (list): sorted numbers
+        fraction (number): between 0 and 1, e.g. 0.99 for p99
+    """
+    if not values:
+        return 0.0
+
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summarize(seconds):
+    """Latency figures for a list of timings in seconds
+
+    Returns:
+        dict: count, mean and percentiles, in milliseconds
+    """
+    values = sorted(seconds)
+    count = len(values)
+
+    return {
+        "count": count,
+        "mean_ms": sum(values) / count * 1000 if count else 0.0,
+        "p50_ms": percentile(values, 0.50) * 1000,
+        "p90_ms": percentile(values, 0.90) * 1000,
+        "p99_ms": percentile(values, 0.99) * 1000,
+        "max_ms": values[-1] * 1000 if count else 0.0,
+    }
+
+
+def environment():
+    """What the results were measured on, so runs can be told apart
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+    }
+
+
+def save_results(path, kind, settings, results):
+    """Writes a benchmark run to a JSON file
+
+    Args:
+        path (string): the file to write
+        kind (string): which benchmark produced the results, e.g. "micro"
+        settings (dict): the options the run used
+        results (dict): benchmark name -> figures
+    """
+    with open(path, "w") as output:
+        json.dump({"benchmark": kind, "environment": environment(), "settings": settings,
+                   "results": results}, output, indent=2)
+
+
+def compare(previous_path, results, key, threshold):
+    """Lists the benchmarks that got slower than in an earlier run
+
+    Args:
+        previous_path (string): a JSON file written by save_results()
+        results (dict): the current results
+        key (string): the figure to compare, e.g. "p50_ms"
+        threshold (number): how much slower counts as a regression, e.g.
+            0.1 for 10%
+
+    Returns:
+        list: (name, before, after) for every regression
+    """
+    with open(previous_path) as previous:
+        before = json.load(previous)["results"]
+
+    regressions = []
+
+    for (name, figures) in results.items():
+        if name not in before or key not in figures or key not in before[name]:
+            continue
+
+        (old, new) = (before[name][key], figures[key])
+
+        if old > 0 and new > old * (1 + threshold):
+            regressions.append((name, old, new))
+
+    return regressions
@@ -0,0 +1,79 @@
+import os
+
+# Settings can be overridden with environment variables so the same code
+# can run against a scratch database or with different SQLite tuning.
+
+# Path of the SQLite database file
+DATABASE_PATH = os.environ.get("JOURNAL_DATABASE", "./dailyjournal.sqlite3")
+
+# PRAGMAs applied to every pooled connection when it is opened
+SQLITE_JOURNAL_MODE = os.environ.get("JOURNAL_SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("JOURNAL_SQLITE_SYNCHRONOUS", "NORMAL")
+# Bytes of the database file to memory map
+SQLITE_MMAP_SIZE = int(os.environ.get("JOURNAL_SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+# Negative values are KiB, positive values are pages (see PRAGMA cache_size)
+SQLITE_CACHE_SIZE = int(os.environ.get("JOURNAL_SQLITE_CACHE_SIZE", -16000))
+# Prepared statements each connection keeps for reuse
+SQLITE_CACHED_STATEMENTS = int(os.environ.get("JOURNAL_SQLITE_CACHED_STATEMENTS", 256))
+# Seconds to wait for a lock held by another connection
+SQLITE_BUSY_TIMEOUT = float(os.environ.get("JOURNAL_SQLITE_BUSY_TIMEOUT", 5.0))
+
+# In-process cache of serialized GET responses (see views/cache.py)
+CACHE_MAX_ENTRIES = int(os.environ.get("JOURNAL_CACHE_MAX_ENTRIES", 1024))
+# Seconds a cached response is served before it's read again. This also
+# bounds how stale a response can be after a write made by another process.
+CACHE_TTL = float(os.environ.get("JOURNAL_CACHE_TTL", 60))
+
+# Entries inserted per executemany() call by POST /entries/bulk
+BULK_BATCH_SIZE = int(os.environ.get("JOURNAL_BULK_BATCH_SIZE", 500))
+
+# Where the access log is written, "-" for stderr
+ACCESS_LOG = os.environ.get("JOURNAL_ACCESS_LOG", "-")
+# Lines held before they are written out together
+ACCESS_LOG_BUFFER = int(os.environ.get("JOURNAL_ACCESS_LOG_BUFFER", 256))
+# Seconds a line may wait in the buffer on a quiet server
+ACCESS_LOG_FLUSH_INTERVAL = float(os.environ.get("JOURNAL_ACCESS_LOG_FLUSH_INTERVAL", 1.0))
+
+# Responses are compressed when the client sends Accept-Encoding, using
+# brotli or zstd when their packages are installed and gzip otherwise.
+# Bodies smaller than this many bytes are sent as they are.
+COMPRESSION_MIN_SIZE = int(os.environ.get("JOURNAL_COMPRESSION_MIN_SIZE", 1024))
+# 1 (fastest) to 9 (smallest)
+GZIP_LEVEL = int(os.environ.get("JOURNAL_GZIP_LEVEL", 6))
+# 0 (fastest) to 11 (smallest)
+BROTLI_QUALITY = int(os.environ.get("JOURNAL_BROTLI_QUALITY", 5))
+# 1 (fastest) to 22 (smallest)
+ZSTD_LEVEL = int(os.environ.get("JOURNAL_ZSTD_LEVEL", 3))
+# Compressed bodies of unchanged resources are kept so polling clients
+# don't cost a recompression each time
+COMPRESSION_CACHE_BYTES = int(os.environ.get("JOURNAL_COMPRESSION_CACHE_BYTES", 32 * 1024 * 1024))
+# Larger bodies are compressed on every request instead of being cached
+COMPRESSION_CACHE_MAX_BODY = int(os.environ.get("JOURNAL_COMPRESSION_CACHE_MAX_BODY",
+                                                4 * 1024 * 1024))
+
+# Send entry writes through one thread that commits them in batches
+# (see views/write_queue.py), also turned on with --group-commit
+WRITE_QUEUE = os.environ.get("JOURNAL_WRITE_QUEUE", "") not in ("", "0")
+# Most writes committed in one transaction
+WRITE_QUEUE_MAX_BATCH = int(os.environ.get("JOURNAL_WRITE_QUEUE_MAX_BATCH", 64))
+# Seconds the first write of a batch waits for others to join it
+WRITE_QUEUE_MAX_DELAY = float(os.environ.get("JOURNAL_WRITE_QUEUE_MAX_DELAY", 0.002))
+
+# Seconds tombstones of deleted entries stay in the change log behind
+# GET /entries/changes before database/compaction.py drops them. Clients
+# that haven't synced for longer have to start over from since=0.
+CHANGE_LOG_RETENTION = float(os.environ.get("JOURNAL_CHANGE_LOG_RETENTION", 30 * 24 * 60 * 60))
+
+# Serve GET requests from an in-memory copy of the database (see
+# database/replica.py), also turned on with --replica
+REPLICA = os.environ.get("JOURNAL_REPLICA", "") not in ("", "0")
+# Most seconds between checks of the database for changes to copy. Writes
+# made by this process are copied sooner.
+REPLICA_MAX_STALENESS = float(os.environ.get("JOURNAL_REPLICA_MAX_STALENESS", 1.0))
+# Fewest seconds between two copies while writes keep coming in
+REPLICA_MIN_INTERVAL = float(os.environ.get("JOURNAL_REPLICA_MIN_INTERVAL", 0.5))
+
+# With --profile, the share of requests that are profiled with cProfile,
+# and how often in seconds the samples are written out
+PROFILE_SAMPLE_RATE = float(os.environ.get("JOURNAL_PROFILE_SAMPLE_RATE", 0.1))
+PROFILE_DUMP_INTERVAL = float(os.environ.get("JOURNAL_PROFILE_DUMP_INTERVAL", 30.0))
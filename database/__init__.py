@@ -0,0 +1,7 @@
+from .connection import (get_connection, close_connection, pool_stats, query_stats,
+                         reset_query_stats, primary_connection, use_replica, prepare,
+                         warm_up)
+from .dates import to_epoch
+from .migrations import migrate
+from .replica import start_replica, replica_changed, replica_stats
+from .versions import get_resource_version, read_version
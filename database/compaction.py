@@ -0,0 +1,141 @@
+import argparse
+import sqlite3
+import time
+
+import config
+from .migrations import DELETE_DUPLICATE_ENTRY_TAGS, migrate
+
+
+def _database_size(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+
+    return page_size * page_count
+
+
+def compact_entry_changes(conn, retention):
+    """Drops tombstones older than `retention` seconds from EntryChanges
+
+    The newest version dropped becomes the horizon: GET /entries/changes
+    answers 410 to a client that synced before it, since it could have
+    missed a delete. Call it inside a transaction.
+
+    Args:
+        conn (sqlite3.Connection): the connection to write with
+        retention (number): seconds a tombstone is kept
+
+    Returns:
+        number: how many tombstones were dropped
+    """
+    cutoff = int(time.time() - retention)
+
+    horizon = conn.execute("""
+    SELECT MAX(c.version)
+    FROM EntryChanges c
+    WHERE c.deleted = 1 AND c.changed < ?
+    """, (cutoff, )).fetchone()[0]
+
+    if horizon is None:
+        return 0
+
+    conn.execute("""
+    UPDATE EntryChangesHorizon
+    SET version = MAX(version, ?)
+    """, (horizon, ))
+
+    return conn.execute("""
+    DELETE FROM EntryChanges
+    WHERE deleted = 1 AND version <= ?
+    """, (horizon, )).rowcount
+
+
+def compact(path=None, change_retention=None):
+    """Removes duplicate and orphaned Entrytags rows and old change log
+    tombstones, and shrinks the file
+
+    Duplicate links are left over from the old update_entry, and links to
+    deleted entries from the old delete_entry. After removing them the
+    schema is brought up to date, tombstones older than change_retention
+    are dropped and the database is rebuilt with VACUUM, which hands the
+    freed pages back to the file system.
+
+    VACUUM needs to rewrite the whole file, so run this while the server
+    is stopped.
+
+    Args:
+        path (string): the database file, config.DATABASE_PATH by default
+        change_retention (number): seconds tombstones are kept,
+            config.CHANGE_LOG_RETENTION by default
+
+    Returns:
+        dict: the rows removed and the file size before and after, in bytes
+    """
+    path = path or config.DATABASE_PATH
+
+    if change_retention is None:
+        change_retention = config.CHANGE_LOG_RETENTION
+
+    conn = sqlite3.connect(path, isolation_level=None)
+
+    try:
+        size_before = _database_size(conn)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            duplicates = conn.execute(DELETE_DUPLICATE_ENTRY_TAGS).rowcount
+            orphans = conn.execute("""
+            DELETE FROM Entrytags
+            WHERE entry_id NOT IN (SELECT id FROM Entries)
+            """).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        migrate(path)
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            tombstones = compact_entry_changes(conn, change_retention)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        conn.execute("VACUUM")
+        # Fold the WAL back into the file so the size below is the real one
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size_after = _database_size(conn)
+    finally:
+        conn.close()
+
+    return {
+        "duplicate_entry_tags": duplicates,
+        "orphaned_entry_tags": orphans,
+        "change_tombstones": tombstones,
+        "size_before": size_before,
+        "size_after": size_after,
+        "reclaimed": size_before - size_after,
+    }
+
+
+def main():
+    """python -m database.compaction [--database PATH] [--change-retention SECONDS]
+    """
+    parser = argparse.ArgumentParser(description="Compact the journal database")
+    parser.add_argument("--database", default=config.DATABASE_PATH)
+    parser.add_argument("--change-retention", type=float, default=config.CHANGE_LOG_RETENTION,
+                        help="seconds tombstones are kept in the change log")
+    args = parser.parse_args()
+
+    result = compact(args.database, args.change_retention)
+
+    print(f"Removed {result['duplicate_entry_tags']} duplicate and "
+          f"{result['orphaned_entry_tags']} orphaned Entrytags rows")
+    print(f"Dropped {result['change_tombstones']} change log tombstones")
+    print(f"{result['size_before']} bytes -> {result['size_after']} bytes, "
+          f"reclaimed {result['reclaimed']} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import mmap
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+
+
+# Each thread keeps its own connection for as long as it lives. sqlite3
+# connections can't be shared between threads, but a worker thread can
+# reuse one connection for every request it serves.
+_local = threading.local()
+
+# The in-memory read replica, set by database/replica.py when running
+_replica = None
+
+# Functions that run a module's hot statements on each new connection,
+# registered with @prepare
+_prepared = []
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _count_query(started):
+    _local.queries = getattr(_local, "queries", 0) + 1
+    _local.sql_time = getattr(_local, "sql_time", 0.0) + time.perf_counter() - started
+
+
+class TimedCursor(sqlite3.Cursor):
+    """A cursor that adds the time spent in SQLite to its thread's counters
+
+    Rows read by iterating the cursor aren't timed one by one, that would
+    slow down every streamed listing. SQLite finds the first row inside
+    execute(), so only the work for the rows after it is left out.
+    """
+
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _count_query(started)
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _count_query(started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _local.sql_time = getattr(_local, "sql_time", 0.0) + time.perf_counter() - started
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _local.sql_time = getattr(_local, "sql_time", 0.0) + time.perf_counter() - started
+
+
+class TimedConnection(sqlite3.Connection):
+    """A connection whose cursors are TimedCursors
+
+    Connection.execute() doesn't go through cursor(), so it's timed here too.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+
+def reset_query_stats():
+    """Starts counting queries for a new request on the calling thread
+    """
+    _local.queries = 0
+    _local.sql_time = 0.0
+
+
+def query_stats():
+    """Returns what the calling thread has run since reset_query_stats()
+
+    Returns:
+        tuple: (number of statements, seconds spent in SQLite)
+    """
+    return (getattr(_local, "queries", 0), getattr(_local, "sql_time", 0.0))
+
+
+@contextmanager
+def uncounted():
+    """Leaves the statements run inside the block out of the calling
+    thread's query_stats()
+
+    Opening a connection runs PRAGMAs and the @prepare statements, which
+    belong to no route, so they would make a thread's first request look
+    like it ran more queries than the same request does later.
+    """
+    (queries, sql_time) = query_stats()
+
+    try:
+        yield
+    finally:
+        _local.queries = queries
+        _local.sql_time = sql_time
+
+
+def prepare(func):
+    """Registers a function that runs a module's hot statements once on
+    every new connection
+
+    sqlite3 keeps the statements a connection has run prepared, keyed by
+    their SQL text, up to config.SQLITE_CACHED_STATEMENTS of them. Running
+    the hot ones up front, with arguments that match nothing, means the
+    first request a thread serves doesn't pay for compiling them.
+
+    Args:
+        func (function): called with the new connection
+    """
+    _prepared.append(func)
+    return func
+
+
+def prepare_statements(conn):
+    """Runs every function registered with @prepare on a connection
+    """
+    for func in _prepared:
+        try:
+            func(conn)
+        except sqlite3.OperationalError:
+            # A database that isn't migrated yet lacks some tables
+            pass
+
+
+def warm_up(path=None):
+    """Reads the database file into the OS page cache through mmap
+
+    A server that has just started would otherwise wait for the disk on
+    the first reads of every page. Only the part SQLite itself maps,
+    config.SQLITE_MMAP_SIZE bytes, is read. Where madvise(MADV_WILLNEED)
+    is available the kernel reads it in the background; elsewhere every
+    page is read here.
+
+    Args:
+        path (string): the database file, config.DATABASE_PATH by default
+
+    Returns:
+        number: how many bytes of the file were covered
+    """
+    with open(path or config.DATABASE_PATH, "rb") as file:
+        length = min(os.fstat(file.fileno()).st_size, config.SQLITE_MMAP_SIZE)
+
+        if length == 0:
+            return 0
+
+        with mmap.mmap(file.fileno(), length, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mmap, "MADV_WILLNEED"):
+                # Has the kernel read the pages in, without waiting for it
+                mapped.madvise(mmap.MADV_WILLNEED)
+            else:
+                # Reading one byte of a page faults the whole page in;
+                # the byte itself isn't needed
+                for offset in range(0, length, mmap.PAGESIZE):
+                    mapped[offset]
+
+    return length
+
+
+def _open_connection():
+    conn = sqlite3.connect(config.DATABASE_PATH, timeout=config.SQLITE_BUSY_TIMEOUT,
+                           factory=TimedConnection,
+                           cached_statements=config.SQLITE_CACHED_STATEMENTS)
+
+    with uncounted():
+        conn.execute(f"PRAGMA journal_mode = {config.SQLITE_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous = {config.SQLITE_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA mmap_size = {config.SQLITE_MMAP_SIZE:d}")
+        conn.execute(f"PRAGMA cache_size = {config.SQLITE_CACHE_SIZE:d}")
+
+        prepare_statements(conn)
+
+    return conn
+
+
+def use_replica(enabled):
+    """Sends the calling thread's get_connection() calls to the read
+    replica, when one is running, until this is called again
+
+    The server calls it at the start of every request, with True for GETs.
+
+    Args:
+        enabled (boolean): whether the thread's next reads may be served
+            by the replica
+    """
+    _local.use_replica = enabled
+
+    if enabled and _replica is not None:
+        _replica.pin()
+
+
+def get_connection():
+    """Returns the calling thread's connection, opening it on first use
+
+    Use it the same way as sqlite3.connect():
+
+        with get_connection() as conn:
+            ...
+
+    The with block commits or rolls back, but the connection stays open
+    for the next request served by the same thread.
+
+    On a thread serving a GET with the read replica running, the
+    connection is to the replica instead (see use_replica()).
+
+    Returns:
+        sqlite3.Connection: the connection owned by the current thread
+    """
+    if _replica is not None and getattr(_local, "use_replica", False):
+        return _replica.connection()
+
+    return primary_connection()
+
+
+def primary_connection():
+    """Returns the calling thread's connection to the database file, even
+    while it is serving a request from the read replica
+
+    Returns:
+        sqlite3.Connection: the connection owned by the current thread
+    """
+    conn = getattr(_local, "conn", None)
+
+    # A connection inherited through fork() belongs to the parent process
+    if conn is not None and _local.pid == os.getpid():
+        with _stats_lock:
+            _stats["hits"] += 1
+        return conn
+
+    conn = _open_connection()
+    _local.conn = conn
+    _local.pid = os.getpid()
+
+    with _stats_lock:
+        _stats["misses"] += 1
+
+    return conn
+
+
+def close_connection():
+    """Closes the calling thread's connection, if it has one
+    """
+    conn = getattr(_local, "conn", None)
+
+    if conn is None:
+        return
+
+    _local.conn = None
+
+    if _local.pid == os.getpid():
+        conn.close()
+
+
+def pool_stats():
+    """Returns the pool's hit/miss counters
+
+    Returns:
+        dict: hits, misses (connections opened) and the hit rate
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+
+    requests = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / requests if requests else 0.0
+
+    return stats
@@ -0,0 +1,45 @@
+import re
+from datetime import datetime, timezone
+
+
+# The front end sends dates as JavaScript's Date.toString() does, e.g.
+# "Mon Apr 11 2022 10:10:47 GMT-0500 (Central Daylight Time)". Older rows
+# only have "Mon Apr 11 2022 10:10:47".
+JS_DATE = re.compile(
+    r"^\w{3} (\w{3} \d{1,2} \d{4} \d{1,2}:\d{2}:\d{2})(?: GMT([+-]\d{4}))?")
+
+
+def to_epoch(value):
+    """Converts a date as stored in Entries.date into a Unix timestamp
+
+    Understands the JavaScript Date.toString() format the front end sends,
+    ISO 8601 dates and times, and plain Unix timestamps. Times without an
+    offset are taken to be UTC.
+
+    Args:
+        value (string): the date text
+
+    Returns:
+        number: seconds since the epoch, or None if the text isn't a date
+    """
+    text = str(value).strip()
+
+    if re.fullmatch(r"-?\d+", text):
+        return int(text)
+
+    match = JS_DATE.match(text)
+
+    try:
+        if match:
+            (moment, offset) = match.groups()
+            parsed = datetime.strptime(f"{moment} {offset or '+0000'}",
+                                       "%b %d %Y %H:%M:%S %z")
+        else:
+            parsed = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+
+    return int(parsed.timestamp())
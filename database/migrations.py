@@ -0,0 +1,344 @@
+import sqlite3
+
+import config
+from .dates import to_epoch
+
+
+# Schema changes applied on top of dailyjournal.sql, in order. The number
+# of migrations already applied is kept in the database's user_version, so
+# each one runs exactly once per database file. Only ever append to this
+# list; never edit or reorder a migration that has shipped.
+MIGRATIONS = []
+
+# Keeps the first of each set of identical (entry_id, tag_id) links. Also
+# used by database/compaction.py.
+DELETE_DUPLICATE_ENTRY_TAGS = """
+DELETE FROM Entrytags
+WHERE id NOT IN (
+    SELECT MIN(id)
+    FROM Entrytags
+    GROUP BY entry_id, tag_id
+)
+"""
+
+
+def migration(func):
+    """Registers a function as the next migration
+    """
+    MIGRATIONS.append(func)
+    return func
+
+
+@migration
+def add_entries_search_index(conn):
+    """Full-text index over Entries.concept and Entries.entry
+
+    EntriesSearch is an external content FTS5 table: it stores only the
+    index and reads the text from Entries, and triggers keep it in step
+    with every insert, update and delete.
+    """
+    conn.execute("""
+    CREATE VIRTUAL TABLE EntriesSearch USING fts5(
+        concept,
+        entry,
+        content = 'Entries',
+        content_rowid = 'id',
+        tokenize = 'porter unicode61'
+    )
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER entries_search_insert AFTER INSERT ON Entries BEGIN
+        INSERT INTO EntriesSearch (rowid, concept, entry)
+        VALUES (new.id, new.concept, new.entry);
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER entries_search_delete AFTER DELETE ON Entries BEGIN
+        INSERT INTO EntriesSearch (EntriesSearch, rowid, concept, entry)
+        VALUES ('delete', old.id, old.concept, old.entry);
+    END
+    """)
+
+    conn.execute("""
+    CREATE TRIGGER entries_search_update AFTER UPDATE OF concept, entry ON Entries BEGIN
+        INSERT INTO EntriesSearch (EntriesSearch, rowid, concept, entry)
+        VALUES ('delete', old.id, old.concept, old.entry);
+        INSERT INTO EntriesSearch (rowid, concept, entry)
+        VALUES (new.id, new.concept, new.entry);
+    END
+    """)
+
+    # Index the entries that already exist
+    conn.execute("INSERT INTO EntriesSearch (EntriesSearch) VALUES ('rebuild')")
+
+
+@migration
+def add_resource_versions(conn):
+    """Per-resource write counters used for ETag and Last-Modified headers
+
+    Triggers bump the counter of every resource whose responses a write
+    can change. Entries embed mood labels and tag names, so writes to
+    Moods and Tags bump entries as well.
+    """
+    conn.execute("""
+    CREATE TABLE ResourceVersions (
+        `resource`  TEXT NOT NULL PRIMARY KEY,
+        `version`   INTEGER NOT NULL,
+        `modified`  INTEGER NOT NULL
+    )
+    """)
+
+    conn.execute("""
+    INSERT INTO ResourceVersions
+    VALUES
+        ('entries', 1, CAST(strftime('%s', 'now') AS INTEGER)),
+        ('moods', 1, CAST(strftime('%s', 'now') AS INTEGER)),
+        ('tags', 1, CAST(strftime('%s', 'now') AS INTEGER))
+    """)
+
+    affected = {
+        "Entries": "'entries'",
+        "Entrytags": "'entries'",
+        "Moods": "'entries', 'moods'",
+        "Tags": "'entries', 'tags'",
+    }
+
+    for (table, resources) in affected.items():
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+            CREATE TRIGGER {table.lower()}_version_{event.lower()}
+            AFTER {event} ON {table} BEGIN
+                UPDATE ResourceVersions
+                SET version = version + 1,
+                    modified = CAST(strftime('%s', 'now') AS INTEGER)
+                WHERE resource IN ({resources});
+            END
+            """)
+
+
+@migration
+def add_lookup_indexes(conn):
+    """Indexes for the lookups and joins the views run on every request
+
+    (entry_id, tag_id) covers loading the tags of entries in entry order,
+    (tag_id, entry_id) covers finding the entries of a tag, and the
+    Entries indexes serve filtering by mood and ordering by date.
+    """
+    conn.execute("CREATE INDEX entrytags_entry_id ON Entrytags (entry_id, tag_id)")
+    conn.execute("CREATE INDEX entrytags_tag_id ON Entrytags (tag_id, entry_id)")
+    conn.execute("CREATE INDEX entries_mood_id ON Entries (mood_id)")
+    conn.execute("CREATE INDEX entries_date ON Entries (date)")
+
+    # Give the query planner statistics for the new indexes
+    conn.execute("ANALYZE")
+
+
+@migration
+def add_entry_date_epoch(conn):
+    """A sortable copy of Entries.date as a Unix timestamp
+
+    Entries.date is free text such as "Mon Apr 11 2022 10:10:47", which
+    can't be compared or indexed usefully. date_epoch holds the same moment
+    as seconds since the epoch, or NULL when the text isn't a date. The
+    write paths in views/entry_requests.py keep it up to date.
+    """
+    conn.execute("ALTER TABLE Entries ADD COLUMN date_epoch INTEGER")
+
+    rows = conn.execute("SELECT id, date FROM Entries").fetchall()
+    conn.executemany("UPDATE Entries SET date_epoch = ? WHERE id = ?",
+                     [(to_epoch(date), id) for (id, date) in rows])
+
+    # Text dates in this format don't sort, so their index never helped
+    conn.execute("DROP INDEX entries_date")
+    conn.execute("CREATE INDEX entries_date_epoch ON Entries (date_epoch)")
+
+
+def migrate(path=None):
+    """Applies every migration the database hasn't seen yet
+
+    Each migration runs in its own transaction together with the
+    user_version bump, so a failure leaves the database at the last
+    migration that completed.
+
+    Args:
+        path (string): the database file, config.DATABASE_PATH by default
+
+    Returns:
+        number: how many migrations were applied
+    """
+    conn = sqlite3.connect(path or config.DATABASE_PATH, isolation_level=None)
+
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+        for number, func in enumerate(MIGRATIONS[version:], start=version + 1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                func(conn)
+                conn.execute(f"PRAGMA user_version = {number:d}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        return max(len(MIGRATIONS) - version, 0)
+    finally:
+        conn.close()
+
+
+@migration
+def add_unique_entry_tags(conn):
+    """Each tag can be linked to an entry only once
+
+    update_entry used to insert every tag again on each PUT, so Entrytags
+    holds duplicates. The oldest copy of each link is kept. The unique
+    index replaces entrytags_entry_id, which covered the same columns.
+    """
+    conn.execute(DELETE_DUPLICATE_ENTRY_TAGS)
+    conn.execute("DROP INDEX entrytags_entry_id")
+    conn.execute("CREATE UNIQUE INDEX entrytags_entry_tag ON Entrytags (entry_id, tag_id)")
+
+
+@migration
+def add_entry_changes(conn):
+    """A change log of entries for GET /entries/changes
+
+    Each entry has one row, holding the version of its latest change;
+    every change replaces the row and takes a new, higher version from
+    AUTOINCREMENT. A client that has synced up to some version only needs
+    the rows after it, so syncing costs as much as what changed since,
+    not the size of the journal. Deleted entries keep a tombstone row
+    until database/compaction.py drops it. EntryChangesHorizon records the
+    newest tombstone dropped: a client behind it has to sync from scratch.
+
+    Changes to an entry's tags count as changes to the entry, as do new
+    labels for its mood or tags, since its document embeds them.
+    """
+    conn.execute("""
+    CREATE TABLE EntryChanges (
+        `version`   INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        `entry_id`  INTEGER NOT NULL UNIQUE,
+        `deleted`   INTEGER NOT NULL,
+        `changed`   INTEGER NOT NULL
+    )
+    """)
+
+    conn.execute("CREATE TABLE EntryChangesHorizon (`version` INTEGER NOT NULL)")
+    conn.execute("INSERT INTO EntryChangesHorizon VALUES (0)")
+
+    # Every existing entry is a change since version 0
+    conn.execute("""
+    INSERT INTO EntryChanges (entry_id, deleted, changed)
+    SELECT e.id, 0, CAST(strftime('%s', 'now') AS INTEGER)
+    FROM Entries e
+    ORDER BY e.id
+    """)
+
+    def record(entry_ids, deleted):
+        # REPLACE deletes the entry's previous row, so the log never holds
+        # more than one row per entry
+        return f"""
+        INSERT OR REPLACE INTO EntryChanges (entry_id, deleted, changed)
+        SELECT id, {deleted:d}, CAST(strftime('%s', 'now') AS INTEGER)
+        FROM ({entry_ids});
+        """
+
+    triggers = {
+        "entries_changes_insert": ("AFTER INSERT ON Entries",
+                                   record("SELECT new.id id", False)),
+        "entries_changes_update": ("AFTER UPDATE ON Entries",
+                                   record("SELECT new.id id", False)),
+        "entries_changes_delete": ("AFTER DELETE ON Entries",
+                                   record("SELECT old.id id", True)),
+        # Links removed along with a deleted entry mustn't bring it back
+        "entrytags_changes_insert": ("AFTER INSERT ON Entrytags",
+                                     record("SELECT e.id FROM Entries e "
+                                            "WHERE e.id = new.entry_id", False)),
+        "entrytags_changes_delete": ("AFTER DELETE ON Entrytags",
+                                     record("SELECT e.id FROM Entries e "
+                                            "WHERE e.id = old.entry_id", False)),
+        "moods_changes_update": ("AFTER UPDATE OF label ON Moods",
+                                 record("SELECT e.id FROM Entries e "
+                                        "WHERE e.mood_id = new.id", False)),
+        "tags_changes_update": ("AFTER UPDATE OF name ON Tags",
+                                record("SELECT DISTINCT et.entry_id id FROM Entrytags et "
+                                       "WHERE et.tag_id = new.id", False)),
+    }
+
+    for (name, (event, body)) in triggers.items():
+        conn.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+
+# Renders the JSON document of every entry matching {where}, in the
+# same shape views/entry_requests.py used to build from the Entries, Moods
+# and Tags models. Used by the add_entry_documents triggers.
+RENDER_ENTRY_DOCUMENTS = """
+INSERT OR REPLACE INTO EntryDocuments (entry_id, document)
+SELECT
+    e.id,
+    json_object(
+        'id', e.id,
+        'concept', e.concept,
+        'entry', e.entry,
+        'date', e.date,
+        'mood_id', e.mood_id,
+        'mood', json_object('id', m.id, 'label', m.label),
+        'tags', json((
+            SELECT json_group_array(json_object('id', t.id, 'name', t.name))
+            FROM (
+                SELECT t.id, t.name
+                FROM Entrytags et
+                JOIN Tags t
+                    ON t.id = et.tag_id
+                WHERE et.entry_id = e.id
+                ORDER BY et.tag_id
+            ) t
+        ))
+    )
+FROM Entries e
+JOIN Moods m
+    ON m.id = e.mood_id
+WHERE {where};
+"""
+
+
+@migration
+def add_entry_documents(conn):
+    """Each entry's JSON document, with its mood and tags embedded
+
+    Listings and lookups send the stored text as it is instead of joining
+    Moods and Tags and serializing models on every read. Triggers render
+    the document again whenever the entry, its tags, or the label of its
+    mood or one of its tags changes.
+    """
+    conn.execute("""
+    CREATE TABLE EntryDocuments (
+        `entry_id`  INTEGER NOT NULL PRIMARY KEY,
+        `document`  TEXT NOT NULL
+    )
+    """)
+
+    conn.execute(RENDER_ENTRY_DOCUMENTS.format(where="1"))
+
+    triggers = {
+        "entries_document_insert": ("AFTER INSERT ON Entries", "e.id = new.id"),
+        "entries_document_update": ("AFTER UPDATE ON Entries", "e.id = new.id"),
+        "entrytags_document_insert": ("AFTER INSERT ON Entrytags", "e.id = new.entry_id"),
+        "entrytags_document_delete": ("AFTER DELETE ON Entrytags", "e.id = old.entry_id"),
+        "moods_document_update": ("AFTER UPDATE OF label ON Moods", "e.mood_id = new.id"),
+        "tags_document_update": ("AFTER UPDATE OF name ON Tags",
+                                 "e.id IN (SELECT et.entry_id FROM Entrytags et "
+                                 "WHERE et.tag_id = new.id)"),
+    }
+
+    for (name, (event, where)) in triggers.items():
+        conn.execute(f"CREATE TRIGGER {name} {event} BEGIN "
+                     f"{RENDER_ENTRY_DOCUMENTS.format(where=where)} END")
+
+    conn.execute("""
+    CREATE TRIGGER entries_document_delete AFTER DELETE ON Entries BEGIN
+        DELETE FROM EntryDocuments WHERE entry_id = old.id;
+    END
+    """)
@@ -0,0 +1,233 @@
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import quote
+
+import config
+from . import connection
+
+
+# Reads the write counters of every resource at once, to tell whether
+# the primary has changed since the replica was copied
+READ_VERSIONS = """
+SELECT group_concat(v.resource || ':' || v.version)
+FROM (SELECT resource, version FROM ResourceVersions ORDER BY resource) v
+"""
+
+
+class Replica():
+    """An in-memory copy of the database that GET requests read from
+
+    The copy is made with VACUUM INTO, SQLite's other online backup, into
+    an in-memory database of the memdb VFS. Every reader thread opens it
+    by name with its own connection and reads it through mmap, so reads
+    never touch the disk, never wait for a writer's lock and, unlike a
+    shared-cache :memory: database, don't hold each other up. (The backup
+    API can't be used here: it copies the primary's WAL header, and memdb
+    databases can't be opened in WAL mode.)
+
+    Each copy is a generation with its own name. A
+    refresher thread makes a new generation when the primary's
+    ResourceVersions have moved on, and new reads switch to it while
+    reads already running finish on the old one.
+
+    A thread drops the connection to an old generation the next time it
+    reads, so an idle thread keeps an old copy in memory until then.
+
+    Writes always go to the primary. The replica is behind by at most
+    `max_staleness` seconds plus the time a copy takes.
+    """
+
+    def __init__(self, max_staleness, min_interval):
+        """
+        Args:
+            max_staleness (number): most seconds between checks of the
+                primary for changes
+            min_interval (number): fewest seconds between two copies, so a
+                busy writer doesn't keep the refresher copying nonstop
+        """
+        self.max_staleness = max_staleness
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        # Held while a generation is swapped in or connected to, so a
+        # reader can't open the name of a copy that was just freed
+        self._swap_lock = threading.Lock()
+        self._changed = threading.Event()
+        self._local = threading.local()
+        self._pid = None
+        self._keeper = None
+        self._generation = 0
+        self._versions = None
+        self._stats = {"refreshes": 0, "refresh_seconds": 0.0, "refreshed_at": 0.0}
+
+    def _uri(self, generation):
+        return f"file:/journal-replica-{os.getpid()}-{generation}?vfs=memdb"
+
+    def _ensure_started(self):
+        # A copy inherited through fork() belongs to the parent process
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._keeper = None
+                self._versions = None
+                self.refresh()
+                threading.Thread(target=self._run, name="replica-refresh", daemon=True).start()
+                self._pid = os.getpid()
+
+    def refresh(self):
+        """Copies the primary into a new generation, unless it hasn't
+        changed since the last copy
+
+        Returns:
+            boolean: True when a new generation was made
+        """
+        started = time.perf_counter()
+        # Opened by URI so VACUUM INTO below understands the memdb one
+        primary = sqlite3.connect("file:" + quote(os.path.abspath(config.DATABASE_PATH)),
+                                  uri=True, timeout=config.SQLITE_BUSY_TIMEOUT)
+
+        try:
+            if primary.execute(READ_VERSIONS).fetchone()[0] == self._versions:
+                return False
+
+            generation = self._generation + 1
+            keeper = sqlite3.connect(self._uri(generation), uri=True)
+
+            # Writes a consistent snapshot of the primary, compacted
+            primary.execute("VACUUM INTO ?", (self._uri(generation), ))
+        finally:
+            primary.close()
+
+        versions = keeper.execute(READ_VERSIONS).fetchone()[0]
+
+        # The keeper holds the in-memory database open. Closing the old
+        # one frees its copy once the last reader has moved on.
+        with self._swap_lock:
+            (previous, self._keeper) = (self._keeper, keeper)
+            self._versions = versions
+            self._generation = generation
+
+            if previous is not None and self._pid == os.getpid():
+                previous.close()
+
+        self._stats["refreshes"] += 1
+        self._stats["refresh_seconds"] += time.perf_counter() - started
+        self._stats["refreshed_at"] = time.time()
+
+        return True
+
+    def _run(self):
+        while True:
+            self._changed.wait(self.max_staleness)
+            self._changed.clear()
+
+            try:
+                if self.refresh():
+                    time.sleep(self.min_interval)
+            except sqlite3.Error:
+                # Keep serving the last copy and try again on the next round
+                time.sleep(self.min_interval)
+
+    def mark_changed(self):
+        """Tells the refresher the primary was written to, so it copies it
+        without waiting out max_staleness
+        """
+        self._changed.set()
+
+    def pin(self):
+        """Moves the calling thread to the newest generation
+
+        Called at the start of each request, so every read of a request
+        sees the same copy even if a refresh lands halfway through it.
+
+        Returns:
+            sqlite3.Connection: the thread's read-only connection
+        """
+        self._ensure_started()
+
+        local = self._local
+
+        if getattr(local, "generation", None) == self._generation and \
+                local.pid == os.getpid():
+            return local.conn
+
+        if getattr(local, "conn", None) is not None and local.pid == os.getpid():
+            local.conn.close()
+
+        with self._swap_lock:
+            generation = self._generation
+            conn = sqlite3.connect(self._uri(generation), uri=True,
+                                   factory=connection.TimedConnection,
+                                   cached_statements=config.SQLITE_CACHED_STATEMENTS)
+
+        with connection.uncounted():
+            conn.execute("PRAGMA query_only = 1")
+            # Read pages straight from the copy instead of into a page cache
+            conn.execute(f"PRAGMA mmap_size = {config.SQLITE_MMAP_SIZE:d}")
+            connection.prepare_statements(conn)
+
+        local.conn = conn
+        local.generation = generation
+        local.pid = os.getpid()
+
+        return conn
+
+    def connection(self):
+        """Returns the calling thread's connection to the generation it
+        was last pinned to
+
+        Returns:
+            sqlite3.Connection: a read-only connection
+        """
+        local = self._local
+
+        if getattr(local, "conn", None) is not None and local.pid == os.getpid():
+            return local.conn
+
+        return self.pin()
+
+    def stats(self):
+        """Returns the replica's counters
+
+        Returns:
+            dict: the generation, copies made, seconds spent copying and
+            seconds since the last copy
+        """
+        stats = dict(self._stats)
+        stats["generation"] = self._generation
+        stats["age_seconds"] = time.time() - stats.pop("refreshed_at")
+
+        return stats
+
+
+def start_replica(max_staleness=None, min_interval=None):
+    """Serves GET requests from an in-memory copy of the database
+
+    Threads that called use_replica(True) get a connection to the copy
+    from get_connection(). The copy is made right away in this process,
+    and again in each process forked from it on first use.
+
+    Args:
+        max_staleness (number): defaults to config.REPLICA_MAX_STALENESS
+        min_interval (number): defaults to config.REPLICA_MIN_INTERVAL
+    """
+    replica = Replica(config.REPLICA_MAX_STALENESS if max_staleness is None else max_staleness,
+                      config.REPLICA_MIN_INTERVAL if min_interval is None else min_interval)
+    replica.pin()
+    connection._replica = replica
+
+
+def replica_changed():
+    """Lets the replica know the primary was just written to, if there is one
+    """
+    if connection._replica is not None:
+        connection._replica.mark_changed()
+
+
+def replica_stats():
+    """Returns the replica's counters, or None when it isn't running
+    """
+    return connection._replica.stats() if connection._replica is not None else None
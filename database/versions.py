@@ -0,0 +1,60 @@
+from .connection import get_connection, prepare
+
+
+# Every conditional GET reads one of these, so they're kept prepared
+READ_VERSION = """
+SELECT v.version
+FROM ResourceVersions v
+WHERE v.resource = ?
+"""
+
+READ_VERSION_MODIFIED = """
+SELECT
+    v.version,
+    v.modified
+FROM ResourceVersions v
+WHERE v.resource = ?
+"""
+
+
+@prepare
+def _prepare_versions(conn):
+    conn.execute(READ_VERSION, ("", )).fetchone()
+    conn.execute(READ_VERSION_MODIFIED, ("", )).fetchone()
+
+
+def read_version(conn, resource):
+    """Reads a resource's write counter on the given connection
+
+    Write paths call this inside their transaction, before and after their
+    changes, to learn exactly which version their write produced.
+
+    Args:
+        conn (sqlite3.Connection): the connection to read with
+        resource (string): entries, moods or tags
+
+    Returns:
+        number: the version, or None for a resource that isn't versioned
+    """
+    row = conn.execute(READ_VERSION, (resource, )).fetchone()
+
+    return None if row is None else row[0]
+
+
+def get_resource_version(resource):
+    """Looks up how many times a resource has been written to, and when
+
+    The counters are maintained by triggers (see the add_resource_versions
+    migration), so they also see writes made by other processes.
+
+    Args:
+        resource (string): entries, moods or tags
+
+    Returns:
+        tuple: (version, modified) where modified is a Unix timestamp, or
+        None for a resource that isn't versioned
+    """
+    with get_connection() as conn:
+        row = conn.execute(READ_VERSION_MODIFIED, (resource, )).fetchone()
+
+    return None if row is None else tuple(row)
@@ -1,3 +1,3 @@
-from .entry import Entries
 from .mood import Moods
-from .tag import Tags
\ No newline at end of file
+from .tag import Tags
+from .serializer import to_json
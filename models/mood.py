@@ -1,8 +1,16 @@
+from dataclasses import dataclass
+
+
+@dataclass(init=False)
 class Moods():
+    __slots__ = ('id', 'label')
+
+    id: int
+    label: str
 
-    # Class initializer. It has 5 custom parameters, with the
+    # Class initializer. It has 2 custom parameters, with the
     # special `self` parameter that every method on a class
     # needs as the first parameter.
     def __init__(self, id, label):
         self.id = id
-        self.label = label
\ No newline at end of file
+        self.label = label
@@ -0,0 +1,76 @@
+from dataclasses import fields, is_dataclass
+from json import dumps
+from json.encoder import encode_basestring_ascii
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# For each model class, the text that goes before each of its fields,
+# e.g. [('{"id": ', 'id'), (', "name": ', 'name')]
+_templates = {}
+
+
+def _template(cls):
+    template = _templates.get(cls)
+
+    if template is None:
+        template = [((", " if index else "{") + encode_basestring_ascii(field.name) + ": ",
+                     field.name)
+                    for (index, field) in enumerate(fields(cls))]
+        _templates[cls] = template
+
+    return template
+
+
+def _encode(value):
+    """Encodes one value the same way json.dumps() would with its defaults
+    """
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+
+    if value is None:
+        return "null"
+
+    if value is True:
+        return "true"
+
+    if value is False:
+        return "false"
+
+    if isinstance(value, int):
+        return int.__repr__(value)
+
+    if isinstance(value, list):
+        return "[" + ", ".join([_encode(item) for item in value]) + "]"
+
+    if isinstance(value, dict):
+        return "{" + ", ".join([encode_basestring_ascii(str(key)) + ": " + _encode(item)
+                                for (key, item) in value.items()]) + "}"
+
+    if is_dataclass(value):
+        return "".join([prefix + _encode(getattr(value, name))
+                        for (prefix, name) in _template(type(value))]) + "}"
+
+    return dumps(value)
+
+
+def to_json(value):
+    """Serializes models, lists of models and plain values to JSON
+
+    Model instances are written straight from their slots, without first
+    copying them into a dictionary. When orjson is installed its C encoder
+    does the work; otherwise the output matches json.dumps().
+
+    Args:
+        value: a model instance, a list, a dictionary or a plain value
+
+    Returns:
+        string: the JSON text
+    """
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+
+    return _encode(value)
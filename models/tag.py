@@ -1,4 +1,13 @@
+from dataclasses import dataclass
+
+
+@dataclass(init=False)
 class Tags():
+    __slots__ = ('id', 'name')
+
+    id: int
+    name: str
+
     def __init__(self, id, name):
         self.id = id
-        self.name = name
\ No newline at end of file
+        self.name = name
@@ -1,8 +1,20 @@
+import argparse
 import json
+import os
+import signal
+import time
 
 from http.server import BaseHTTPRequestHandler, HTTPServer
 
-from views import get_all_entries, get_single_entry, delete_entry, get_all_moods, create_journal_entry, update_entry, search_entries, get_single_tag, get_all_tags
+import config
+from database import (migrate, query_stats, reset_query_stats, start_replica, use_replica,
+                      warm_up)
+from routes import router
+from server import (BoundedThreadingHTTPServer, Request, access_logger, compress_response,
+                    log_access, metrics, profiled, record_import_times, record_startup,
+                    serve_prefork, start_access_log, start_profiling, stop_access_log,
+                    stop_on_signal, stop_profiling)
+from views import build_entry_index, start_write_queue
 
 
 # Here's a class. It inherits from another class.
@@ -13,259 +25,342 @@ class HandleRequests(BaseHTTPRequestHandler):
     # This is a Docstring it should be at the beginning of all classes and functions
     # It gives a description of the class or function
     """Controls the functionality of any GET, PUT, POST, DELETE requests to the server
+
+    Every request is matched against the route table in routes.py, and the
+    Response the route returns is written back to the client.
     """
 
-# A tuple is a specialized list in Python and is surrounded by parenthesis.
-# What makes it different is that it is immutable - meaning it cannot be changed after it is created.
-# You can't add things, remove things, or change the position of anything in it.
-# In Python, there is a very powerful tuple assignment feature that assigns the right-hand side of values into the left-hand side.
-# In another way, it is called unpacking of a tuple of values into a variable.
-# In packing, we put values into a new tuple while in unpacking we extract those values into a single variable.
-    def parse_url(self, path):
-        path_params = path.split("/")
-        resource = path_params[1]
-
-        # Check if there is a query string parameter
-        if "?" in resource:
-            # GIVEN: /customers?email=jenna@solis.com
-
-            param = resource.split("?")[1]  # email=jenna@solis.com
-            resource = resource.split("?")[0]  # 'customers'
-            pair = param.split("=")  # [ 'email', 'jenna@solis.com' ]
-            key = pair[0]  # 'email'
-            value = pair[1]  # 'jenna@solis.com'
-
-            return (resource, key, value)  # This is a tuple
-
-        # No query string parameter
-        else:
-            id = None
-            # Try to get the item at index 2
-            try:
-                # int() Python function to convert a string to an integer
-                id = int(path_params[2])
-                # Convert the string "1" to the integer 1
-                # This is the new parseInt()
-            except IndexError:
-                pass  # No route parameter exists: /animals
-            except ValueError:
-                pass  # Request had trailing slash: /animals/
-
-            return (resource, id)
+    # Connections are kept open between requests, and large listings are
+    # streamed with chunked transfer encoding, which needs HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    # Seconds an idle kept-alive connection may hold a worker thread
+    timeout = 5
+
+    # Headers and body go out in separate writes. With Nagle's algorithm
+    # the body waits for the client's delayed ACK of the headers, which
+    # adds ~40ms to every response on a kept-alive connection.
+    disable_nagle_algorithm = True
+
+    # Time spent writing to the socket and bytes sent for the current request
+    _write_time = 0.0
+    _bytes_sent = 0
+
+    def log_request(self, code='-', size='-'):
+        # Every routed request gets a structured line from _dispatch() instead
+        pass
+
+    def log_message(self, format, *args):
+        """Sends the server's own messages (timeouts, malformed requests)
+        to the access log instead of printing them to stderr
+        """
+        access_logger.warning({"level": "warning", "client": self.client_address[0],
+                               "message": format % args})
+
+    def flush_headers(self):
+        started = time.perf_counter()
+        super().flush_headers()
+        self._write_time += time.perf_counter() - started
+
+    def _write(self, data):
+        """Writes part of the response body, keeping count of the bytes
+        sent and the time spent in the socket
+        """
+        started = time.perf_counter()
+        self.wfile.write(data)
+        self._write_time += time.perf_counter() - started
+        self._bytes_sent += len(data)
 
     # Here's a class function
-    def _set_headers(self, status):
+    def _set_headers(self, status, content_length=0, headers=None,
+                     content_type='application/json'):
         # Notice this Docstring also includes information about the arguments passed to the function
-        """Sets the status code, Content-Type and Access-Control-Allow-Origin
-        headers on the response
+        """Sets the status code, Content-Type, Content-Length and
+        Access-Control-Allow-Origin headers on the response
 
         Args:
             status (number): the status code to return to the front end
+            content_length (number): the size in bytes of the response body
+            headers (dict): any other headers to send
+            content_type (string): the media type of the body
         """
         self.send_response(status)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
-
-    # Another method! This supports requests with the OPTIONS verb.
-    def do_OPTIONS(self):
-        """Sets the options headers
-        """
-        self.send_response(200)
+        self.send_header('Content-type', content_type)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods',
-                         'GET, POST, PUT, DELETE')
-        self.send_header('Access-Control-Allow-Headers',
-                         'X-Requested-With, Content-Type, Accept')
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        # 204 and 304 responses never have a body, so they must not have a length
+        if status not in (204, 304):
+            self.send_header('Content-Length', str(content_length))
         self.end_headers()
 
-    # Here's a method on the class that overrides the parent's method.
-    # It handles any GET request.
-    def do_GET(self):
-        self._set_headers(200)
-
-        response = {}
-
-        # Parse URL and store entire tuple in a variable
-        parsed = self.parse_url(self.path)
-
-        # Response from parse_url() is a tuple with 2
-        # items in it, which means the request was for
-        # `/animals` or `/animals/2`
-        if len(parsed) == 2:
-            # Parse the URL and capture the tuple that is returned
-            (resource, id) = parsed
-
-            if resource == "entries":
-                if id is not None:
-                    response = f"{get_single_entry(id)}"
-                else:
-                    response = f"{get_all_entries()}"
-            elif resource == "moods":
-            #     if id is not None:
-            #         response = f"{get_single_customer(id)}"
-            #     else:
-                    response = f"{get_all_moods()}"
-            elif resource == "tags":
-                if id is not None:
-                    response = f"{get_single_tag(id)}"
-                else:
-                    response = f"{get_all_tags()}"
-            # elif resource == "locations":
-            #     if id is not None:
-            #         response = f"{get_single_location(id)}"
-            #     else:
-            #         response = f"{get_all_locations()}"
-
-        # Response from parse_url() is a tuple with 3
-        # items in it, which means the request was for
-        # `/resource?parameter=value`
-        elif len(parsed) == 3:
-            (resource, key, value) = parsed
-
-            # Is the resource `customers` and was there a
-            # query parameter that specified the customer
-            # email as a filtering value?
-            if key == "q" and resource == "entries":
-                response = search_entries(value)
-
-            # if key == "location_id" and resource == "animals":
-            #     response = get_animals_by_location_id(value)
-
-            # if key == "location_id" and resource == "employees":
-            #     response = get_employees_by_location_id(value)
-
-            # if key == "status" and resource == "animals":
-            #     response = get_animals_by_status(value)
-
-        self.wfile.write(response.encode())
-
-    def do_PUT(self):
-        content_len = int(self.headers.get('content-length', 0))
-        post_body = self.rfile.read(content_len)
-        post_body = json.loads(post_body)
+    def _send_body(self, status, body, headers=None, content_type='application/json'):
+        """Sends a complete response
 
-        # Parse the URL
-        (resource, id) = self.parse_url(self.path)
+        Args:
+            status (number): the status code to return to the front end
+            body (string): the response body, or bytes when it's compressed
+            headers (dict): any other headers to send
+            content_type (string): the media type of the body
+        """
+        data = body if isinstance(body, bytes) else body.encode()
+        self._set_headers(status, len(data), headers, content_type)
+        self._write(data)
 
-        success = False
+    def _send_chunked(self, status, chunks, headers=None, content_type='application/json'):
+        """Streams a response body as it is produced
 
-        if resource == "entries":
-            success = update_entry(id, post_body)
-        # rest of the elif's
+        Each piece is written as soon as it's ready with chunked transfer
+        encoding, so the whole body is never held in memory.
 
-        if success:
-            self._set_headers(204)
+        Args:
+            status (number): the status code to return to the front end
+            chunks (iterable): the pieces of the response body
+            headers (dict): any other headers to send
+            content_type (string): the media type of the body
+        """
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+
+        # HTTP/1.0 clients don't understand chunks; the end of the body is
+        # marked by closing the connection instead
+        chunked = self.request_version != "HTTP/1.0"
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
         else:
-            self._set_headers(404)
-
-        self.wfile.write("".encode())
-
-    # Here's a method on the class that overrides the parent's method.
-    # It handles any POST request: creates a new object that's converted from a string into a Python dictionary,
-    # then added to the ANIMALS list or other list you choose in views
-    def do_POST(self):
-        self._set_headers(201)
-        content_len = int(self.headers.get('content-length', 0))
-        post_body = self.rfile.read(content_len)
-
-    #     # Convert JSON string to a Python dictionary
-    #     # In Python, you convert a string to a dictionary with json.loads().
-        post_body = json.loads(post_body)
-
-    #     # Parse the URL
-        (resource, id) = self.parse_url(self.path)
-
-    #     # Initialize new animal, location, employee, etc.
-        new_resource = None
-
-        # Add a new animal to the list. Don't worry about
-        # the orange squiggle, you'll define the create_animal
-        # function next.
-        if resource == "entries":
-            new_resource = create_journal_entry(post_body)
-
-        # Add a new location to the list. Don't worry about
-        # the orange squiggle, you'll define the create_location
-        # function next.
-    #     if resource == "locations":
-    #         new_resource = create_location(post_body)
-
-    #     # Add a new employee to the list. Don't worry about
-    #     # the orange squiggle, you'll define the create_employee
-    #     # function next.
-        # if resource == "employees":
-        #     new_resource = create_employee(post_body)
-
-    #     # Add a new customer to the list. Don't worry about
-    #     # the orange squiggle, you'll define the create_customer
-    #     # function next.
-    #     if resource == "customers":
-    #         new_resource = create_customer(post_body)
-
-    #     # Encode the new resource and send in response
-        self.wfile.write(f"{new_resource}".encode())
-
-    def do_DELETE(self):
-        #     # Set a 204 response code
-        #     # A 204 response code in HTTP means,
-        #     # "I, the server, successfully processed your request,
-        #     # but I have no information to send back to you."
-        self._set_headers(204)
+            self.close_connection = True
+        self.end_headers()
 
-    #     # Parse the URL
-        (resource, id) = self.parse_url(self.path)
+        for chunk in chunks:
+            data = chunk if isinstance(chunk, bytes) else chunk.encode()
 
-    #     # Delete a single animal from the list
-        if resource == "entries":
-            delete_entry(id)
+            if not data:
+                continue
 
-        # if resource == "locations":
-        #     delete_location(id)
+            if chunked:
+                self._write(b"%x\r\n%s\r\n" % (len(data), data))
+            else:
+                self._write(data)
 
-        # if resource == "employees":
-        #     delete_employee(id)
+        if chunked:
+            self._write(b"0\r\n\r\n")
 
-        # if resource == "customers":
-        #     delete_customer(id)
+    def _dispatch(self):
+        """Runs the route for the current request and sends its response
 
-    #     # Encode the new animal and send in response
-        self.wfile.write("".encode())
+        The time spent in SQL, building the body and writing it to the
+        socket is recorded in the metrics, and the request in the access log.
+        """
+        started = time.perf_counter()
+        self._write_time = 0.0
+        self._bytes_sent = 0
+        reset_query_stats()
+        metrics.request_started()
+
+        request = Request(self.command, self.path, self.headers, self.rfile,
+                          int(self.headers.get('content-length', 0)))
+        use_replica(request.method == "GET")
+
+        with profiled(request):
+            self._respond(request, started)
+
+    def _respond(self, request, started):
+        try:
+            response = compress_response(request, router.dispatch(request))
+        except Exception:
+            self.log_error("Error handling %s %s", self.command, self.path)
+            self.server.handle_error(self.request, self.client_address)
+            response = None
+
+        # Whatever part of the body the route didn't read can't be skipped
+        # reliably, so the connection can't be used for another request
+        if not request.fully_read:
+            self.close_connection = True
+
+        # A client that goes away mid-response still counts as a request
+        try:
+            if response is None:
+                self._send_body(500, json.dumps({"message": "Internal server error"}))
+            elif response.chunks is not None:
+                self._send_chunked(response.status, response.chunks, response.headers,
+                                   response.content_type)
+            else:
+                self._send_body(response.status, response.body, response.headers,
+                                response.content_type)
+        finally:
+            self._record(request, response.status if response is not None else 500,
+                         started)
+
+    def _record(self, request, status, started):
+        """Adds a finished request to the metrics and the access log
+        """
+        duration = time.perf_counter() - started
+        (queries, sql_time) = query_stats()
+        route = request.route or "unmatched"
 
-    # def do_PUT(self):
-    #     self._set_headers(204)
-    #     content_len = int(self.headers.get('content-length', 0))
-    #     post_body = self.rfile.read(content_len)
-    #     post_body = json.loads(post_body)
+        metrics.request_finished(self.command, route, status, duration, sql=sql_time,
+                                 write=self._write_time, queries=queries,
+                                 size=self._bytes_sent)
 
-    #     # Parse the URL
-    #     (resource, id) = self.parse_url(self.path)
+        log_access(self.client_address[0], self.command, self.path, route, status,
+                   self._bytes_sent, duration, sql_time, queries)
 
-    #     # Delete a single animal from the list
-    #     # if resource == "animals":
-    #     #     update_animal(id, post_body)
+    # Another method! This supports requests with the OPTIONS verb.
+    def do_OPTIONS(self):
+        """Sets the options headers
+        """
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods',
+                         'GET, POST, PUT, DELETE')
+        self.send_header('Access-Control-Allow-Headers',
+                         'X-Requested-With, Content-Type, Accept')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
 
-    #     if resource == "locations":
-    #         update_location(id, post_body)
+    # Here are methods on the class that override the parent's methods.
+    # Each one handles requests with its HTTP verb.
+    def do_GET(self):
+        self._dispatch()
 
-    #     if resource == "employees":
-    #         update_employee(id, post_body)
+    def do_POST(self):
+        self._dispatch()
 
-    #     if resource == "customers":
-    #         update_customer(id, post_body)
+    def do_PUT(self):
+        self._dispatch()
 
-    #     # Encode the new animal and send in response
-    #     self.wfile.write("".encode())
+    def do_DELETE(self):
+        self._dispatch()
 
 
 # This function is not inside the class. It is the starting
 # point of this application.
 def main():
     """Starts the server on port 8088 using the HandleRequests class
+
+    The --mode option picks how requests are served concurrently:
+        single: one request at a time on a plain HTTPServer
+        threaded: a bounded pool of worker threads (the default)
+        prefork: several worker processes sharing the listening socket,
+            each with its own pool of worker threads
+        asyncio: connections handled by an event loop, so thousands of
+            idle keep-alive clients don't hold threads; routes still run
+            on a bounded pool of worker threads
+
+    With --group-commit, creates, updates and deletes of entries go
+    through one writer thread that commits them in batches, which raises
+    write throughput under concurrent load.
+
+    With --replica, GET requests read from an in-memory copy of the
+    database that is refreshed in the background, at most
+    config.REPLICA_MAX_STALENESS seconds behind.
+
+    With --profile DIR, a share of requests is profiled with cProfile and
+    the samples, the startup steps' timings and the modules' import times
+    are written to DIR (see server/profiling.py).
+    """
+    parser = argparse.ArgumentParser(description="Daily journal API server")
+    parser.add_argument("--host", default='')
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--mode", choices=["single", "threaded", "prefork", "asyncio"],
+                        default="threaded")
+    parser.add_argument("--threads", type=int, default=16,
+                        help="worker threads per process")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="worker processes in prefork mode")
+    parser.add_argument("--max-queue", type=int, default=64,
+                        help="requests waiting for a worker before answering 503")
+    parser.add_argument("--keepalive-timeout", type=float, default=75.0,
+                        help="seconds an idle connection is kept open in asyncio mode")
+    parser.add_argument("--group-commit", action="store_true", default=config.WRITE_QUEUE,
+                        help="commit entry writes from concurrent requests in batches")
+    parser.add_argument("--replica", action="store_true", default=config.REPLICA,
+                        help="serve GET requests from an in-memory copy of the database")
+    parser.add_argument("--profile", metavar="DIR",
+                        help="profile requests and startup, writing the results to DIR")
+    parser.add_argument("--profile-sample", type=float, default=config.PROFILE_SAMPLE_RATE,
+                        help="share of requests profiled with --profile, 0 to 1")
+    args = parser.parse_args()
+
+    # How long each startup step takes, written out with --profile
+    phases = {}
+
+    def timed(name, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        phases[name] = time.perf_counter() - started
+        return result
+
+    # Bring the database schema up to date before serving anything
+    timed("migrate", migrate)
+    timed("warm_up", warm_up)
+    timed("build_entry_index", build_entry_index)
+
+    if args.group_commit:
+        timed("start_write_queue", start_write_queue)
+
+    if args.replica:
+        timed("start_replica", start_replica)
+
+    if args.profile:
+        start_profiling(args.profile, args.profile_sample)
+        record_startup(args.profile, phases)
+        record_import_times(args.profile, "request_handler",
+                            os.path.dirname(os.path.abspath(__file__)))
+
+    try:
+        serve(args)
+    finally:
+        stop_profiling()
+
+
+def serve(args):
+    """Serves requests in the --mode picked on the command line until the
+    server is stopped
     """
-    host = ''
-    port = 8088
-    HTTPServer((host, port), HandleRequests).serve_forever()
+    address = (args.host, args.port)
+
+    if args.mode == "single":
+        start_access_log()
+
+        try:
+            HTTPServer(address, HandleRequests).serve_forever()
+        finally:
+            stop_access_log()
+
+    elif args.mode == "threaded":
+        server = BoundedThreadingHTTPServer(address, HandleRequests,
+                                            threads=args.threads,
+                                            max_queue=args.max_queue)
+        signal.signal(signal.SIGINT, stop_on_signal(server))
+        signal.signal(signal.SIGTERM, stop_on_signal(server))
+        start_access_log()
+
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            stop_access_log()
+
+    elif args.mode == "asyncio":
+        # Only this mode needs asyncio, so it's imported here
+        from server import serve_asyncio
+
+        start_access_log()
+
+        try:
+            serve_asyncio(address, router, threads=args.threads, max_queue=args.max_queue,
+                          keepalive_timeout=args.keepalive_timeout)
+        finally:
+            stop_access_log()
+
+    else:
+        # Each worker process starts its own access log after forking
+        serve_prefork(address, HandleRequests, args.processes,
+                      threads=args.threads, max_queue=args.max_queue)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,311 @@
+import json
+from email.utils import formatdate, parsedate_to_datetime
+from functools import wraps
+from itertools import chain
+
+from database import get_resource_version, pool_stats, replica_stats
+from server import (Response, Router, cached_response, compression_stats, json_response,
+                    metrics, render_stats)
+from views import (get_single_entry, stream_all_entries, search_entries, export_entries,
+                   create_journal_entry, create_journal_entries, update_entry, delete_entry,
+                   get_all_moods, get_all_tags, get_single_tag, get_entry_stats, cache_stats,
+                   get_entries_by_ids, get_entry_changes, get_tags_by_ids,
+                   write_queue_stats)
+
+
+# Query string parameters that filter the /entries listing
+ENTRY_FILTERS = ("from", "to", "tag_id", "match", "mood_id")
+
+router = Router()
+
+
+def _validators(resource):
+    """Builds the ETag and Last-Modified headers for a resource from its
+    write counter
+
+    Returns:
+        dict: the headers, empty for resources that aren't versioned
+    """
+    version = get_resource_version(resource)
+
+    if version is None:
+        return {}
+
+    (number, modified) = version
+
+    return {
+        'ETag': f'W/"{resource}-{number}"',
+        'Last-Modified': formatdate(modified, usegmt=True),
+        'Cache-Control': 'no-cache',
+    }
+
+
+def _is_not_modified(request, validators):
+    """Checks the request's If-None-Match and If-Modified-Since headers
+
+    Returns:
+        boolean: True when the client's copy is still current
+    """
+    if not validators:
+        return False
+
+    if_none_match = request.headers.get('If-None-Match')
+
+    # If-None-Match wins over If-Modified-Since when both are sent
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or validators['ETag'] in tags
+
+    if_modified_since = request.headers.get('If-Modified-Since')
+
+    if if_modified_since is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+        modified = parsedate_to_datetime(validators['Last-Modified'])
+        return modified <= since
+
+    return False
+
+
+def _started(chunks):
+    """Reads the first piece of a streamed body right away
+
+    That runs the body's query, whose read transaction then holds the
+    connection's snapshot while the rest is streamed, so the write counter
+    read next on the same connection is the one the body is read at.
+
+    Returns:
+        iterator: every piece, the first one included
+    """
+    chunks = iter(chunks)
+    first = next(chunks, None)
+
+    return iter(()) if first is None else chain((first, ), chunks)
+
+
+def conditional(resource):
+    """Adds ETag/Last-Modified to a GET route and answers 304 when the
+    client's copy is current, without querying or serializing anything
+
+    The counter is read again once the body has been read. A write that
+    landed in between means the body may be newer than the ETag, so the
+    response goes out without validators rather than with the wrong ones,
+    and compress_response() doesn't keep it.
+
+    Args:
+        resource (string): the write counter the route's responses follow
+    """
+    def decorate(handler):
+        @wraps(handler)
+        def wrapper(request, **params):
+            validators = _validators(resource)
+
+            if _is_not_modified(request, validators):
+                return Response(304, headers=validators)
+
+            # The same page was compressed for this coding since the last write
+            if validators:
+                response = cached_response(request, validators['ETag'])
+
+                if response is not None:
+                    response.headers.update(validators)
+                    return response
+
+            response = handler(request, **params)
+
+            if response.status != 200 or not validators:
+                return response
+
+            if response.chunks is not None:
+                response.chunks = _started(response.chunks)
+
+            if _validators(resource) == validators:
+                response.headers.update(validators)
+
+            return response
+
+        return wrapper
+
+    return decorate
+
+
+def _ids(value):
+    """Parses an `ids=` value such as "1,2,3"
+
+    Raises:
+        ValueError: when one of the ids isn't a number
+    """
+    try:
+        return [int(id) for id in value.split(",") if id.strip()]
+    except ValueError as ex:
+        raise ValueError("ids must be a comma separated list of ids") from ex
+
+
+def _after(value):
+    """Parses an `after=` value, the last entry id of the previous page
+
+    Raises:
+        ValueError: when it isn't an id SQLite can store
+    """
+    after = int(value)
+
+    if not 0 <= after < 2 ** 63:
+        raise ValueError("after must be an entry id")
+
+    return after
+
+
+def _found(response):
+    """Answers 404 for a views function that found nothing
+    """
+    if response is None:
+        return json_response(404, {"message": "Not found"})
+
+    return Response(200, response)
+
+
+@router.route("GET", "/entries")
+@conditional("entries")
+def list_entries(request):
+    query = request.query
+
+    if "q" in query:
+        return Response(200, search_entries(query["q"]))
+
+    # Many entries by id, with their tags, in one round trip
+    if "ids" in query:
+        return Response(200, get_entries_by_ids(_ids(query["ids"])))
+
+    limit = int(query["limit"]) if "limit" in query else None
+    after = _after(query["after"]) if "after" in query else None
+    filters = {key: query[key] for key in ENTRY_FILTERS if key in query}
+
+    # Listings can be huge, so they are sent as they're read
+    return Response(200, chunks=stream_all_entries(limit, after, query.get("fields"), **filters))
+
+
+@router.route("GET", "/entries/export")
+@conditional("entries")
+def export(request):
+    # A full NDJSON backup, streamed as it's read
+    return Response(200, chunks=export_entries(), content_type="application/x-ndjson")
+
+
+@router.route("GET", "/entries/changes")
+@conditional("entries")
+def list_entry_changes(request):
+    query = request.query
+
+    since = int(query.get("since", 0))
+    limit = int(query["limit"]) if "limit" in query else None
+    changes = get_entry_changes(since, limit)
+
+    if changes is None:
+        return json_response(410, {"message": "Changes this old were compacted; "
+                                              "sync again from since=0"})
+
+    return Response(200, changes)
+
+
+@router.route("GET", "/entries/{id:int}")
+@conditional("entries")
+def retrieve_entry(request, id):
+    return _found(get_single_entry(id))
+
+
+@router.route("POST", "/entries")
+def create_entry(request):
+    return Response(201, create_journal_entry(request.json()))
+
+
+@router.route("POST", "/entries/bulk")
+def create_entries(request):
+    """The body is either a JSON array of entries or NDJSON, one entry per
+    line. NDJSON is parsed line by line as it's read from the socket.
+    """
+    content_type = request.headers.get('content-type', '')
+
+    if 'ndjson' in content_type or 'jsonlines' in content_type:
+        new_entries = (json.loads(line) for line in request.lines() if line.strip())
+    else:
+        new_entries = request.json()
+
+        if not isinstance(new_entries, list):
+            raise ValueError("Expected a JSON array of entries")
+
+    batch_size = int(request.query["batch_size"]) if "batch_size" in request.query else None
+
+    return Response(201, create_journal_entries(new_entries, batch_size))
+
+
+@router.route("PUT", "/entries/{id:int}")
+def replace_entry(request, id):
+    if update_entry(id, request.json()):
+        return Response(204)
+
+    return Response(404)
+
+
+@router.route("DELETE", "/entries/{id:int}")
+def remove_entry(request, id):
+    delete_entry(id)
+
+    return Response(204)
+
+
+@router.route("GET", "/moods")
+@conditional("moods")
+def list_moods(request):
+    return Response(200, get_all_moods())
+
+
+@router.route("GET", "/tags")
+@conditional("tags")
+def list_tags(request):
+    if "ids" in request.query:
+        return Response(200, get_tags_by_ids(_ids(request.query["ids"])))
+
+    return Response(200, get_all_tags())
+
+
+@router.route("GET", "/tags/{id:int}")
+@conditional("tags")
+def retrieve_tag(request, id):
+    return _found(get_single_tag(id))
+
+
+@router.route("GET", "/stats")
+# Stats are computed from entries, so they change with them
+@conditional("entries")
+def stats(request):
+    query = request.query
+
+    return Response(200, get_entry_stats(query.get("period", "day"),
+                                         query.get("from"), query.get("to")))
+
+
+@router.route("GET", "/metrics")
+def get_metrics(request):
+    """Request metrics, connection pool and response cache counters in
+    Prometheus text format
+    """
+    lines = metrics.render()
+    lines += render_stats("journal_connection_pool", "Per-thread SQLite connection reuse",
+                          pool_stats())
+    lines += render_stats("journal_response_cache", "Cached views responses",
+                          cache_stats())
+    lines += render_stats("journal_compressed_cache", "Cached compressed response bodies",
+                          compression_stats())
+
+    if replica_stats() is not None:
+        lines += render_stats("journal_replica", "In-memory read replica", replica_stats())
+
+    if write_queue_stats() is not None:
+        lines += render_stats("journal_write_queue", "Group-committed entry writes",
+                              write_queue_stats())
+
+    return Response(200, "\n".join(lines) + "\n",
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
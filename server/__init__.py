@@ -0,0 +1,19 @@
+from .threaded import BoundedThreadingHTTPServer, stop_on_signal
+from .prefork import serve_prefork
+from .router import Request, Response, Router, json_response
+from .metrics import metrics, render_stats
+from .access_log import access_logger, log_access, start_access_log, stop_access_log
+from .compression import cached_response, compress_response, compression_stats
+from .profiling import (dump_profiles, profiled, record_import_times, record_startup,
+                        start_profiling, stop_profiling)
+
+
+def __getattr__(name):
+    # server.aio pulls in asyncio, which takes longer to import than the
+    # rest of the server together, so it's only loaded for --mode asyncio
+    if name in ("AsyncHTTPServer", "serve_asyncio"):
+        from . import aio
+
+        return getattr(aio, name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,145 @@
+import json
+import logging
+import sys
+import threading
+import time
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener
+from queue import SimpleQueue
+
+import config
+
+
+# One JSON object per line for every request. Request threads only put
+# the record on a queue; formatting and writing happen on the listener's
+# thread, and lines are written in batches.
+access_logger = logging.getLogger("journal.access")
+access_logger.setLevel(logging.INFO)
+access_logger.propagate = False
+
+_listener = None
+_flusher = None
+_stopped = threading.Event()
+
+
+class _RecordQueueHandler(QueueHandler):
+    """Queues records as they are
+
+    QueueHandler formats the message in the calling thread so records can
+    be pickled to another process. These records stay in this process, so
+    the formatting is left to the listener.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats access records, whose message is a dict of fields, as JSON
+    """
+
+    def format(self, record):
+        if isinstance(record.msg, dict):
+            fields = record.msg
+        else:
+            fields = {"level": record.levelname.lower(), "message": record.getMessage()}
+
+        fields = {"time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"), **fields}
+
+        return json.dumps(fields)
+
+    # Timestamps are always UTC
+    converter = time.gmtime
+
+
+def log_access(client, method, path, route, status, size, duration, sql_time, queries):
+    """Queues the access log line of a finished request
+
+    Args:
+        client (string): the client's address
+        method (string): the HTTP method
+        path (string): the request target, with its query string
+        route (string): the route pattern that matched
+        status (number): the response status code
+        size (number): bytes of response body sent
+        duration (number): seconds taken to serve the request
+        sql_time (number): seconds of that spent in SQLite
+        queries (number): how many statements the request ran
+    """
+    access_logger.info({
+        "client": client,
+        "method": method,
+        "path": path,
+        "route": route,
+        "status": status,
+        "bytes": size,
+        "duration_ms": round(duration * 1000, 3),
+        "sql_ms": round(sql_time * 1000, 3),
+        "queries": queries,
+    })
+
+
+def start_access_log(path=None):
+    """Starts writing the access log
+
+    Each process calls it once, after any fork(); the listener's thread
+    doesn't survive forking.
+
+    Args:
+        path (string): the file to append to, or "-" for stderr. Defaults
+            to config.ACCESS_LOG.
+    """
+    global _listener, _flusher
+
+    path = config.ACCESS_LOG if path is None else path
+
+    if path == "-":
+        output = logging.StreamHandler(sys.stderr)
+    else:
+        output = logging.FileHandler(path)
+
+    output.setFormatter(JsonFormatter())
+
+    # Holds records until it has a batch of them, or an error arrives
+    buffer = MemoryHandler(config.ACCESS_LOG_BUFFER, flushLevel=logging.ERROR,
+                           target=output)
+
+    queue = SimpleQueue()
+    access_logger.handlers = [_RecordQueueHandler(queue)]
+
+    _listener = QueueListener(queue, buffer)
+    _listener.start()
+
+    # A quiet server would otherwise keep its last few lines to itself
+    _stopped.clear()
+    _flusher = threading.Thread(target=_flush_periodically, args=(buffer, ),
+                                name="access-log-flush", daemon=True)
+    _flusher.start()
+
+
+def _flush_periodically(buffer):
+    while not _stopped.wait(config.ACCESS_LOG_FLUSH_INTERVAL):
+        buffer.flush()
+
+
+def stop_access_log():
+    """Writes out whatever is still queued and stops the access log
+    """
+    global _listener, _flusher
+
+    if _listener is None:
+        return
+
+    access_logger.handlers = []
+    _listener.stop()
+
+    _stopped.set()
+    _flusher.join()
+
+    for handler in _listener.handlers:
+        output = handler.target
+        # Closing the buffer flushes it into the output
+        handler.close()
+        output.close()
+
+    _listener = None
+    _flusher = None
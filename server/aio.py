@@ -0,0 +1,586 @@
+import asyncio
+import io
+import signal
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+from http.client import HTTPException, parse_headers
+
+from database import query_stats, reset_query_stats, use_replica
+
+from .access_log import log_access
+from .compression import compress_response
+from .metrics import metrics
+from .profiling import profiled
+from .router import Request
+from .threaded import SERVICE_UNAVAILABLE
+
+
+# Request bodies up to this size are read before the route runs. Larger
+# ones (bulk imports) are read by the route as it needs them.
+MAX_BUFFERED_BODY = 64 * 1024
+
+# Longest request line or header line, and most header lines, accepted
+MAX_LINE = 64 * 1024
+MAX_HEADERS = 100
+
+# Chunks of a streamed response waiting to be written. When the client
+# reads slowly, the worker thread producing them waits.
+STREAM_QUEUE_SIZE = 8
+
+# Markers the worker thread puts on a stream's queue after the last chunk
+_END = object()
+_FAILED = object()
+
+
+class _BadRequest(Exception):
+    """The request can't be parsed; answered with its status, and the
+    connection is closed
+    """
+
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+
+class _Stream():
+    """Hands a response, and the chunks of a streamed body, from the worker
+    thread running the route to the connection's coroutine
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        # Set by the coroutine once the client is gone
+        self.closed = False
+        # Set once the response has been handed over
+        self.started = False
+
+    def start(self, response):
+        # The response is always the first item, so the queue has room
+        self.started = True
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, response)
+
+    def send(self, item):
+        """Waits until the coroutine has room for another chunk
+
+        Returns:
+            boolean: False once nobody is writing the chunks anymore
+        """
+        if self.closed:
+            return False
+
+        asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop).result()
+        return not self.closed
+
+    def finish(self, marker):
+        """Puts _END or _FAILED after the last chunk
+
+        The coroutine waits for it even after the client is gone, so it's
+        always sent.
+        """
+        asyncio.run_coroutine_threadsafe(self.queue.put(marker), self.loop).result()
+
+
+class _BodyReader():
+    """A blocking file-like view of a request body still in the socket
+
+    Routes run on worker threads and read bodies with read() and
+    readline(), so each read is handed to the event loop and waited for.
+    Never reads past the end of the body, where a pipelined request may
+    already be waiting.
+    """
+
+    def __init__(self, reader, loop, length):
+        self._reader = reader
+        self._loop = loop
+        self._left = length
+        self._buffer = bytearray()
+
+    def _fill(self):
+        if self._left <= 0:
+            return False
+
+        data = asyncio.run_coroutine_threadsafe(
+            self._reader.read(min(self._left, MAX_BUFFERED_BODY)), self._loop).result()
+
+        if not data:
+            self._left = 0
+            return False
+
+        self._left -= len(data)
+        self._buffer += data
+        return True
+
+    def read(self, size):
+        while len(self._buffer) < size and self._fill():
+            pass
+
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def readline(self, limit):
+        while True:
+            end = self._buffer.find(b"\n", 0, limit)
+
+            if end >= 0:
+                size = end + 1
+                break
+
+            if len(self._buffer) >= limit or not self._fill():
+                size = limit
+                break
+
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class AsyncHTTPServer():
+    """Serves a Router from an asyncio event loop
+
+    Connections, keep-alive and pipelining are handled by coroutines, so
+    idle clients cost a little memory and no threads. Routes and the views
+    behind them still make blocking SQLite calls, so each request runs on
+    a bounded pool of worker threads. When threads + max_queue requests
+    are already in progress, new ones get a 503.
+    """
+
+    def __init__(self, router, threads=16, max_queue=64, keepalive_timeout=75.0):
+        """
+        Args:
+            router (Router): the route table, e.g. routes.router
+            threads (number): how many routes run at the same time
+            max_queue (number): how many requests may wait for a thread
+            keepalive_timeout (number): seconds an idle connection is kept
+        """
+        self.router = router
+        self.max_requests = threads + max_queue
+        self.keepalive_timeout = keepalive_timeout
+        self._executor = ThreadPoolExecutor(max_workers=threads,
+                                            thread_name_prefix="journal-worker")
+        self._active = 0
+        # Connection task -> True while it is serving a request
+        self._connections = {}
+        self._closing = False
+        self._date = (0, "")
+
+    async def serve(self, host, port):
+        """Accepts connections until SIGINT/SIGTERM, then lets the requests
+        in progress finish
+        """
+        loop = asyncio.get_running_loop()
+        stopped = asyncio.Event()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+
+        server = await asyncio.start_server(self._connection, host or None, port,
+                                            limit=MAX_LINE, reuse_address=True)
+
+        async with server:
+            await stopped.wait()
+            self._closing = True
+            server.close()
+
+            # Idle connections are dropped, busy ones close after their request
+            for (task, busy) in list(self._connections.items()):
+                if not busy:
+                    task.cancel()
+
+            if self._connections:
+                await asyncio.wait(list(self._connections))
+
+        self._executor.shutdown()
+
+    def _http_date(self):
+        # The Date header only changes once a second
+        now = int(time.time())
+
+        if self._date[0] != now:
+            self._date = (now, formatdate(now, usegmt=True))
+
+        return self._date[1]
+
+    async def _connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = False
+        peer = writer.get_extra_info("peername")
+        client = peer[0] if peer else "-"
+
+        try:
+            while not self._closing:
+                try:
+                    head = await asyncio.wait_for(self._read_head(reader),
+                                                  self.keepalive_timeout)
+                except _BadRequest as ex:
+                    writer.write(self._head(ex.status, 0, {}, "application/json",
+                                            keep_alive=False))
+                    await writer.drain()
+                    break
+
+                if head is None:
+                    break
+
+                self._connections[task] = True
+
+                try:
+                    keep_alive = await self._request(head, reader, writer, client)
+                finally:
+                    self._connections[task] = False
+
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.CancelledError, ConnectionError,
+                asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self._connections[task]
+            writer.close()
+
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+
+    async def _read_head(self, reader):
+        """Reads a request line and its headers
+
+        Returns:
+            tuple: (method, target, version, headers), or None when the
+            client closed the connection between requests
+        """
+        try:
+            line = await reader.readline()
+
+            # Blank lines between pipelined requests are allowed (RFC 9112)
+            while line in (b"\r\n", b"\n"):
+                line = await reader.readline()
+
+            if not line:
+                return None
+
+            parts = line.decode("latin-1").split()
+
+            if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+                raise _BadRequest(400)
+
+            lines = []
+
+            while True:
+                header = await reader.readline()
+
+                if header in (b"\r\n", b"\n", b""):
+                    break
+
+                lines.append(header)
+
+                if len(lines) > MAX_HEADERS:
+                    raise _BadRequest(431)
+        except ValueError as ex:
+            # StreamReader.readline() gave up on a line longer than MAX_LINE
+            raise _BadRequest(431) from ex
+
+        try:
+            headers = parse_headers(io.BytesIO(b"".join(lines) + b"\r\n"))
+        except HTTPException as ex:
+            raise _BadRequest(400) from ex
+
+        return (parts[0], parts[1], parts[2], headers)
+
+    async def _request(self, head, reader, writer, client):
+        """Serves one request
+
+        Returns:
+            boolean: True when the connection can be used for another request
+        """
+        started = time.perf_counter()
+        (method, target, version, headers) = head
+        connection = headers.get("Connection", "").lower()
+
+        if version == "HTTP/1.0":
+            keep_alive = connection == "keep-alive"
+        else:
+            keep_alive = connection != "close"
+
+        if "chunked" in headers.get("Transfer-Encoding", "").lower():
+            # Request bodies have to come with a Content-Length
+            writer.write(self._head(411, 0, {}, "application/json", keep_alive=False))
+            await writer.drain()
+            return False
+
+        try:
+            length = int(headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+
+        if length < 0:
+            writer.write(self._head(400, 0, {}, "application/json", keep_alive=False))
+            await writer.drain()
+            return False
+
+        if method == "OPTIONS":
+            await reader.readexactly(length)
+            writer.write(self._head(200, 0, {
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE',
+                'Access-Control-Allow-Headers': 'X-Requested-With, Content-Type, Accept',
+            }, None, keep_alive, version=version))
+            await writer.drain()
+            return keep_alive
+
+        if self._active >= self.max_requests:
+            writer.write(SERVICE_UNAVAILABLE)
+            await writer.drain()
+            return False
+
+        if version != "HTTP/1.0" and headers.get("Expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        loop = asyncio.get_running_loop()
+
+        if length <= MAX_BUFFERED_BODY:
+            body = io.BytesIO(await reader.readexactly(length))
+        else:
+            body = _BodyReader(reader, loop, length)
+
+        request = Request(method, target, headers, body, length)
+        stream = _Stream(loop)
+
+        self._active += 1
+        metrics.request_started()
+
+        write_time = 0.0
+        size = 0
+        status = 500
+        work = None
+
+        try:
+            work = loop.run_in_executor(self._executor, self._work, request, stream)
+            response = await stream.queue.get()
+
+            # Whatever part of a large body the route didn't read is still
+            # in the socket, ahead of the next request
+            if isinstance(body, _BodyReader) and not request.fully_read:
+                keep_alive = False
+
+            if response is None:
+                status = 500
+                data = b'{"message": "Internal server error"}'
+                chunks = None
+                (response_headers, content_type) = ({}, "application/json")
+            else:
+                status = response.status
+                chunks = response.chunks
+                data = None
+
+                if chunks is None:
+                    data = response.body
+                    data = data if isinstance(data, bytes) else data.encode()
+                (response_headers, content_type) = (response.headers, response.content_type)
+
+            if chunks is None:
+                # 204 and 304 responses never have a body
+                if status in (204, 304):
+                    data = b""
+
+                write_started = time.perf_counter()
+                writer.write(self._head(status, len(data), response_headers, content_type,
+                                        keep_alive, empty=status in (204, 304),
+                                        version=version) + data)
+                await writer.drain()
+                write_time += time.perf_counter() - write_started
+                size = len(data)
+            else:
+                (keep_alive, size, write_time) = await self._write_chunks(
+                    writer, stream, status, response_headers, content_type,
+                    keep_alive, version)
+
+            await work
+        finally:
+            self._active -= 1
+            duration = time.perf_counter() - started
+
+            # A client that went away mid-response still counts as a request
+            if work is not None and work.done() and not work.exception():
+                (queries, sql_time) = work.result()
+            else:
+                (queries, sql_time) = (0, 0.0)
+
+            route = request.route or "unmatched"
+            metrics.request_finished(method, route, status, duration, sql=sql_time,
+                                     write=write_time, queries=queries, size=size)
+            log_access(client, method, target, route, status, size, duration,
+                       sql_time, queries)
+
+        return keep_alive
+
+    async def _write_chunks(self, writer, stream, status, headers, content_type,
+                            keep_alive, version):
+        """Writes a streamed response as the worker thread produces it
+
+        Returns:
+            tuple: (keep_alive, bytes of body sent, seconds spent writing)
+        """
+        # HTTP/1.0 clients don't understand chunks; the end of the body is
+        # marked by closing the connection instead
+        chunked = version != "HTTP/1.0"
+        if not chunked:
+            keep_alive = False
+
+        extra = {'Transfer-Encoding': 'chunked'} if chunked else {}
+        head = self._head(status, None, {**headers, **extra}, content_type, keep_alive)
+
+        size = 0
+        write_time = 0.0
+
+        try:
+            writer.write(head)
+
+            while True:
+                item = await stream.queue.get()
+
+                if item is _END:
+                    if chunked:
+                        writer.write(b"0\r\n\r\n")
+                    break
+
+                if item is _FAILED:
+                    # The body is cut short; closing the connection without
+                    # the last chunk tells the client something went wrong
+                    keep_alive = False
+                    break
+
+                size += len(item)
+                writer.write(b"%x\r\n%s\r\n" % (len(item), item) if chunked else item)
+
+                write_started = time.perf_counter()
+                await writer.drain()
+                write_time += time.perf_counter() - write_started
+
+            write_started = time.perf_counter()
+            await writer.drain()
+            write_time += time.perf_counter() - write_started
+        except ConnectionError:
+            # Let the worker thread stop producing chunks, and take the ones
+            # it already queued so it isn't left waiting
+            stream.closed = True
+
+            while await stream.queue.get() not in (_END, _FAILED):
+                pass
+
+            raise
+
+        return (keep_alive, size, write_time)
+
+    def _work(self, request, stream):
+        """Runs a route on a worker thread
+
+        A streamed body is produced on this same thread, because the
+        generators behind it keep using this thread's SQLite connection.
+
+        Returns:
+            tuple: (number of statements, seconds spent in SQLite)
+        """
+        try:
+            reset_query_stats()
+            use_replica(request.method == "GET")
+
+            with profiled(request):
+                return self._run_route(request, stream)
+        except Exception:
+            # Once the response is out, _run_route() has dealt with it
+            if stream.started:
+                raise
+
+            # E.g. the read replica couldn't be opened. The coroutine is
+            # waiting for a response, so it gets the 500.
+            traceback.print_exc()
+            stream.start(None)
+
+            return query_stats()
+
+    def _run_route(self, request, stream):
+        try:
+            response = compress_response(request, self.router.dispatch(request))
+        except Exception:
+            traceback.print_exc()
+            response = None
+
+        stream.start(response)
+
+        if response is None or response.chunks is None:
+            return query_stats()
+
+        chunks = iter(response.chunks)
+        end = _END
+
+        try:
+            for chunk in chunks:
+                data = chunk if isinstance(chunk, bytes) else chunk.encode()
+
+                if data and not stream.send(data):
+                    break
+        except Exception:
+            traceback.print_exc()
+            end = _FAILED
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+        stream.finish(end)
+
+        return query_stats()
+
+    def _head(self, status, content_length, headers, content_type, keep_alive,
+              empty=False, version=None):
+        """Builds the status line and headers of a response
+
+        Args:
+            content_length (number): the body size, None for streamed bodies
+            empty (boolean): the status never has a body (204, 304)
+            version (string): the request's HTTP version; HTTP/1.0 clients
+                are told when their connection is kept open
+        """
+        try:
+            phrase = HTTPStatus(status).phrase
+        except ValueError:
+            phrase = ""
+
+        lines = [f"HTTP/1.1 {status} {phrase}", f"Date: {self._http_date()}"]
+
+        if content_type is not None:
+            lines.append(f"Content-type: {content_type}")
+
+        lines.append("Access-Control-Allow-Origin: *")
+
+        for (name, value) in headers.items():
+            lines.append(f"{name}: {value}")
+
+        if content_length is not None and not empty:
+            lines.append(f"Content-Length: {content_length}")
+
+        if not keep_alive:
+            lines.append("Connection: close")
+        elif version == "HTTP/1.0":
+            # HTTP/1.0 closes by default, so keeping it open is announced
+            lines.append("Connection: keep-alive")
+
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def serve_asyncio(server_address, router, threads=16, max_queue=64, keepalive_timeout=75.0):
+    """Serves the router with AsyncHTTPServer until SIGINT/SIGTERM
+
+    Args:
+        server_address (tuple): the (host, port) to listen on
+        router (Router): the route table, e.g. routes.router
+        threads (number): worker threads running routes
+        max_queue (number): requests waiting for a worker before answering 503
+        keepalive_timeout (number): seconds an idle connection is kept open
+    """
+    server = AsyncHTTPServer(router, threads=threads, max_queue=max_queue,
+                             keepalive_timeout=keepalive_timeout)
+    asyncio.run(server.serve(*server_address))
@@ -0,0 +1,284 @@
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import config
+
+from .router import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Media types worth compressing. Everything this server sends is text.
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+class _GzipCompressor():
+    def __init__(self):
+        # wbits 31 writes a gzip header and trailer around the deflate data
+        self._compressor = zlib.compressobj(config.GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor():
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=config.BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+class _ZstdCompressor():
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=config.ZSTD_LEVEL).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+
+# Content codings this server can produce, best first. brotli and zstd are
+# only offered when their packages are installed.
+ENCODERS = OrderedDict()
+
+if brotli is not None:
+    ENCODERS["br"] = _BrotliCompressor
+
+if zstandard is not None:
+    ENCODERS["zstd"] = _ZstdCompressor
+
+ENCODERS["gzip"] = _GzipCompressor
+
+
+def negotiate(accept_encoding):
+    """Picks the content coding for a response from the request's
+    Accept-Encoding header
+
+    The client's q-values decide; between codings it likes equally, the
+    first one in ENCODERS wins.
+
+    Args:
+        accept_encoding (string): the header, e.g. "gzip, deflate, br;q=0.9"
+
+    Returns:
+        string: a key of ENCODERS, or None to send the body as it is
+    """
+    if not accept_encoding:
+        return None
+
+    weights = {}
+
+    for item in accept_encoding.split(","):
+        (name, _, params) = item.strip().partition(";")
+        quality = 1.0
+
+        for param in params.split(";"):
+            (key, _, value) = param.strip().partition("=")
+
+            if key == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        weights[name.strip().lower()] = quality
+
+    best = None
+    best_quality = 0.0
+
+    for name in ENCODERS:
+        quality = weights.get(name, weights.get("*", 0.0))
+
+        if quality > best_quality:
+            (best, best_quality) = (name, quality)
+
+    return best
+
+
+def _is_compressible(response):
+    return (response.status == 200 or response.status == 201) and \
+        'Content-Encoding' not in response.headers and \
+        response.content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+# (expires_at, media type, compressed body) keyed by (request target,
+# ETag, coding), oldest use first. A new ETag means the resource changed,
+# so bodies of older versions are never served; they just age out. Only
+# responses carrying an ETag are stored, and routes only attach one to a
+# body read at that version (see conditional() in routes.py). Bodies also
+# expire after config.CACHE_TTL seconds, like the views cache they are
+# often built from.
+_bodies = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "bytes": 0}
+
+
+def _store(key, content_type, body):
+    if len(body) > config.COMPRESSION_CACHE_MAX_BODY:
+        return
+
+    with _lock:
+        previous = _bodies.pop(key, None)
+        if previous is not None:
+            _stats["bytes"] -= len(previous[2])
+
+        _bodies[key] = (time.monotonic() + config.CACHE_TTL, content_type, body)
+        _stats["bytes"] += len(body)
+
+        while _stats["bytes"] > config.COMPRESSION_CACHE_BYTES:
+            (_, (_, _, evicted)) = _bodies.popitem(last=False)
+            _stats["bytes"] -= len(evicted)
+            _stats["evictions"] += 1
+
+
+def cached_response(request, etag):
+    """Finds an already compressed body for a conditional GET
+
+    Lets a route skip querying and serializing a resource that hasn't
+    changed since it was last compressed for this URL and coding.
+
+    Args:
+        request (Request): the request, for its target and Accept-Encoding
+        etag (string): the resource's current ETag
+
+    Returns:
+        Response: the compressed response, or None
+    """
+    encoding = negotiate(request.headers.get('Accept-Encoding'))
+
+    if encoding is None:
+        return None
+
+    key = (request.target, etag, encoding)
+
+    with _lock:
+        item = _bodies.get(key)
+
+        if item is not None and item[0] <= time.monotonic():
+            del _bodies[key]
+            _stats["bytes"] -= len(item[2])
+            _stats["expirations"] += 1
+            item = None
+
+        if item is None:
+            _stats["misses"] += 1
+            return None
+
+        _bodies.move_to_end(key)
+        _stats["hits"] += 1
+
+    (_, content_type, body) = item
+
+    return Response(200, body, content_type=content_type,
+                    headers={'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'})
+
+
+def compress_response(request, response):
+    """Compresses a route's response when the client accepts it
+
+    Bodies smaller than config.COMPRESSION_MIN_SIZE are sent as they are.
+    Streamed bodies are compressed chunk by chunk as they're produced.
+    Responses with an ETag are remembered for cached_response().
+
+    Args:
+        request (Request): the request, for its Accept-Encoding header
+        response (Response): what the route returned
+
+    Returns:
+        Response: the same response, changed in place
+    """
+    if response is None or not _is_compressible(response):
+        return response
+
+    response.headers['Vary'] = 'Accept-Encoding'
+    encoding = negotiate(request.headers.get('Accept-Encoding'))
+
+    if encoding is None:
+        return response
+
+    etag = response.headers.get('ETag')
+    key = (request.target, etag, encoding)
+
+    if response.chunks is not None:
+        response.chunks = _compress_chunks(response.chunks, ENCODERS[encoding](),
+                                           key if etag else None, response.content_type)
+    else:
+        body = response.body if isinstance(response.body, bytes) else response.body.encode()
+
+        if len(body) < config.COMPRESSION_MIN_SIZE:
+            return response
+
+        compressor = ENCODERS[encoding]()
+        response.body = compressor.compress(body) + compressor.flush()
+
+        if etag:
+            _store(key, response.content_type, response.body)
+
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _compress_chunks(chunks, compressor, key, content_type):
+    """Compresses a streamed body, keeping a copy for the cache as long as
+    it stays under config.COMPRESSION_CACHE_MAX_BODY
+    """
+    kept = [] if key is not None else None
+    size = 0
+
+    for chunk in chunks:
+        data = compressor.compress(chunk if isinstance(chunk, bytes) else chunk.encode())
+
+        if not data:
+            continue
+
+        if kept is not None:
+            size += len(data)
+
+            if size <= config.COMPRESSION_CACHE_MAX_BODY:
+                kept.append(data)
+            else:
+                kept = None
+
+        yield data
+
+    data = compressor.flush()
+
+    # Only a body streamed to the end is complete enough to cache
+    if kept is not None:
+        kept.append(data)
+        _store(key, content_type, b"".join(kept))
+
+    yield data
+
+
+def compression_stats():
+    """Returns the compressed body cache's counters
+
+    Returns:
+        dict: hits, misses, evictions, expirations, bytes held and number
+        of bodies
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats["size"] = len(_bodies)
+
+    return stats
@@ -0,0 +1,177 @@
+import threading
+from bisect import bisect_left
+
+
+# Upper bounds of the histogram buckets. Prometheus buckets are
+# cumulative, the counts are only summed up when the metrics are rendered.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# How a request's time is split up:
+#   sql: inside SQLite, see database.query_stats()
+#   write: writing the response to the socket
+#   serialize: everything else, mostly building the JSON body
+PHASES = ("sql", "serialize", "write")
+
+
+class Histogram():
+    """Counts observed values into fixed buckets
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One more slot for values above the largest bound (le="+Inf")
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        """Returns the histogram's lines in Prometheus text format
+        """
+        lines = []
+        total = 0
+
+        for (bound, count) in zip(self.buckets + ("+Inf", ), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {total}')
+
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+
+        return lines
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for (key, value) in labels.items())
+
+
+class Metrics():
+    """Request metrics of this process
+
+    Every server engine calls request_started() and request_finished()
+    around each request. In prefork mode each worker process has its own
+    metrics, and /metrics reports those of the worker that answered it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        # Keyed by (method, route, status)
+        self._responses = {}
+        # Keyed by (method, route)
+        self._durations = {}
+        self._sizes = {}
+        self._queries = {}
+        # Keyed by (method, route, phase)
+        self._phases = {}
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, method, route, status, duration, sql=0.0, write=0.0,
+                         queries=0, size=0):
+        """Records a finished request
+
+        Args:
+            method (string): the HTTP method
+            route (string): the matched route pattern, e.g. /entries/{id:int},
+                so every entry id shares one histogram
+            status (number): the response status code
+            duration (number): seconds from reading the request line to
+                writing the last byte of the response
+            sql (number): seconds of that spent in SQLite
+            write (number): seconds of that spent writing to the socket
+            queries (number): how many statements the request ran
+            size (number): bytes of response body sent
+        """
+        key = (method, route)
+        serialize = max(duration - sql - write, 0.0)
+
+        with self._lock:
+            self.in_flight -= 1
+
+            response_key = (method, route, status)
+            self._responses[response_key] = self._responses.get(response_key, 0) + 1
+
+            if key not in self._durations:
+                self._durations[key] = Histogram(LATENCY_BUCKETS)
+                self._sizes[key] = Histogram(SIZE_BUCKETS)
+                self._queries[key] = Histogram(QUERY_BUCKETS)
+
+            self._durations[key].observe(duration)
+            self._sizes[key].observe(size)
+            self._queries[key].observe(queries)
+
+            for (phase, seconds) in zip(PHASES, (sql, serialize, write)):
+                phase_key = (method, route, phase)
+                self._phases[phase_key] = self._phases.get(phase_key, 0.0) + seconds
+
+    def render(self):
+        """Returns the request metrics in Prometheus text format
+
+        Returns:
+            list: the lines of the exposition
+        """
+        with self._lock:
+            lines = [
+                "# HELP journal_requests_in_flight Requests being served right now",
+                "# TYPE journal_requests_in_flight gauge",
+                f"journal_requests_in_flight {self.in_flight}",
+                "# HELP journal_responses_total Responses sent",
+                "# TYPE journal_responses_total counter",
+            ]
+
+            for ((method, route, status), count) in sorted(self._responses.items()):
+                labels = _labels(method=method, route=route, status=status)
+                lines.append(f"journal_responses_total{{{labels}}} {count}")
+
+            for (name, help_text, histograms) in (
+                    ("journal_request_duration_seconds", "Time to serve a request",
+                     self._durations),
+                    ("journal_response_size_bytes", "Size of the response body",
+                     self._sizes),
+                    ("journal_request_queries", "SQL statements run per request",
+                     self._queries)):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+
+                for ((method, route), histogram) in sorted(histograms.items()):
+                    lines.extend(histogram.render(name, _labels(method=method, route=route)))
+
+            lines.append("# HELP journal_request_phase_seconds_total "
+                         "Time spent in SQL, serialization and socket writes")
+            lines.append("# TYPE journal_request_phase_seconds_total counter")
+
+            for ((method, route, phase), seconds) in sorted(self._phases.items()):
+                labels = _labels(method=method, route=route, phase=phase)
+                lines.append(f"journal_request_phase_seconds_total{{{labels}}} {seconds}")
+
+        return lines
+
+
+def render_stats(name, help_text, stats):
+    """Renders a dict of counters, like pool_stats() or cache_stats(), as
+    one gauge with a label per counter
+
+    Returns:
+        list: the lines of the exposition
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+
+    for (key, value) in sorted(stats.items()):
+        lines.append(f'{name}{{stat="{key}"}} {value}')
+
+    return lines
+
+
+# The metrics of this process
+metrics = Metrics()
@@ -0,0 +1,87 @@
+import os
+import signal
+import traceback
+
+from .access_log import start_access_log, stop_access_log
+from .profiling import stop_profiling
+from .threaded import BoundedThreadingHTTPServer, open_listening_socket, stop_on_signal
+
+
+def _serve_child(sock, server_address, handler_class, threads, max_queue):
+    """Runs one worker process's server on the inherited socket until it's
+    told to stop
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server = BoundedThreadingHTTPServer(server_address, handler_class,
+                                        threads=threads, max_queue=max_queue,
+                                        bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    signal.signal(signal.SIGTERM, stop_on_signal(server))
+    start_access_log()
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        # os._exit() skips the normal shutdown, so flush the log and the
+        # profiles first
+        stop_access_log()
+        stop_profiling()
+
+
+def serve_prefork(server_address, handler_class, processes, threads=16, max_queue=64):
+    """Forks worker processes that all accept connections from one socket
+
+    The parent binds the socket, forks the workers and then only waits for
+    them. SIGINT/SIGTERM in the parent are forwarded to every worker, and
+    each worker stops accepting, finishes its in-flight requests and exits.
+
+    Args:
+        server_address (tuple): the (host, port) to listen on
+        handler_class (class): the request handler, e.g. HandleRequests
+        processes (number): how many worker processes to fork
+        threads (number): worker threads per process
+        max_queue (number): queued requests per process before answering 503
+    """
+    sock = open_listening_socket(server_address)
+    children = []
+
+    for _ in range(processes):
+        pid = os.fork()
+
+        if pid == 0:
+            # Worker process. Whatever happens it leaves through os._exit(),
+            # so an exception can never drop it into the parent's loop
+            # below and have it fork workers of its own.
+            try:
+                _serve_child(sock, server_address, handler_class, threads, max_queue)
+            except BaseException:
+                traceback.print_exc()
+                os._exit(1)
+
+            os._exit(0)
+
+        children.append(pid)
+
+    def forward(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGTERM, forward)
+
+    for child in children:
+        while True:
+            try:
+                os.waitpid(child, 0)
+                break
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+
+    sock.close()
@@ -0,0 +1,185 @@
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+from contextlib import contextmanager
+
+import config
+
+
+# Imported by start_profiling()
+cProfile = None
+pstats = None
+
+# Set by start_profiling(); None while profiling is off
+_directory = None
+_sample_rate = 0.0
+
+# pstats.Stats per "METHOD /route", merged from every sampled request
+_profiles = {}
+_lock = threading.Lock()
+_stopped = threading.Event()
+_dumper = None
+
+
+def start_profiling(directory, sample_rate=None):
+    """Starts collecting cProfile samples of requests into `directory`
+
+    Each process writes its own files, named after its pid, so prefork
+    workers don't overwrite each other:
+        <pid>-<route>.prof: the merged samples of one route, for pstats or
+            snakeviz
+        <pid>-summary.txt: the top functions of every route by cumulative time
+
+    They are written every config.PROFILE_DUMP_INTERVAL seconds and by
+    stop_profiling().
+
+    Args:
+        directory (string): where the files go; created if needed
+        sample_rate (number): the share of requests to profile, 0 to 1,
+            config.PROFILE_SAMPLE_RATE by default
+    """
+    global _directory, _sample_rate, _dumper, cProfile, pstats
+
+    # Only loaded when profiling, so they don't slow down every start
+    import cProfile
+    import pstats
+
+    os.makedirs(directory, exist_ok=True)
+
+    _directory = directory
+    _sample_rate = config.PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+
+    _stopped.clear()
+    _dumper = threading.Thread(target=_dump_periodically, name="profile-dump", daemon=True)
+    _dumper.start()
+
+
+@contextmanager
+def profiled(request):
+    """Profiles the block when profiling is on and the request is sampled
+
+    The block should cover sending the response as well, since streamed
+    bodies are read from the database while they're written.
+
+    Args:
+        request (Request): the request, for the route its samples are
+            filed under once the block has run
+    """
+    if _directory is None or random.random() >= _sample_rate:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    profile.enable()
+
+    try:
+        yield
+    finally:
+        profile.disable()
+        _record(f"{request.method} {request.route or 'unmatched'}", profile)
+
+
+def _record(key, profile):
+    with _lock:
+        stats = _profiles.get(key)
+
+        if stats is None:
+            _profiles[key] = pstats.Stats(profile)
+        else:
+            stats.add(profile)
+
+
+def _file_name(key):
+    return re.sub(r"[^A-Za-z0-9]+", "_", key).strip("_")
+
+
+def dump_profiles():
+    """Writes the samples collected so far, see start_profiling()
+    """
+    if _directory is None:
+        return
+
+    pid = os.getpid()
+    summary = io.StringIO()
+
+    with _lock:
+        for (key, stats) in sorted(_profiles.items()):
+            stats.dump_stats(os.path.join(_directory, f"{pid}-{_file_name(key)}.prof"))
+
+            summary.write(f"==== {key}\n")
+            stats.stream = summary
+            stats.sort_stats("cumulative").print_stats(25)
+
+    with open(os.path.join(_directory, f"{pid}-summary.txt"), "w") as output:
+        output.write(summary.getvalue())
+
+
+def _dump_periodically():
+    while not _stopped.wait(config.PROFILE_DUMP_INTERVAL):
+        dump_profiles()
+
+
+def stop_profiling():
+    """Writes out the samples and stops profiling
+    """
+    global _directory, _dumper
+
+    if _directory is None:
+        return
+
+    _stopped.set()
+    _dumper.join()
+    dump_profiles()
+
+    _directory = None
+    _dumper = None
+
+
+def record_import_times(directory, module, path):
+    """Measures how long importing `module` takes, module by module
+
+    A fresh interpreter imports it with -X importtime, so the figures are
+    those of a cold start. It runs in the background and writes
+    <directory>/import-times.txt, sorted by cumulative microseconds.
+
+    Args:
+        directory (string): where the file goes
+        module (string): the module to import, e.g. "request_handler"
+        path (string): the directory it is imported from
+    """
+    import subprocess
+
+    def run():
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                text=True, cwd=path)
+
+        # "import time: self [us] | cumulative | imported package"
+        lines = [line for line in result.stderr.splitlines()
+                 if line.startswith("import time:") and "self [us]" not in line]
+        lines.sort(key=lambda line: -int(line.split("|")[1]))
+
+        with open(os.path.join(directory, "import-times.txt"), "w") as output:
+            output.write("self [us] | cumulative [us] | module\n")
+            output.write("\n".join(line[len("import time:"):].strip() for line in lines))
+            output.write("\n")
+
+    threading.Thread(target=run, name="import-times", daemon=True).start()
+
+
+def record_startup(directory, phases):
+    """Writes how long each startup step took, in milliseconds, to
+    <directory>/startup.json
+
+    Args:
+        directory (string): where the file goes
+        phases (dict): step name -> seconds
+    """
+    with open(os.path.join(directory, "startup.json"), "w") as output:
+        json.dump({name: round(seconds * 1000, 3) for (name, seconds) in phases.items()},
+                  output, indent=2)
+        output.write("\n")
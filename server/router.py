@@ -0,0 +1,213 @@
+import json
+import re
+from urllib.parse import parse_qs, urlsplit
+
+
+class Request():
+    """What a route handler gets to know about an HTTP request
+
+    The server engine builds one per request, so handlers don't depend on
+    BaseHTTPRequestHandler or any other server class.
+    """
+
+    def __init__(self, method, target, headers, rfile=None, content_length=0):
+        """
+        Args:
+            method (string): GET, POST, PUT or DELETE
+            target (string): the path and query string, e.g. /entries?limit=5
+            headers (Message): the request headers
+            rfile (file): the request body stream
+            content_length (number): the size of the body in bytes
+        """
+        url = urlsplit(target)
+
+        self.method = method
+        self.target = target
+        self.path = url.path.rstrip("/") or "/"
+        # parse_qs decodes the values and keeps every parameter, so turn
+        # its lists into single values: { 'limit': '10', 'after': '20' }
+        self.query = {key: values[-1] for (key, values) in parse_qs(url.query).items()}
+        self.headers = headers
+        self.params = {}
+        # The pattern of the route that matched, set by Router.dispatch()
+        self.route = None
+        self._rfile = rfile
+        self._remaining = content_length
+
+    def read(self):
+        """Reads the whole request body
+
+        Returns:
+            bytes: the body
+        """
+        data = self._rfile.read(self._remaining) if self._remaining > 0 else b""
+        self._remaining = 0
+        return data
+
+    def json(self):
+        """Reads the whole request body as JSON
+
+        Raises:
+            ValueError: when the body isn't valid JSON
+        """
+        return json.loads(self.read())
+
+    def lines(self):
+        """Reads the request body one line at a time as it arrives
+
+        Returns:
+            generator: the lines of the body, as bytes
+        """
+        while self._remaining > 0:
+            line = self._rfile.readline(self._remaining)
+
+            if not line:
+                break
+
+            self._remaining -= len(line)
+            yield line
+
+    @property
+    def fully_read(self):
+        """True once the handler has consumed the whole body"""
+        return self._remaining <= 0
+
+
+class Response():
+    """What a route handler sends back
+
+    A response has either a complete body or an iterable of chunks that
+    the engine streams with chunked transfer encoding. Bodies and chunks
+    are strings, or bytes once they've been compressed.
+    """
+
+    def __init__(self, status, body="", headers=None, chunks=None,
+                 content_type="application/json"):
+        self.status = status
+        self.body = body
+        self.headers = dict(headers or {})
+        self.chunks = chunks
+        self.content_type = content_type
+
+
+def json_response(status, data):
+    """Builds a response holding a JSON document
+    """
+    return Response(status, json.dumps(data))
+
+
+# {name} in a route pattern matches one path segment, {name:int} only
+# digits, which are handed to the handler as an int
+PARAMETER = re.compile(r"{(\w+)(?::(int))?}")
+
+
+class Router():
+    """Maps (method, path pattern) pairs to route handlers
+
+    Patterns are compiled when routes are added. Paths without parameters
+    are looked up in a dictionary, and patterns with parameters are grouped
+    by their first path segment, so dispatch doesn't get slower as more
+    resources are added.
+    """
+
+    def __init__(self):
+        self._static = {}
+        self._dynamic = {}
+        self._methods = {}
+
+    def add(self, method, pattern, handler):
+        """Registers a route
+
+        Args:
+            method (string): the HTTP method
+            pattern (string): the path, e.g. /entries or /entries/{id:int}
+            handler (function): called with the Request and the path
+                parameters as keyword arguments; returns a Response
+        """
+        if not PARAMETER.search(pattern):
+            self._static[(method, pattern)] = (handler, pattern)
+            self._methods.setdefault(pattern, set()).add(method)
+            return
+
+        converters = {}
+        regex = ""
+        position = 0
+
+        for match in PARAMETER.finditer(pattern):
+            (name, kind) = match.groups()
+            regex += re.escape(pattern[position:match.start()])
+            regex += r"(?P<%s>\d+)" % name if kind == "int" else r"(?P<%s>[^/]+)" % name
+            converters[name] = int if kind == "int" else str
+            position = match.end()
+
+        regex += re.escape(pattern[position:])
+
+        segment = pattern.split("/")[1]
+        self._dynamic.setdefault(segment, []).append(
+            (method, re.compile(regex + "$"), converters, handler, pattern))
+
+    def route(self, method, pattern):
+        """Decorator form of add()
+        """
+        def register(handler):
+            self.add(method, pattern, handler)
+            return handler
+
+        return register
+
+    def match(self, method, path):
+        """Finds the handler for a request
+
+        Returns:
+            tuple: (handler, params, allowed, pattern) where handler and
+            pattern are None when nothing matched, and allowed lists the
+            methods the path does support (empty when the path itself is
+            unknown)
+        """
+        found = self._static.get((method, path))
+
+        if found is not None:
+            return (found[0], {}, None, found[1])
+
+        allowed = set(self._methods.get(path, ()))
+
+        for (route_method, regex, converters, route_handler, pattern) in self._dynamic.get(
+                path.split("/")[1] if path != "/" else "", ()):
+            found = regex.match(path)
+
+            if found is None:
+                continue
+
+            if route_method == method:
+                params = {name: converters[name](value)
+                          for (name, value) in found.groupdict().items()}
+                return (route_handler, params, None, pattern)
+
+            allowed.add(route_method)
+
+        return (None, {}, sorted(allowed), None)
+
+    def dispatch(self, request):
+        """Runs the handler for a request and returns its response
+
+        Unknown paths get a 404, known paths with the wrong method a 405,
+        and handlers raising ValueError (bad query parameters, malformed
+        JSON) a 400.
+        """
+        (handler, params, allowed, pattern) = self.match(request.method, request.path)
+
+        if handler is None:
+            if allowed:
+                response = json_response(405, {"message": "Method not allowed"})
+                response.headers['Allow'] = ", ".join(allowed)
+                return response
+
+            return json_response(404, {"message": "Not found"})
+
+        request.params = params
+        request.route = pattern
+
+        try:
+            return handler(request, **params)
+        except ValueError as ex:
+            return json_response(400, {"message": str(ex)})
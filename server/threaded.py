@@ -0,0 +1,110 @@
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+
+
+# Sent straight to the socket when the server is too busy to accept
+# another request. The request is never parsed, so the response is
+# written by hand instead of going through HandleRequests.
+SERVICE_UNAVAILABLE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"Retry-After: 1\r\n"
+    b"Content-Length: 2\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b"{}"
+)
+
+
+class BoundedThreadingHTTPServer(HTTPServer):
+    """An HTTPServer that handles requests on a fixed pool of worker threads
+
+    Connections waiting for a free worker are counted, and once that count
+    reaches max_queue new connections are answered with a 503 instead of
+    piling up behind slow requests.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, threads=16, max_queue=64,
+                 bind_and_activate=True):
+        """
+        Args:
+            server_address (tuple): the (host, port) to listen on
+            handler_class (class): the request handler, e.g. HandleRequests
+            threads (number): how many requests are served at the same time
+            max_queue (number): how many accepted requests may wait for a worker
+        """
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=threads,
+                                            thread_name_prefix="journal-worker")
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        """Hands the connection to the worker pool, or rejects it when the
+        pool is already backed up
+        """
+        with self._lock:
+            if self._pending >= self.max_queue:
+                rejected = True
+            else:
+                rejected = False
+                self._pending += 1
+
+        if rejected:
+            self._reject(request)
+            return
+
+        self._executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        with self._lock:
+            self._pending -= 1
+
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def _reject(self, request):
+        try:
+            request.sendall(SERVICE_UNAVAILABLE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        """Stops listening and waits for in-flight requests to finish
+        """
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+def stop_on_signal(server):
+    """Returns a signal handler that shuts the server down gracefully
+
+    serve_forever() runs on the thread that receives the signal, and
+    shutdown() blocks until serve_forever() returns, so the shutdown has
+    to be requested from another thread.
+    """
+    def handler(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    return handler
+
+
+def open_listening_socket(server_address, backlog=128):
+    """Binds a listening socket that can be shared by several processes
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(server_address)
+    sock.listen(backlog)
+    return sock
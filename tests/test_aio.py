@@ -0,0 +1,122 @@
+"""Tests for the asyncio server engine in server/aio.py
+
+    python -m unittest tests.test_aio
+"""
+import asyncio
+import sqlite3
+import unittest
+from unittest import mock
+
+from database import connection
+from server import Response, Router
+from server.aio import MAX_HEADERS, MAX_LINE, AsyncHTTPServer, _BadRequest
+
+
+def _router():
+    router = Router()
+
+    @router.route("GET", "/ping")
+    def ping(request):
+        return Response(200, '{"pong": true}')
+
+    return router
+
+
+async def _exchange(server, data):
+    """Sends raw bytes to the server on a fresh connection and returns
+    everything it writes back until it closes the connection
+    """
+    listener = await asyncio.start_server(server._connection, "127.0.0.1", 0)
+
+    async with listener:
+        port = listener.sockets[0].getsockname()[1]
+        (reader, writer) = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(data)
+        await writer.drain()
+
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+
+    return response
+
+
+def exchange(data):
+    server = AsyncHTTPServer(_router(), threads=2, max_queue=2, keepalive_timeout=1)
+
+    try:
+        return asyncio.run(_exchange(server, data))
+    finally:
+        server._executor.shutdown()
+
+
+def read_head(data):
+    """Runs the request head parser over raw bytes"""
+    async def parse():
+        reader = asyncio.StreamReader(limit=MAX_LINE)
+        reader.feed_data(data)
+        reader.feed_eof()
+
+        return await AsyncHTTPServer(_router(), threads=1)._read_head(reader)
+
+    return asyncio.run(parse())
+
+
+class _FailingReplica():
+    def pin(self):
+        raise sqlite3.OperationalError("unable to open database file")
+
+
+class RequestHeadTests(unittest.TestCase):
+
+    def assertBadRequest(self, data, status):
+        with self.assertRaises(_BadRequest) as raised:
+            read_head(data)
+
+        self.assertEqual(raised.exception.status, status)
+
+    def test_parses_request_line_and_headers(self):
+        (method, target, version, headers) = read_head(
+            b"\r\nGET /entries?limit=5 HTTP/1.1\r\nHost: localhost\r\nIf-None-Match: \"1\"\r\n\r\n")
+
+        self.assertEqual((method, target, version), ("GET", "/entries?limit=5", "HTTP/1.1"))
+        self.assertEqual(headers["host"], "localhost")
+        self.assertEqual(headers["If-None-Match"], '"1"')
+
+    def test_closed_connection_is_none(self):
+        self.assertIsNone(read_head(b""))
+        self.assertIsNone(read_head(b"\r\n\r\n"))
+
+    def test_bad_request_line(self):
+        for line in (b"GET /\r\n", b"GET / HTTP/2\r\n", b"GET / HTTP/1.1 extra\r\n"):
+            with self.subTest(line=line):
+                self.assertBadRequest(line + b"\r\n", 400)
+
+    def test_too_many_headers(self):
+        headers = b"".join(b"X-%d: 1\r\n" % n for n in range(MAX_HEADERS + 1))
+        self.assertBadRequest(b"GET / HTTP/1.1\r\n" + headers + b"\r\n", 431)
+
+    def test_header_line_too_long(self):
+        self.assertBadRequest(b"GET / HTTP/1.1\r\nX-Long: " + b"a" * MAX_LINE + b"\r\n\r\n",
+                              431)
+
+
+class AsyncServerTests(unittest.TestCase):
+
+    def test_replica_failure_answers_500(self):
+        with mock.patch.object(connection, "_replica", _FailingReplica()), \
+                mock.patch("server.aio.traceback.print_exc"):
+            response = exchange(b"GET /ping HTTP/1.1\r\nConnection: close\r\n\r\n")
+
+        self.assertTrue(response.startswith(b"HTTP/1.1 500 "), response)
+
+    def test_http_1_0_keep_alive_is_confirmed(self):
+        response = exchange(b"GET /ping HTTP/1.0\r\nConnection: keep-alive\r\n\r\n"
+                            b"GET /ping HTTP/1.0\r\n\r\n")
+        (first, second) = response.split(b"HTTP/1.1 200 OK")[1:]
+
+        self.assertIn(b"\r\nConnection: keep-alive\r\n", first)
+        self.assertIn(b"\r\nConnection: close\r\n", second)
+
+
+if __name__ == "__main__":
+    unittest.main()
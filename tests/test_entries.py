@@ -0,0 +1,139 @@
+"""Tests for the entry routes, run through the router against a
+generated database
+
+    python -m unittest tests.test_entries
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import config
+from benchmarks.generate import generate
+from database import close_connection
+from routes import router
+from server import Request
+
+
+class _Body():
+    """Stands in for the request body stream"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size):
+        return self.data[:size]
+
+
+def request(method, target, body=None, headers=None):
+    data = b"" if body is None else json.dumps(body).encode()
+
+    return router.dispatch(Request(method, target, headers or {}, _Body(data), len(data)))
+
+
+class EntryRouteTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.database_path = config.DATABASE_PATH
+        config.DATABASE_PATH = os.path.join(cls.directory, "entries.sqlite3")
+        generate(config.DATABASE_PATH, entries=50)
+        close_connection()
+
+    @classmethod
+    def tearDownClass(cls):
+        close_connection()
+        config.DATABASE_PATH = cls.database_path
+        shutil.rmtree(cls.directory)
+
+    def assertBadRequest(self, response, message):
+        self.assertEqual(response.status, 400)
+        self.assertIn(message, json.loads(response.body)["message"])
+
+    def entry_ids(self):
+        response = request("GET", "/entries")
+        return [entry["id"] for entry in json.loads("".join(response.chunks))]
+
+    def test_current_etag_is_not_modified(self):
+        etag = request("GET", "/entries?limit=5").headers["ETag"]
+        response = request("GET", "/entries?limit=5", headers={"If-None-Match": etag})
+
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+
+    def test_etag_is_stale_after_a_write(self):
+        etag = request("GET", "/entries?limit=5").headers["ETag"]
+        self.assertEqual(request("POST", "/entries", {"concept": "Python", "entry": "Stale",
+                                                      "date": "2024-01-02", "moodId": 1,
+                                                      "tags": []}).status, 201)
+
+        response = request("GET", "/entries?limit=5", headers={"If-None-Match": etag})
+        self.assertEqual(response.status, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_bulk_rejects_non_objects(self):
+        entries = [{"concept": "Python", "entry": "x", "date": "2024-01-01", "moodId": 1}, 7]
+        self.assertBadRequest(request("POST", "/entries/bulk", entries),
+                              "Entry 2 must be a JSON object")
+
+    def test_bulk_saves_nothing_when_an_entry_is_invalid(self):
+        before = self.entry_ids()
+        entries = [{"concept": "Python", "entry": "x", "date": "2024-01-01", "moodId": 1},
+                   {"concept": "Python", "entry": "y", "moodId": 1}]
+
+        self.assertBadRequest(request("POST", "/entries/bulk", entries),
+                              "Entry 2 is missing date")
+        self.assertEqual(self.entry_ids(), before)
+
+    def test_bulk_saves_every_entry(self):
+        before = self.entry_ids()
+        entries = [{"concept": "Python", "entry": str(n), "date": "2024-01-01", "moodId": 1,
+                    "tags": [1]}
+                   for n in range(5)]
+
+        response = request("POST", "/entries/bulk?batch_size=2", entries)
+        self.assertEqual(response.status, 201)
+        self.assertEqual(self.entry_ids(), before + json.loads(response.body)["ids"])
+
+    def test_create_without_a_field_is_a_bad_request(self):
+        self.assertBadRequest(request("POST", "/entries", {"concept": "Python", "entry": "x",
+                                                           "date": "2024-01-01", "tags": []}),
+                              "missing moodId")
+
+    def test_create_with_a_non_object_is_a_bad_request(self):
+        self.assertBadRequest(request("POST", "/entries", [1, 2]), "must be a JSON object")
+
+    def test_update_without_tags_is_a_bad_request(self):
+        self.assertBadRequest(request("PUT", "/entries/1", {"concept": "Python", "entry": "x",
+                                                            "date": "2024-01-01",
+                                                            "moodId": 1}),
+                              "missing tags")
+
+    def test_after_out_of_range_is_a_bad_request(self):
+        for after in ("-1", str(2 ** 64)):
+            self.assertBadRequest(request("GET", f"/entries?after={after}&tag_id=1"),
+                                  "after must be an entry id")
+
+    def test_create_and_update(self):
+        entry = {"concept": "Python", "entry": "Tests", "date": "2024-01-01",
+                 "moodId": 1, "tags": [1]}
+        response = request("POST", "/entries", entry)
+        self.assertEqual(response.status, 201)
+
+        id = json.loads(response.body)["id"]
+        self.assertEqual(request("PUT", f"/entries/{id}", dict(entry, tags=[2])).status, 204)
+        self.assertEqual(json.loads(request("GET", f"/entries/{id}").body)["tags"][0]["id"], 2)
+
+        # The tag index moved the entry from tag 1 to tag 2
+        def tagged(tag_id):
+            response = request("GET", f"/entries?tag_id={tag_id}&after={id - 1}")
+            return [entry["id"] for entry in json.loads("".join(response.chunks))]
+
+        self.assertEqual(tagged(1), [])
+        self.assertEqual(tagged(2), [id])
+
+
+if __name__ == "__main__":
+    unittest.main()
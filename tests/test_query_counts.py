@@ -0,0 +1,88 @@
+"""Checks that listing entries runs the same few statements however many
+entries there are, so no per-row (N+1) query creeps back in
+
+    python -m unittest tests.test_query_counts
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import config
+from benchmarks.generate import generate
+from database import close_connection, query_stats, reset_query_stats
+from routes import router
+from server import Request
+from views import build_entry_index
+
+
+# Entries in the small database; the large one has ten times as many
+ENTRIES = 200
+
+# The most statements a listing may run: the ETag's counter before and
+# after the body, and the listing's own queries
+MAX_QUERIES = 4
+
+LISTINGS = [
+    "/entries",
+    "/entries?limit=50&after=20",
+    "/entries?fields=id,concept,tags",
+    "/entries?tag_id=1,2&match=any",
+    "/entries?mood_id=1&from=2000-01-01",
+]
+
+
+class ListingQueryCountTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.databases = {}
+
+        for count in (ENTRIES, ENTRIES * 10):
+            path = os.path.join(cls.directory, f"entries-{count}.sqlite3")
+            generate(path, entries=count)
+            cls.databases[count] = path
+
+        cls.database_path = config.DATABASE_PATH
+
+    @classmethod
+    def tearDownClass(cls):
+        close_connection()
+        config.DATABASE_PATH = cls.database_path
+        shutil.rmtree(cls.directory)
+
+    def count_queries(self, count, target):
+        """Runs GET target against the database of `count` entries
+
+        Returns:
+            number: the statements the route ran
+        """
+        close_connection()
+        config.DATABASE_PATH = self.databases[count]
+        build_entry_index()
+
+        # Opening the connection isn't part of the route
+        close_connection()
+        reset_query_stats()
+
+        response = router.dispatch(Request("GET", target, {}))
+        self.assertEqual(response.status, 200)
+
+        for _ in response.chunks or ():
+            pass
+
+        return query_stats()[0]
+
+    def test_listing_queries_do_not_grow_with_entries(self):
+        for target in LISTINGS:
+            with self.subTest(target=target):
+                small = self.count_queries(ENTRIES, target)
+                large = self.count_queries(ENTRIES * 10, target)
+
+                self.assertEqual(small, large)
+                self.assertLessEqual(large, MAX_QUERIES)
+
+
+if __name__ == "__main__":
+    unittest.main()
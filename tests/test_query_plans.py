@@ -0,0 +1,157 @@
+"""Checks that the entry and tag lookups are answered from the indexes of
+the add_lookup_indexes and add_unique_entry_tags migrations
+
+    python -m unittest tests.test_query_plans
+"""
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import config
+from benchmarks.generate import generate
+from database import close_connection, primary_connection
+from views.entry_index import entry_index
+from views.entry_requests import _delete_entry, _iter_entries, _iter_tags, _update_entry
+
+
+# A full read of the link table, under its name or its alias
+SCAN_ENTRYTAGS = re.compile(r"\bSCAN (Entrytags|et)\b")
+
+# A full read of a table, as opposed to the json_each list of ids
+SCAN_TABLE = re.compile(r"^SCAN (?!json_each\b)")
+
+
+class ExplainCursor():
+    """Stands in for a cursor and returns the query plan of the statement
+    instead of running it
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=()):
+        return [row[3] for row in self.conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+class QueryPlanTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Enough rows for ANALYZE to give the planner realistic statistics
+        cls.directory = tempfile.mkdtemp()
+        path = os.path.join(cls.directory, "plans.sqlite3")
+        generate(path, entries=1000)
+
+        cls.conn = sqlite3.connect(path)
+
+        # The listing and the entry index read through the server's own
+        # connection
+        cls.database_path = config.DATABASE_PATH
+        config.DATABASE_PATH = path
+        close_connection()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.conn.close()
+        close_connection()
+        config.DATABASE_PATH = cls.database_path
+        shutil.rmtree(cls.directory)
+
+    def plan(self, sql, params=()):
+        return ExplainCursor(self.conn).execute(sql, params)
+
+    def traced(self, func):
+        """Runs func(conn) on the server's connection and returns the entry
+        and tag statements it executed, with their parameters filled in
+        """
+        statements = []
+
+        with primary_connection() as conn:
+            conn.set_trace_callback(statements.append)
+
+            try:
+                func(conn)
+            finally:
+                conn.set_trace_callback(None)
+
+        # Trigger bodies are traced as comments; their plans aren't shown.
+        # executemany() traces each row, so repeats are dropped.
+        return [sql for sql in dict.fromkeys(statements)
+                if not sql.startswith("--") and re.search(r"\bEntr(ies|ytags)\b", sql)]
+
+    def assertUsesIndex(self, plan, index):
+        self.assertTrue(any(re.search(rf"USING (COVERING )?INDEX {index}\b", step)
+                            for step in plan), plan)
+
+        for step in plan:
+            self.assertIsNone(SCAN_ENTRYTAGS.search(step), plan)
+
+    def test_index_rebuild_reads_each_table_once(self):
+        statements = self.traced(entry_index.rebuild)
+        self.assertEqual(len(statements), 2, statements)
+
+        # A rebuild loads everything, so one scan per statement is the
+        # point; the joined entry is looked up by its id
+        for sql in statements:
+            with self.subTest(sql=sql):
+                plan = self.plan(sql)
+                self.assertEqual(len([step for step in plan if SCAN_TABLE.match(step)]), 1, plan)
+                self.assertTrue(all(step.startswith(("SCAN", "SEARCH e USING INTEGER PRIMARY KEY"))
+                                    for step in plan), plan)
+
+    def test_filtered_listings_read_only_matching_entries(self):
+        listings = (
+            {"tag_id": "1,2", "match": "any"},
+            {"mood_id": "1", "fields": "id,concept,tags"},
+            {"tag_id": "1", "from": "2020-01-01", "to": "2030-01-01", "fields": "id,tags"},
+        )
+
+        # Only the listing's own statements, not a rebuild of a stale index
+        entry_index.refresh()
+
+        for filters in listings:
+            with self.subTest(**filters):
+                statements = self.traced(lambda conn: list(_iter_entries(limit=10, **filters)))
+                self.assertTrue(statements)
+
+                for sql in statements:
+                    plan = self.plan(sql)
+                    self.assertFalse([step for step in plan if SCAN_TABLE.match(step)], plan)
+
+                    if "Entrytags" in sql:
+                        self.assertUsesIndex(plan, "entrytags_entry_tag")
+
+    def test_listing_tags_use_entry_index(self):
+        for after in (0, 500):
+            with self.subTest(after=after):
+                self.assertUsesIndex(_iter_tags(ExplainCursor(self.conn), after),
+                                     "entrytags_entry_tag")
+
+    def test_tags_by_ids_use_entry_index(self):
+        self.assertUsesIndex(_iter_tags(ExplainCursor(self.conn), entry_ids=[1, 2, 3]),
+                             "entrytags_entry_tag")
+
+    def test_writes_find_links_by_index(self):
+        def write(conn):
+            try:
+                _update_entry(conn, 1, {"concept": "Python", "entry": "Plans",
+                                        "date": "2024-01-01", "moodId": 1, "tags": [2, 3]})
+                _delete_entry(conn, 2)
+            finally:
+                conn.rollback()
+
+        lookups = [sql for sql in self.traced(write)
+                   if "Entrytags" in sql and not sql.lstrip().startswith("INSERT")]
+
+        self.assertTrue(lookups)
+
+        for sql in lookups:
+            with self.subTest(sql=sql):
+                self.assertUsesIndex(self.plan(sql), "entrytags_entry_tag")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,6 @@
-from .entry_requests import get_all_entries, get_single_entry, delete_entry, search_entries, create_journal_entry, update_entry
+from .entry_requests import get_all_entries, stream_all_entries, get_single_entry, delete_entry, search_entries, get_entries_by_ids, get_entry_changes, create_journal_entry, create_journal_entries, export_entries, update_entry, start_write_queue, write_queue_stats
 from .mood_requests import get_all_moods
-from .tag_requests import get_all_tags, get_single_tag
\ No newline at end of file
+from .tag_requests import get_all_tags, get_single_tag, get_tags_by_ids
+from .cache import cache_stats
+from .stats_requests import get_entry_stats
+from .entry_index import build_entry_index
@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+import config
+from database import get_resource_version
+
+
+# Serialized JSON responses keyed by (function name, arguments), oldest
+# use first. Each value is (expires_at, version, response), where version
+# is the (version, modified) of the resource the response was read at.
+_entries = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "outdated": 0}
+
+
+def cached(resource):
+    """Caches the JSON string a views function returns for its arguments
+
+    Each response is stored with the version of `resource` it was read at
+    (see database/versions.py) and only served while the resource is still
+    at that version, so a write made by this or any other process never
+    leaves a stale response behind. A response is only stored when the
+    version is the same before and after it was read, i.e. when no write
+    landed in between.
+
+    The version is the only invalidation there is. Every write to entries
+    bumps the one entries counter, so it outdates every cached entry, not
+    just the ones it touched; responses it outdated are dropped when they
+    are next looked up, or evicted. A hit costs the version lookup, one
+    read of an indexed row, in place of the function's queries and the
+    serialization.
+
+    With the read replica running, the versions are read from the copy the
+    request is pinned to. A response read from an older copy carries that
+    copy's version, so requests pinned to a newer copy never get it.
+
+    The cache holds at most config.CACHE_MAX_ENTRIES responses, evicting
+    the least recently used one, and each response expires after
+    config.CACHE_TTL seconds.
+
+    Args:
+        resource (string): the write counter the function's responses
+            follow: entries, moods or tags
+    """
+    def decorate(func):
+        name = func.__name__
+
+        @wraps(func)
+        def wrapper(*args):
+            key = (name, ) + args
+            now = time.monotonic()
+            version = get_resource_version(resource)
+
+            with _lock:
+                item = _entries.get(key)
+
+                if item is not None and item[0] > now and item[1] == version:
+                    _entries.move_to_end(key)
+                    _stats["hits"] += 1
+                    return item[2]
+
+                if item is not None:
+                    del _entries[key]
+                    _stats["expirations" if item[0] <= now else "outdated"] += 1
+
+                _stats["misses"] += 1
+
+            response = func(*args)
+
+            # A write landed while the response was read, so it may hold
+            # either version; it's returned but not kept
+            if get_resource_version(resource) != version:
+                return response
+
+            with _lock:
+                _entries[key] = (now + config.CACHE_TTL, version, response)
+                _entries.move_to_end(key)
+
+                while len(_entries) > config.CACHE_MAX_ENTRIES:
+                    _entries.popitem(last=False)
+                    _stats["evictions"] += 1
+
+            return response
+
+        return wrapper
+
+    return decorate
+
+
+def cache_stats():
+    """Returns the cache's counters
+
+    Returns:
+        dict: hits, misses, evictions, expirations, responses dropped
+        because their resource was written to since (outdated), the number
+        of cached responses and the hit rate
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats["size"] = len(_entries)
+
+    requests = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / requests if requests else 0.0
+
+    return stats
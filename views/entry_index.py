@@ -0,0 +1,191 @@
+import threading
+
+from database import primary_connection, read_version
+
+# What EntryIndex.rebuild() reads: every entry's mood, then every entry's tags
+ENTRY_MOODS = "SELECT e.id, e.mood_id FROM Entries e"
+
+ENTRY_TAGS = """
+SELECT et.entry_id, et.tag_id
+FROM Entrytags et
+JOIN Entries e
+    ON e.id = et.entry_id
+"""
+
+
+class EntryIndex():
+    """In-memory inverted index from tag ids and mood ids to entry ids
+
+    Each tag and mood maps to a bitmap: a Python int with bit N set when
+    entry N has that tag or mood. AND/OR of several tags is then a single
+    big-int operation instead of a table scan.
+
+    The index remembers the entries version (see ResourceVersions) it
+    reflects. Write paths report the version before and after their change
+    so the index can be updated in place; anything it didn't see, like a
+    write from another process, shows up as a version mismatch and the
+    index is rebuilt on the next read.
+
+    Next to the bitmaps it keeps each entry's own mood and tags, so a write
+    only has to clear the bits that entry actually had.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tags = {}
+        self._moods = {}
+        self._entries = {}
+        self.version = None
+
+    def rebuild(self, conn):
+        """Loads the whole index from the database
+
+        Args:
+            conn (sqlite3.Connection): the connection to read with
+        """
+        tags = {}
+        moods = {}
+        entries = {}
+
+        # Read the version and the rows from the same snapshot
+        with conn:
+            conn.execute("BEGIN")
+            version = read_version(conn, "entries")
+
+            for (entry_id, mood_id) in conn.execute(ENTRY_MOODS):
+                moods[mood_id] = moods.get(mood_id, 0) | 1 << entry_id
+                entries[entry_id] = (mood_id, [])
+
+            for (entry_id, tag_id) in conn.execute(ENTRY_TAGS):
+                tags[tag_id] = tags.get(tag_id, 0) | 1 << entry_id
+                entries[entry_id][1].append(tag_id)
+
+        with self._lock:
+            self._tags = tags
+            self._moods = moods
+            self._entries = entries
+            self.version = version
+
+    def refresh(self):
+        """Rebuilds the index if the database has changed since it was built
+
+        It always reads the database file, not the read replica, so it
+        stays in step with the versions the write paths report.
+        """
+        with primary_connection() as conn:
+            if read_version(conn, "entries") != self.version:
+                self.rebuild(conn)
+
+    def apply(self, changes, version_before, version_after):
+        """Records a committed write
+
+        Args:
+            changes (list): (entry_id, mood_id, tag_ids) for every entry the
+                write touched, with the mood and tags the entry has now and
+                a mood_id of None for an entry that was deleted
+            version_before (number): the entries version before the write
+            version_after (number): the entries version after the write
+        """
+        with self._lock:
+            if self.version == version_after:
+                return
+
+            if self.version != version_before:
+                # Missed another write; rebuild on the next read
+                self.version = None
+                return
+
+            for (entry_id, mood_id, tag_ids) in changes:
+                bit = 1 << entry_id
+                previous = self._entries.pop(entry_id, None)
+
+                # Only the bitmaps this entry was in need its bit cleared
+                if previous is not None:
+                    (old_mood_id, old_tag_ids) = previous
+                    self._moods[old_mood_id] &= ~bit
+
+                    for tag_id in old_tag_ids:
+                        self._tags[tag_id] &= ~bit
+
+                if mood_id is not None:
+                    self._moods[mood_id] = self._moods.get(mood_id, 0) | bit
+
+                    for tag_id in tag_ids:
+                        self._tags[tag_id] = self._tags.get(tag_id, 0) | bit
+
+                    self._entries[entry_id] = (mood_id, list(tag_ids))
+
+            self.version = version_after
+
+    def select(self, tag_ids=None, match="all", mood_ids=None):
+        """Finds the entries with the given tags and moods
+
+        Args:
+            tag_ids (list): tag ids to look for
+            match (string): "all" for entries with every tag, "any" for
+                entries with at least one of them
+            mood_ids (list): mood ids, an entry matches when it has any of them
+
+        Returns:
+            number: a bitmap of the matching entry ids
+        """
+        self.refresh()
+
+        with self._lock:
+            bits = None
+
+            if tag_ids:
+                tag_bits = [self._tags.get(tag_id, 0) for tag_id in tag_ids]
+                bits = tag_bits[0]
+
+                for other in tag_bits[1:]:
+                    bits = bits & other if match == "all" else bits | other
+
+            if mood_ids:
+                mood_bits = 0
+
+                for mood_id in mood_ids:
+                    mood_bits |= self._moods.get(mood_id, 0)
+
+                bits = mood_bits if bits is None else bits & mood_bits
+
+        return bits or 0
+
+
+def bitmap_ids(bits, after=None, limit=None):
+    """Lists the entry ids set in a bitmap, in ascending order
+
+    Args:
+        bits (number): a bitmap from EntryIndex.select()
+        after (number): only list ids greater than this
+        limit (number): the most ids to list
+
+    Returns:
+        list: entry ids
+    """
+    start = (after or 0) + 1
+
+    if start >= bits.bit_length():
+        return []
+
+    # Drop the ids up to `after`, then take the lowest set bit until the
+    # page is full, so a short page doesn't walk the whole bitmap
+    bits = bits >> start << start
+    ids = []
+
+    while bits and (limit is None or len(ids) < limit):
+        lowest = bits & -bits
+        ids.append(lowest.bit_length() - 1)
+        bits ^= lowest
+
+    return ids
+
+
+entry_index = EntryIndex()
+
+
+def build_entry_index():
+    """Builds the index up front, e.g. at server startup
+    """
+    with primary_connection() as conn:
+        entry_index.rebuild(conn)
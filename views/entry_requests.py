@@ -1,136 +1,504 @@
+import re
 import sqlite3
 import json
-from models import Entries, Moods, Tags
 
+import config
+from models import Moods, Tags, to_json
+from database import get_connection, prepare, read_version, replica_changed, to_epoch
+from .cache import cached
+from .entry_index import bitmap_ids, entry_index
+from .write_queue import WriteQueue
 
 
-def get_all_entries():
-    # Open a connection to the database
-    with sqlite3.connect("./dailyjournal.sqlite3") as conn:
+# The fields a client can ask for with `fields=`, and the columns each
+# one needs. `mood` and `tags` are built from joined rows.
+ENTRY_FIELDS = {
+    "id": ["e.id"],
+    "concept": ["e.concept"],
+    "entry": ["e.entry"],
+    "date": ["e.date"],
+    "mood_id": ["e.mood_id"],
+    "mood": ["e.mood_id", "m.label mood_label"],
+    "tags": [],
+}
 
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
+# Largest page a client can ask for with `limit=`
+MAX_PAGE_SIZE = 1000
 
-        # Write the SQL query to get the information you want
-        db_cursor.execute("""
-        SELECT
-            e.id,
-            e.concept,
-            e.entry,
-            e.date,
-            e.mood_id,
-            m.label mood_label
-        FROM Entries e
-        JOIN Moods m
-            ON m.id = e.mood_id
-        """)
-
-        # Initialize an empty list to hold all animal representations
-        journal_entries = []
+# Fields every entry sent by a client must have; `tags` is optional in
+# bulk imports
+ENTRY_REQUIRED_FIELDS = ("concept", "entry", "date", "moodId")
 
-        # Convert rows of data into a Python list
-        dataset = db_cursor.fetchall()
 
-        # Iterate list of data returned from database
-        for row in dataset:
-            
-            rowId = row['id']
-            
-            db_cursor.execute("""
-            SELECT *
+# How many bytes of JSON stream_all_entries collects before handing
+# them to the server, so the socket isn't written once per entry
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _committed(changes, version_before, version_after):
+    """Brings the entry index and the read replica up to date after a
+    write has committed
+
+    The response cache needs nothing: the write bumped the entries version
+    its responses are stored under.
+
+    Args:
+        changes (list): (entry_id, mood_id, tag_ids) for every entry written
+        version_before (number): the entries version before the transaction
+        version_after (number): the entries version after it
+    """
+    entry_index.apply(changes, version_before, version_after)
+
+    # Copy the write to the read replica without waiting for its next check
+    replica_changed()
+
+
+# Set by start_write_queue() to group-commit writes from many requests
+_write_queue = None
+
+
+def start_write_queue(max_batch=None, max_delay=None):
+    """Sends create, update and delete through one writer thread that
+    commits them in batches; see views/write_queue.py
+
+    Args:
+        max_batch (number): most writes per transaction, defaults to
+            config.WRITE_QUEUE_MAX_BATCH
+        max_delay (number): seconds a write may wait for others to join
+            its batch, defaults to config.WRITE_QUEUE_MAX_DELAY
+    """
+    global _write_queue
+
+    _write_queue = WriteQueue(_committed,
+                              max_batch or config.WRITE_QUEUE_MAX_BATCH,
+                              config.WRITE_QUEUE_MAX_DELAY if max_delay is None else max_delay)
+
+
+def write_queue_stats():
+    """Returns the write queue's counters, or None when it isn't running
+    """
+    return _write_queue.stats() if _write_queue is not None else None
+
+
+def _run_write(operation, *args):
+    """Runs a write in its own transaction, or hands it to the write queue
+
+    Args:
+        operation (function): called as operation(conn, *args) inside a
+            transaction; returns (result, entry index changes)
+
+    Returns:
+        the operation's result
+    """
+    if _write_queue is not None:
+        return _write_queue.submit(operation, *args)
+
+    with get_connection() as conn:
+        # Hold the write lock so the versions read below bracket this write
+        conn.execute("BEGIN IMMEDIATE")
+        version_before = read_version(conn, "entries")
+
+        (result, changes) = operation(conn, *args)
+
+        version_after = read_version(conn, "entries")
+
+    _committed(changes, version_before, version_after)
+
+    return result
+
+
+def _iter_tags(db_cursor, after=None, entry_ids=None):
+    """Streams the tags of every entry after `after` in entry id order
+
+    Args:
+        db_cursor (sqlite3.Cursor): a cursor using the sqlite3.Row row factory
+        after (number): skip the tags of entries with this id or lower
+        entry_ids (list): only load the tags of these entries
+
+    Returns:
+        sqlite3.Cursor: rows of entry_id, id and name
+    """
+    if entry_ids is not None:
+        where = "et.entry_id IN (SELECT value FROM json_each(?))"
+        params = (json.dumps(entry_ids), )
+    else:
+        where = "et.entry_id > ?"
+        params = (after or 0, )
+
+    return db_cursor.execute(f"""
+    SELECT
+        et.entry_id,
+        t.id,
+        t.name
+    FROM Entrytags et
+    JOIN Tags t
+        ON t.id = et.tag_id
+    WHERE {where}
+    ORDER BY et.entry_id, et.tag_id
+    """, params)
+
+
+def _parse_fields(fields):
+    """Validates a `fields=` value such as "id,concept,date"
+
+    Returns:
+        list: the requested field names, always including id
+
+    Raises:
+        ValueError: when an unknown field is requested
+    """
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+
+    for name in names:
+        if name not in ENTRY_FIELDS:
+            raise ValueError(f"Unknown field: {name}")
+
+    # The id is the pagination cursor, so it's always returned
+    if "id" not in names:
+        names.insert(0, "id")
+
+    return names
+
+
+def _parse_date(value, name):
+    """Converts a `from=`/`to=` query parameter into a Unix timestamp
+
+    Raises:
+        ValueError: when the value isn't a date
+    """
+    epoch = to_epoch(value)
+
+    if epoch is None:
+        raise ValueError(f"{name} must be an ISO 8601 date or a Unix timestamp")
+
+    return epoch
+
+
+def _parse_ids(value, name):
+    """Converts a comma separated query parameter such as "1,3" into ids
+
+    Raises:
+        ValueError: when one of the values isn't a number
+    """
+    try:
+        return [int(id) for id in value.split(",") if id.strip()]
+    except ValueError as ex:
+        raise ValueError(f"{name} must be a comma separated list of ids") from ex
+
+
+def _iter_entries(limit=None, after=None, fields=None, **filters):
+    """Validates the listing parameters and returns a generator of the
+    entries' JSON documents ordered by id
+
+    Entries are read from the cursor one at a time instead of with
+    fetchall(). Whole entries are the documents stored in EntryDocuments,
+    sent as they are. For `fields=` the tags come from a second cursor
+    that is also ordered by entry id, and the two are walked side by side,
+    so the listing takes two queries and never holds more than one entry
+    in memory.
+
+    Tag and mood filters are answered by the in-memory entry index, and
+    only the matching ids are read from the database.
+
+    Raises:
+        ValueError: when limit, fields or the filters are not valid
+    """
+    if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    names = _parse_fields(fields) if fields else None
+
+    # Keyset cursor, plus the date range served by the date_epoch index
+    where = ["e.id > ?"]
+    params = [after or 0]
+
+    if filters.get("from") is not None:
+        where.append("e.date_epoch >= ?")
+        params.append(_parse_date(filters["from"], "from"))
+
+    if filters.get("to") is not None:
+        where.append("e.date_epoch < ?")
+        params.append(_parse_date(filters["to"], "to"))
+
+    entry_ids = None
+
+    if filters.get("tag_id") is not None or filters.get("mood_id") is not None:
+        match = filters.get("match") or "all"
+
+        if match not in ("all", "any"):
+            raise ValueError("match must be all or any")
+
+        bits = entry_index.select(_parse_ids(filters.get("tag_id") or "", "tag_id"),
+                                  match,
+                                  _parse_ids(filters.get("mood_id") or "", "mood_id"))
+
+        # Without a date range every candidate is returned, so only the
+        # page itself has to be read
+        has_dates = len(where) > 1
+        entry_ids = bitmap_ids(bits, after, None if has_dates else limit)
+
+        where.append("e.id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(entry_ids))
+
+    params.append(-1 if limit is None else limit)
+
+    # Only select the columns the requested fields need, so listing
+    # concepts doesn't read every entry body
+    if names is None:
+        columns = ["e.id", "d.document"]
+        source = """
             FROM Entries e
-            LEFT JOIN Entrytags et 
-                on et.entry_id = e.id
-            LEFT JOIN Tags t 
-                on t.id = et.tag_id
-            WHERE et.entry_id = ?
-            GROUP BY t.id
-            """, (rowId, ))
-            
-            data = db_cursor.fetchall()
-            
-            tags = []
-            
-            for current_tag in data:
-                tag = Tags(current_tag['id'], current_tag['name'])
-                
-                tags.append(tag.__dict__)
-
-            # Create an animal instance from the current row.
-            # Note that the database fields are specified in
-            # exact order of the parameters defined in the
-            # Animal class above.
-            journal_entry = Entries(row['id'], row['concept'], row['entry'], row['date'],
-                            row['mood_id'])
-
-            # Create a Location instance from the current row
-            mood = Moods(row['id'], row['mood_label'])
-
-            # Add the dictionary representation of the location to the animal
-            journal_entry.mood = mood.__dict__
-            
-            journal_entry.tags = tags
-
-            # Add the dictionary representation of the animal to the list
-            journal_entries.append(journal_entry.__dict__)
-
-    # Use `json` package to properly serialize list as JSON
-    return json.dumps(journal_entries)
-
-
-# Function with a single parameter
+            JOIN EntryDocuments d
+                ON d.entry_id = e.id
+        """
+    else:
+        columns = list(dict.fromkeys(
+            column for name in names for column in ENTRY_FIELDS[name]))
+        source = """
+            FROM Entries e
+            JOIN Moods m
+                ON m.id = e.mood_id
+        """
+
+    def generate():
+        # Open a connection to the database
+        with get_connection() as conn:
+
+            # Just use these. It's a Black Box.
+            conn.row_factory = sqlite3.Row
+            db_cursor = conn.cursor()
+
+            # Write the SQL query to get the information you want
+            db_cursor.execute(f"""
+            SELECT
+                {", ".join(columns)}
+            {source}
+            WHERE {" AND ".join(where)}
+            ORDER BY e.id
+            LIMIT ?
+            """, params)
+
+            # Stored documents already hold the mood and tags
+            if names is None:
+                for row in db_cursor:
+                    yield row['document']
+
+                return
+
+            # Load the tags in one query instead of running a separate
+            # query per entry row
+            if "tags" in names:
+                tag_rows = _iter_tags(conn.cursor(), after, entry_ids)
+            else:
+                tag_rows = iter(())
+
+            tag_row = next(tag_rows, None)
+
+            # Iterate the rows as the database returns them
+            for row in db_cursor:
+
+                # Skip tag rows of entries that no longer exist
+                while tag_row is not None and tag_row['entry_id'] < row['id']:
+                    tag_row = next(tag_rows, None)
+
+                tags = []
+
+                while tag_row is not None and tag_row['entry_id'] == row['id']:
+                    tag = Tags(tag_row['id'], tag_row['name'])
+                    tags.append(tag)
+                    tag_row = next(tag_rows, None)
+
+                # Only the requested columns were selected
+                yield to_json(_project(row, names, tags))
+
+    return generate()
+
+
+def get_all_entries(limit=None, after=None, fields=None, **filters):
+    """Lists journal entries ordered by id
+
+    Pages are keyset based: pass the id of the last entry of the previous
+    page as `after` to get the next one. A page shorter than `limit` is the
+    last page.
+
+    Args:
+        limit (number): the most entries to return, all of them by default
+        after (number): only return entries with a greater id
+        fields (string): comma separated fields to include, all by default
+        filters: the entry filters, named like their query parameters:
+            from: only entries dated at or after this ISO 8601 date or
+                Unix timestamp
+            to: only entries dated before this one
+            tag_id: comma separated tag ids
+            match: "all" (the default) for entries with every tag in
+                tag_id, "any" for entries with at least one
+            mood_id: comma separated mood ids, any of which matches
+
+    Raises:
+        ValueError: when limit, fields or the filters are not valid
+    """
+    # The documents are already JSON, so the list is put together as text
+    return "[" + ", ".join(_iter_entries(limit, after, fields, **filters)) + "]"
+
+
+def stream_all_entries(limit=None, after=None, fields=None, **filters):
+    """Lists journal entries like get_all_entries, but as a generator of
+    JSON text pieces that can be sent while the database is still being read
+
+    The parameters are checked before anything is returned, so bad values
+    raise ValueError before the response is started.
+
+    Raises:
+        ValueError: when limit, fields or the filters are not valid
+    """
+    journal_entries = _iter_entries(limit, after, fields, **filters)
+
+    def generate():
+        pieces = ["["]
+        size = 1
+
+        for (index, piece) in enumerate(journal_entries):
+            if index:
+                piece = ", " + piece
+
+            pieces.append(piece)
+            size += len(piece)
+
+            if size >= STREAM_CHUNK_SIZE:
+                yield "".join(pieces)
+                pieces = []
+                size = 0
+
+        pieces.append("]")
+        yield "".join(pieces)
+
+    return generate()
+
+
+def _project(row, names, tags):
+    """Builds the dictionary for one entry with only the requested fields
+    """
+    journal_entry = {}
+
+    for name in names:
+        if name == "mood":
+            journal_entry["mood"] = Moods(row['mood_id'], row['mood_label'])
+        elif name == "tags":
+            journal_entry["tags"] = tags
+        else:
+            journal_entry[name] = row[name]
+
+    return journal_entry
+
+
+def _load_documents(conn, ids):
+    """Reads the stored JSON documents of the entries with the given ids
+
+    Args:
+        conn (sqlite3.Connection): the connection to read with
+        ids (list): the entry ids
+
+    Returns:
+        dict: JSON text by entry id; missing ids are left out
+    """
+    # The ids are passed as one JSON array, so the statement is the same
+    # however many there are
+    rows = conn.execute("""
+    SELECT
+        d.entry_id,
+        d.document
+    FROM EntryDocuments d
+    WHERE d.entry_id IN (SELECT value FROM json_each(?))
+    """, (json.dumps(ids), )).fetchall()
+
+    return {entry_id: document for (entry_id, document) in rows}
+
+
+@prepare
+def _prepare_documents(conn):
+    # Single entries, ?ids= and the change feed all look documents up by id
+    _load_documents(conn, [])
+
+
+@cached("entries")
 def get_single_entry(id):
-    with sqlite3.connect("./dailyjournal.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
+    with get_connection() as conn:
+        # No entry with that id gives None, and the caller answers 404
+        return _load_documents(conn, [id]).get(id)
 
-        # Use a ? parameter to inject a variable's value
-        # into the SQL statement.
-        db_cursor.execute("""
-        SELECT
-            e.id,
-            e.concept,
-            e.entry,
-            e.date,
-            e.mood_id,
-            m.label mood_label
-        FROM Entries e
-        JOIN Moods m
-            ON m.id = e.mood_id
-        WHERE e.id = ?    
-        """, ( id, ))
-
-        # Load the single result into memory
-        data = db_cursor.fetchone()
-
-        # Create an animal instance from the current row
-        journal_entry = Entries(data['id'], data['concept'], data['entry'], data['date'],
-                            data['mood_id'])
-        
-        mood = Moods(data['id'], data['mood_label'])
-
-        journal_entry.mood = mood.__dict__
-
-    # Use `json` package to properly serialize list as JSON
-    return json.dumps(journal_entry.__dict__)
+
+def get_entries_by_ids(ids):
+    """Reads many entries at once, for GET /entries?ids=1,2,3
+
+    Args:
+        ids (list): the entry ids, at most MAX_PAGE_SIZE of them
+
+    Returns:
+        string: JSON array of the entries in the order they were asked
+        for, with their moods and tags; unknown ids are left out
+
+    Raises:
+        ValueError: when more than MAX_PAGE_SIZE ids are asked for
+    """
+    if len(ids) > MAX_PAGE_SIZE:
+        raise ValueError(f"At most {MAX_PAGE_SIZE} ids can be requested at once")
+
+    with get_connection() as conn:
+        documents = _load_documents(conn, ids)
+
+    # An id asked for twice is only returned once
+    return "[" + ", ".join([documents[id] for id in dict.fromkeys(ids)
+                            if id in documents]) + "]"
     
     
     
+def _delete_entry(conn, id):
+    """Deletes an entry inside the caller's transaction
+
+    Returns:
+        tuple: (None, the entry index changes)
+    """
+    db_cursor = conn.cursor()
+
+    db_cursor.execute("""
+    DELETE FROM ENTRIES
+    WHERE id = ?
+    """, (id, ))    
+
+    # Its tag links would otherwise be left behind
+    db_cursor.execute("""
+    DELETE FROM Entrytags
+    WHERE entry_id = ?
+    """, (id, ))
+
+    return (None, [(id, None, [])])
+
+
 def delete_entry(id):
-    with sqlite3.connect("./dailyjournal.sqlite3") as conn:
-        db_cursor = conn.cursor()
+    _run_write(_delete_entry, id)
+
+
+def _to_match_query(searchTerm):
+    """Turns free text from the client into an FTS5 MATCH expression
+
+    Every word becomes a quoted prefix query, so punctuation in the search
+    box can't break the FTS5 syntax and "pyth" still finds "Python".
+    Entries must contain all of the words.
+    """
+    words = re.findall(r"\w+", searchTerm)
+
+    return " ".join(f'"{word}"*' for word in words)
 
-        db_cursor.execute("""
-        DELETE FROM ENTRIES
-        WHERE id = ?
-        """, (id, ))    
-        
-        
 
 def search_entries(searchTerm):
+    match_query = _to_match_query(searchTerm)
+
+    # Nothing searchable, e.g. the client only sent punctuation
+    if not match_query:
+        return json.dumps([])
+
     # Open a connection to the database
-    with sqlite3.connect("./dailyjournal.sqlite3") as conn:
+    with get_connection() as conn:
 
         # Just use these. It's a Black Box.
         conn.row_factory = sqlite3.Row
@@ -139,120 +507,358 @@ def search_entries(searchTerm):
         # Write the SQL query to get the information you want
         db_cursor.execute("""
         SELECT
-            e.id,
-            e.concept,
-            e.entry,
-            e.date,
-            e.mood_id,
-            m.label mood_label
-        FROM Entries e
-        JOIN Moods m
-            ON m.id = e.mood_id
-        WHERE e.entry LIKE ?    
-        """, ('%' + searchTerm + '%', ))
-
-        # Initialize an empty list to hold all animal representations
-        journal_entries = []
+            d.document,
+            snippet(EntriesSearch, -1, '<mark>', '</mark>', '…', 16) snippet
+        FROM EntriesSearch s
+        JOIN EntryDocuments d
+            ON d.entry_id = s.rowid
+        WHERE EntriesSearch MATCH ?
+        ORDER BY bm25(EntriesSearch, 2.0, 1.0)
+        """, (match_query, ))
 
         # Convert rows of data into a Python list
         dataset = db_cursor.fetchall()
 
-        # Iterate list of data returned from database
-        for row in dataset:
+    # The snippet is the matching part of the entry with the search
+    # words highlighted. It's added as the last field of the stored
+    # document.
+    journal_entries = [row['document'][:-1] + ', "snippet": ' + to_json(row['snippet']) + "}"
+                       for row in dataset]
+
+    return "[" + ", ".join(journal_entries) + "]"
+
+
+
+def _check_entry(new_entry, name, required=ENTRY_REQUIRED_FIELDS):
+    """Checks an entry sent by the client before anything is written
+
+    Args:
+        new_entry: the decoded JSON of the entry
+        name (string): how the entry is called in the error, e.g. "Entry 3"
+        required (tuple): the fields it must have
 
-            # Create an animal instance from the current row.
-            # Note that the database fields are specified in
-            # exact order of the parameters defined in the
-            # Animal class above.
-            journal_entry = Entries(row['id'], row['concept'], row['entry'], row['date'],
-                            row['mood_id'])
+    Raises:
+        ValueError: when it isn't an object, lacks a field or has tags
+            that aren't a list of ids
+    """
+    if not isinstance(new_entry, dict):
+        raise ValueError(f"{name} must be a JSON object")
 
-            # Create a Location instance from the current row
-            mood = Moods(row['id'], row['mood_label'])
+    missing = [field for field in required if field not in new_entry]
 
-            # Add the dictionary representation of the location to the animal
-            journal_entry.mood = mood.__dict__
+    if missing:
+        raise ValueError(f"{name} is missing {', '.join(missing)}")
 
-            # Add the dictionary representation of the animal to the list
-            journal_entries.append(journal_entry.__dict__)
+    tags = new_entry.get('tags', [])
 
-    # Use `json` package to properly serialize list as JSON
-    return json.dumps(journal_entries)  
+    if not isinstance(tags, list) or not all(isinstance(tag, int) for tag in tags):
+        raise ValueError(f"{name} has tags that aren't a list of tag ids")
 
 
+def _create_journal_entry(conn, new_entry):
+    """Inserts an entry and its tags inside the caller's transaction
+
+    Returns:
+        tuple: (the JSON response, the entry index changes)
+    """
+    db_cursor = conn.cursor()
+
+    db_cursor.execute("""
+    INSERT INTO Entries
+        ( concept, entry, date, mood_id, date_epoch )
+    VALUES
+        ( ?, ?, ?, ?, ? );
+    """, (new_entry['concept'], new_entry['entry'],
+          new_entry['date'], new_entry['moodId'],
+          to_epoch(new_entry['date']), ))
+
+    # The `lastrowid` property on the cursor will return
+    # the primary key of the last thing that got added to
+    # the database.
+    id = db_cursor.lastrowid
+
+    # Add the `id` property to the animal dictionary that
+    # was sent by the client so that the client sees the
+    # primary key in the response.
+    new_entry['id'] = id
+    
+    # A tag sent twice is only linked once
+    entry_tags = list(dict.fromkeys(new_entry['tags']))
+
+    db_cursor.executemany("""
+    INSERT INTO Entrytags
+        (entry_id, tag_id)
+    VALUES
+        (?, ?);
+    """, [(id, tag) for tag in entry_tags])
+
+    return (json.dumps(new_entry), [(id, new_entry['moodId'], entry_tags)])
+
 
 def create_journal_entry(new_entry):
-    with sqlite3.connect("./dailyjournal.sqlite3") as conn:
-        db_cursor = conn.cursor()
+    """Saves a new entry and links its tags
 
-        db_cursor.execute("""
-        INSERT INTO Entries
-            ( concept, entry, date, mood_id )
-        VALUES
-            ( ?, ?, ?, ? );
-        """, (new_entry['concept'], new_entry['entry'],
-              new_entry['date'], new_entry['moodId'], ))
-
-        # The `lastrowid` property on the cursor will return
-        # the primary key of the last thing that got added to
-        # the database.
-        id = db_cursor.lastrowid
-
-        # Add the `id` property to the animal dictionary that
-        # was sent by the client so that the client sees the
-        # primary key in the response.
-        new_entry['id'] = id
-        
-        entry_tags = []
-
-        for tag in new_entry['tags']:
-            db_cursor.execute("""
-            INSERT INTO Entrytags
-                (entry_id, tag_id)
-            VALUES
-                (?, ?);
-            """, (id, tag))
-            
-            entry_tags.append(tag)
+    Raises:
+        ValueError: when the entry isn't an object or is missing a field
+    """
+    _check_entry(new_entry, "The entry", ENTRY_REQUIRED_FIELDS + ("tags", ))
 
-    return json.dumps(new_entry)       
+    return _run_write(_create_journal_entry, new_entry)
 
 
+def create_journal_entries(new_entries, batch_size=None):
+    """Inserts many entries and their tags in a single transaction
 
-def update_entry(id, new_entry):
-    with sqlite3.connect("./dailyjournal.sqlite3") as conn:
+    Entries are inserted in batches with executemany(). Either every entry
+    is saved or, when one of them is invalid, none of them are. The
+    entries are all read and checked before the transaction starts, so
+    the write lock is only held for the inserts.
+
+    Args:
+        new_entries (iterable): entry dictionaries shaped like the body of
+            POST /entries; a generator works, so NDJSON is parsed line by
+            line as it arrives
+        batch_size (number): entries per executemany() call, defaults to
+            config.BULK_BATCH_SIZE
+
+    Returns:
+        string: JSON with the number of entries created and their ids, in
+        the order they were sent
+
+    Raises:
+        ValueError: when an entry isn't an object or is missing a field;
+            nothing is saved
+    """
+    batch_size = batch_size or config.BULK_BATCH_SIZE
+
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+
+    rows = []
+    entry_tags = []
+
+    # Read and check the whole body before taking the write lock, so a
+    # slow upload doesn't keep every other writer waiting on it
+    for new_entry in new_entries:
+        _check_entry(new_entry, f"Entry {len(rows) + 1}")
+
+        rows.append((new_entry['concept'], new_entry['entry'],
+                     new_entry['date'], new_entry['moodId'],
+                     to_epoch(new_entry['date'])))
+
+        # A tag sent twice for one entry is only linked once
+        entry_tags.append(list(dict.fromkeys(new_entry.get('tags', []))))
+
+    ids = []
+
+    with get_connection() as conn:
         db_cursor = conn.cursor()
 
-        db_cursor.execute("""
-        UPDATE Entries
-            SET
-                concept = ?,
-                entry = ?,
-                date = ?,
-                mood_id = ?
-        WHERE id = ?
-        """, (new_entry['concept'], new_entry['entry'],
-              new_entry['date'], new_entry['moodId'], id, ))
-
-        # Were any rows affected?
-        # Did the client send an `id` that exists?
-        rows_affected = db_cursor.rowcount
-        
-        entry_tags = []
-        
-        for tag in new_entry['tags']:
+        # Take the write lock up front. While it's held nobody else can
+        # insert entries, so the ids of a batch are known in advance.
+        db_cursor.execute("BEGIN IMMEDIATE")
+        version_before = read_version(conn, "entries")
+        changes = []
+
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            batch_tags = entry_tags[start:start + batch_size]
+
+            # AUTOINCREMENT hands out the ids after the highest one ever used
             db_cursor.execute("""
+            SELECT MAX(
+                IFNULL((SELECT seq FROM sqlite_sequence WHERE name = 'Entries'), 0),
+                IFNULL((SELECT MAX(id) FROM Entries), 0)
+            )
+            """)
+            last_id = db_cursor.fetchone()[0]
+
+            db_cursor.executemany("""
+            INSERT INTO Entries
+                ( concept, entry, date, mood_id, date_epoch )
+            VALUES
+                ( ?, ?, ?, ?, ? );
+            """, batch)
+
+            batch_ids = list(range(last_id + 1, last_id + 1 + len(batch)))
+
+            db_cursor.executemany("""
             INSERT INTO Entrytags
                 (entry_id, tag_id)
             VALUES
                 (?, ?);
-            """, (id, tag))  
-            
-            entry_tags.append(tag)      
+            """, [(id, tag)
+                  for (id, tags) in zip(batch_ids, batch_tags)
+                  for tag in tags])
+
+            ids.extend(batch_ids)
+            changes.extend((id, row[3], tags)
+                           for (id, row, tags) in zip(batch_ids, batch, batch_tags))
+
+        version_after = read_version(conn, "entries")
+
+    # A lookup of one of these ids before it existed may have been cached
+    _committed(changes, version_before, version_after)
+
+    return json.dumps({"count": len(ids), "ids": ids})
+
+
+def get_entry_changes(since=0, limit=None):
+    """Lists what happened to entries after a version of the change log,
+    for GET /entries/changes?since=
+
+    A client mirroring the journal starts with since=0, which returns
+    every entry, then passes the `next` of each response back as `since`.
+    Each entry appears at most once, with its latest state; deleted
+    entries come back as tombstones with "deleted": true.
+
+    Args:
+        since (number): the change log version the client has synced to
+        limit (number): most changes to return, at most MAX_PAGE_SIZE
+
+    Returns:
+        string: JSON object with `changes`, the `next` version to ask for
+        and `more` when there are changes after this page, or None when
+        `since` is older than the tombstones still kept (the client has to
+        sync from 0 again)
+
+    Raises:
+        ValueError: when the limit is not valid
+    """
+    limit = MAX_PAGE_SIZE if limit is None else limit
+
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    with get_connection() as conn:
+        # Read the log and the entries from the same snapshot
+        conn.execute("BEGIN")
+
+        horizon = conn.execute("SELECT h.version FROM EntryChangesHorizon h").fetchone()[0]
+
+        # A fresh mirror has nothing to delete, so it can't miss a tombstone
+        if 0 < since < horizon:
+            return None
+
+        rows = conn.execute("""
+        SELECT
+            c.version,
+            c.entry_id,
+            c.deleted
+        FROM EntryChanges c
+        WHERE c.version > ?
+        ORDER BY c.version
+        LIMIT ?
+        """, (since, limit + 1)).fetchall()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+
+        documents = _load_documents(conn, [row[1] for row in rows if not row[2]])
+
+    # The stored documents are spliced in as they are
+    changes = [f'{{"version": {version:d}, "id": {entry_id:d}, '
+               f'"deleted": {"true" if deleted else "false"}, '
+               f'"entry": {documents.get(entry_id, "null")}}}'
+               for (version, entry_id, deleted) in rows]
+
+    return (f'{{"changes": [{", ".join(changes)}], '
+            f'"next": {rows[-1][0] if rows else since:d}, "more": {"true" if more else "false"}}}')
+
+
+def export_entries():
+    """Streams every entry, with its mood and tags, as NDJSON
+
+    Returns:
+        generator: pieces of text holding one JSON entry per line
+    """
+    journal_entries = _iter_entries()
+
+    def generate():
+        pieces = []
+        size = 0
+
+        for journal_entry in journal_entries:
+            piece = journal_entry + "\n"
+            pieces.append(piece)
+            size += len(piece)
+
+            if size >= STREAM_CHUNK_SIZE:
+                yield "".join(pieces)
+                pieces = []
+                size = 0
+
+        yield "".join(pieces)
+
+    return generate()
+
+
+def _update_entry(conn, id, new_entry):
+    """Updates an entry and syncs its tags inside the caller's transaction
+
+    Returns:
+        tuple: (whether the entry exists, the entry index changes)
+    """
+    db_cursor = conn.cursor()
+
+    db_cursor.execute("""
+    UPDATE Entries
+        SET
+            concept = ?,
+            entry = ?,
+            date = ?,
+            mood_id = ?,
+            date_epoch = ?
+    WHERE id = ?
+    """, (new_entry['concept'], new_entry['entry'],
+          new_entry['date'], new_entry['moodId'],
+          to_epoch(new_entry['date']), id, ))
+
+    # Were any rows affected?
+    # Did the client send an `id` that exists?
+    rows_affected = db_cursor.rowcount
 
     if rows_affected == 0:
         # Forces 404 response by main module
-        return False
-    else:
-        # Forces 204 response by main module
-        return True 
\ No newline at end of file
+        return (False, [(id, None, [])])
+
+    tag_ids = list(dict.fromkeys(new_entry['tags']))
+
+    # Only touch the links that change, so sending the same tags
+    # again writes nothing to Entrytags
+    db_cursor.execute("""
+    SELECT et.tag_id
+    FROM Entrytags et
+    WHERE et.entry_id = ?
+    """, (id, ))
+    current = {row[0] for row in db_cursor.fetchall()}
+    wanted = set(tag_ids)
+
+    db_cursor.executemany("""
+    DELETE FROM Entrytags
+    WHERE entry_id = ? AND tag_id = ?
+    """, [(id, tag) for tag in current - wanted])
+
+    db_cursor.executemany("""
+    INSERT INTO Entrytags
+        (entry_id, tag_id)
+    VALUES
+        (?, ?);
+    """, [(id, tag) for tag in tag_ids if tag not in current])
+
+    # Forces 204 response by main module
+    return (True, [(id, new_entry['moodId'], tag_ids)])
+
+
+def update_entry(id, new_entry):
+    """Replaces an entry and syncs its tags
+
+    Returns:
+        boolean: whether the entry exists
+
+    Raises:
+        ValueError: when the entry isn't an object or is missing a field
+    """
+    _check_entry(new_entry, "The entry", ENTRY_REQUIRED_FIELDS + ("tags", ))
+
+    return _run_write(_update_entry, id, new_entry)
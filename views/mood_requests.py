@@ -1,11 +1,13 @@
 import sqlite3
-import json
-from models import Moods
+from models import Moods, to_json
+from database import get_connection
+from .cache import cached
 
 
+@cached("moods")
 def get_all_moods():
     # Open a connection to the database
-    with sqlite3.connect("./dailyjournal.sqlite3") as conn:
+    with get_connection() as conn:
 
         # Just use these. It's a Black Box.
         conn.row_factory = sqlite3.Row
@@ -40,8 +42,8 @@ def get_all_moods():
             # Add the dictionary representation of the location to the animal
 #            journal_entry.mood = mood.__dict__
 
-            # Add the dictionary representation of the animal to the list
-            moods.append(mood.__dict__)
+            # Add the animal to the list
+            moods.append(mood)
 
-    # Use `json` package to properly serialize list as JSON
-    return json.dumps(moods)
\ No newline at end of file
+    # Serialize the list of models straight to JSON
+    return to_json(moods)
\ No newline at end of file
@@ -0,0 +1,80 @@
+import sqlite3
+import json
+from database import get_connection, to_epoch
+
+
+# strftime() formats that group timestamps into each period
+PERIODS = {
+    "day": "%Y-%m-%d",
+    "week": "%Y-W%W",
+    "month": "%Y-%m",
+}
+
+
+def get_entry_stats(period="day", date_from=None, date_to=None):
+    """Counts entries per period, and per mood in each period
+
+    The grouping happens in SQL over the indexed date_epoch column, so no
+    entry rows are loaded into Python. Entries whose date couldn't be
+    parsed are left out.
+
+    Args:
+        period (string): day, week or month
+        date_from (string): only count entries dated at or after this
+            ISO 8601 date or Unix timestamp
+        date_to (string): only count entries dated before this one
+
+    Raises:
+        ValueError: when the period or the dates are not valid
+    """
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+
+    where = ["e.date_epoch IS NOT NULL"]
+    params = [PERIODS[period]]
+
+    for (name, value, comparison) in (("from", date_from, ">="), ("to", date_to, "<")):
+        if value is None:
+            continue
+
+        epoch = to_epoch(value)
+
+        if epoch is None:
+            raise ValueError(f"{name} must be an ISO 8601 date or a Unix timestamp")
+
+        where.append(f"e.date_epoch {comparison} ?")
+        params.append(epoch)
+
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        db_cursor = conn.cursor()
+
+        db_cursor.execute(f"""
+        SELECT
+            strftime(?, e.date_epoch, 'unixepoch') period,
+            COUNT(*) entries
+        FROM Entries e
+        WHERE {" AND ".join(where)}
+        GROUP BY period
+        ORDER BY period
+        """, params)
+
+        entries = [dict(row) for row in db_cursor.fetchall()]
+
+        db_cursor.execute(f"""
+        SELECT
+            strftime(?, e.date_epoch, 'unixepoch') period,
+            m.id mood_id,
+            m.label,
+            COUNT(*) entries
+        FROM Entries e
+        JOIN Moods m
+            ON m.id = e.mood_id
+        WHERE {" AND ".join(where)}
+        GROUP BY period, m.id
+        ORDER BY period, m.id
+        """, params)
+
+        moods = [dict(row) for row in db_cursor.fetchall()]
+
+    return json.dumps({"period": period, "entries": entries, "moods": moods})
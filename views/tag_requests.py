@@ -1,9 +1,17 @@
-from models import Tags
-import sqlite3
 import json
+import sqlite3
+
+from models import Tags, to_json
+from database import get_connection
+from .cache import cached
+
+# Most tags GET /tags?ids= returns at once
+MAX_IDS = 1000
+
 
+@cached("tags")
 def get_all_tags():
-    with sqlite3.connect("./dailyjournal.sqlite3") as conn:
+    with get_connection() as conn:
         conn.row_factory = sqlite3.Row
         db_cursor = conn.cursor()
         
@@ -21,11 +29,12 @@ def get_all_tags():
         for row in dataset:
             tag = Tags(row['id'], row['name'])
             
-            tags.append(tag.__dict__)
-    return json.dumps(tags)
+            tags.append(tag)
+    return to_json(tags)
 
+@cached("tags")
 def get_single_tag(id):
-    with sqlite3.connect("./dailyjournal.sqlite3") as conn:
+    with get_connection() as conn:
         conn.row_factory = sqlite3.Row
         db_cursor = conn.cursor()
         
@@ -38,7 +47,44 @@ def get_single_tag(id):
         """, (id, ))
         
         data = db_cursor.fetchone()
+
+        # No tag with that id; the caller answers 404
+        if data is None:
+            return None
         
         tag = Tags(data['id'], data['name'])
         
-    return json.dumps(tag.__dict__)
\ No newline at end of file
+    return to_json(tag)
+
+def get_tags_by_ids(ids):
+    """Reads many tags in one query, for GET /tags?ids=1,2,3
+
+    Args:
+        ids (list): the tag ids, at most MAX_IDS of them
+
+    Returns:
+        string: JSON array of the tags in the order they were asked for;
+        unknown ids are left out
+
+    Raises:
+        ValueError: when more than MAX_IDS ids are asked for
+    """
+    if len(ids) > MAX_IDS:
+        raise ValueError(f"At most {MAX_IDS} ids can be requested at once")
+
+    with get_connection() as conn:
+        conn.row_factory = sqlite3.Row
+        db_cursor = conn.cursor()
+
+        db_cursor.execute("""
+        SELECT
+            t.id,
+            t.name
+        FROM Tags t
+        WHERE t.id IN (SELECT value FROM json_each(?))
+        """, (json.dumps(ids), ))
+
+        tags = {row['id']: Tags(row['id'], row['name']) for row in db_cursor.fetchall()}
+
+    # A tag asked for twice is only returned once
+    return to_json([tags[id] for id in dict.fromkeys(ids) if id in tags])
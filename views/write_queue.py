@@ -0,0 +1,155 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from database import get_connection, read_version
+
+
+class WriteQueue():
+    """One writer thread that commits the writes of many requests together
+
+    Each write in WAL mode ends with a commit that waits for the disk, and
+    SQLite only lets one connection write at a time, so concurrent writers
+    mostly queue up on the lock and fsync one after the other. Here
+    request threads hand their write to a queue instead. The writer takes
+    up to `max_batch` of them, waiting at most `max_delay` seconds for
+    more to arrive after the first, runs them in one transaction and
+    commits once for the whole batch.
+
+    Every write runs inside its own SAVEPOINT, so one that fails is rolled
+    back on its own and its request gets the exception while the rest of
+    the batch still commits. A request's call returns only after the batch
+    holding its write has committed.
+    """
+
+    def __init__(self, on_commit, max_batch, max_delay):
+        """
+        Args:
+            on_commit (function): called as on_commit(changes, version_before,
+                version_after) after each batch commits, with the entry index
+                changes of every write that succeeded
+            max_batch (number): most writes per transaction
+            max_delay (number): seconds to wait for a batch to fill up
+        """
+        self.on_commit = on_commit
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stats = {"writes": 0, "failed": 0, "batches": 0}
+
+    def _ensure_started(self):
+        # Threads don't survive fork(), so each prefork worker starts its own
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, name="write-queue", daemon=True).start()
+                self._pid = os.getpid()
+
+    def submit(self, operation, *args):
+        """Queues a write and waits for the batch holding it to commit
+
+        Args:
+            operation (function): called as operation(conn, *args) inside the
+                batch's transaction; returns (result, entry index changes)
+
+        Returns:
+            the operation's result
+
+        Raises:
+            Exception: whatever the operation or the commit raised
+        """
+        self._ensure_started()
+
+        future = Future()
+        self._queue.put((future, operation, args))
+
+        return future.result()
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Still take whatever arrived while waiting
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+
+            try:
+                self._commit(batch)
+            except Exception as error:
+                # BEGIN or COMMIT failed, so none of the batch was written
+                for (future, _, _) in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+                with self._lock:
+                    self._stats["failed"] += len(batch)
+
+    def _commit(self, batch):
+        results = []
+        changes = []
+
+        with get_connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            version_before = read_version(conn, "entries")
+
+            for (future, operation, args) in batch:
+                conn.execute("SAVEPOINT write")
+
+                try:
+                    (result, write_changes) = operation(conn, *args)
+                except Exception as error:
+                    conn.execute("ROLLBACK TO write")
+                    conn.execute("RELEASE write")
+                    future.set_exception(error)
+                    continue
+
+                conn.execute("RELEASE write")
+                results.append((future, result))
+                changes.extend(write_changes)
+
+            version_after = read_version(conn, "entries")
+
+        self.on_commit(changes, version_before, version_after)
+
+        with self._lock:
+            self._stats["writes"] += len(results)
+            self._stats["failed"] += len(batch) - len(results)
+            self._stats["batches"] += 1
+
+        for (future, result) in results:
+            future.set_result(result)
+
+    def stats(self):
+        """Returns the writer's counters
+
+        Returns:
+            dict: writes committed, writes failed, batches committed and
+            the average batch size
+        """
+        with self._lock:
+            stats = dict(self._stats)
+
+        stats["average_batch"] = stats["writes"] / stats["batches"] if stats["batches"] else 0.0
+
+        return stats